@@ -4,6 +4,20 @@ from swane.utils.fsl_conflict_handler import fsl_conflict_check
 def main():
     import sys
     import os
+
+    # Diagnostic: report the modules that slow down the application startup
+    if "--import-time" in sys.argv:
+        from swane.utils.import_time_report import import_time_report
+
+        print(import_time_report())
+        return
+
+    # Dependency probes run in background while the GUI modules are imported.
+    # nipype and pydicom are imported by the modules only where they are used
+    from swane.utils.DependencyManager import DependencyManager
+
+    DependencyManager.start_probes()
+
     from swane import strings
     import swane_supplement
     from PySide6.QtWidgets import QApplication, QMessageBox
@@ -1,9 +1,12 @@
+import io
 import configparser
+import threading
 from configparser import SectionProxy
 from typing import Literal, cast
 
 from swane import strings, __version__
 from swane.config.preference_list import *
+from swane.config.PreferenceSnapshot import PreferenceSnapshot
 from swane.utils.CryptographyManager import CryptographyManager
 from swane.utils.DataInputList import DataInputList
 from enum import Enum
@@ -15,6 +18,10 @@ class ConfigManager(configparser.ConfigParser):
 
     VALIDATION_SUFFIX = "_validation"
 
+    # Read-only global configurations shared by subject configurations, by file path
+    _global_snapshots: dict = {}
+    _global_snapshots_lock = threading.Lock()
+
     # Overrides to accept non-str stringable object as section keys
     def __getitem__(
         self, key: str | DataInputList | GlobalPrefCategoryList
@@ -24,7 +31,12 @@ class ConfigManager(configparser.ConfigParser):
     def __setitem__(self, key, value):
         super().__setitem__(str(key), value)
 
-    def __init__(self, subject_folder: str = None, global_base_folder: str = None):
+    def __init__(
+        self,
+        subject_folder: str = None,
+        global_base_folder: str = None,
+        read_only: bool = False,
+    ):
         """
         Parameters
         ----------
@@ -32,25 +44,34 @@ class ConfigManager(configparser.ConfigParser):
             The subject folder path. None in global all configuration
         global_base_folder: path, optional
             An alternative folder for global configuration file. Default is None
+        read_only: bool, optional
+            If True, the configuration is never saved and cannot be changed. Default is False
         """
         super(ConfigManager, self).__init__()
         self._section_defaults = {}
+        self._read_only = read_only
+        self._frozen = False
+        # Content of the config file as last read or written, to skip unchanged saves
+        self._saved_text = None
 
         # First set some internal values differentiating global from subject pref objects
+        self.global_base_folder = global_base_folder
         if subject_folder is not None:
             self.global_config = False
             self.config_file = os.path.abspath(os.path.join(subject_folder, ".config"))
         else:
-            if global_base_folder is None or not os.path.exists(global_base_folder):
-                global_base_folder = os.path.expanduser("~")
             self.global_config = True
-            self.config_file = os.path.abspath(
-                os.path.join(global_base_folder, "." + strings.APPNAME)
-            )
+            self.config_file = ConfigManager.global_config_file(global_base_folder)
 
         # Load default pref from pref list
         self._load_defaults(save=False)
 
+        try:
+            with open(self.config_file, encoding="utf-8") as file:
+                self._saved_text = file.read()
+        except OSError:
+            pass
+
         # check if this version need pref reset
         force_pref_reset = self.getboolean_safe(
             GlobalPrefCategoryList.MAIN, "force_pref_reset"
@@ -62,7 +83,7 @@ class ConfigManager(configparser.ConfigParser):
             try:
                 # main.last_swane_version should exist in both global and  subject config file
                 temp_config = configparser.ConfigParser()
-                temp_config.read(self.config_file)
+                temp_config.read_string(self._saved_text)
                 last_swane_version = temp_config[str(GlobalPrefCategoryList.MAIN)][
                     "last_swane_version"
                 ]
@@ -72,8 +93,8 @@ class ConfigManager(configparser.ConfigParser):
                 # otherwise assume outdated version
                 reset_pref = True
 
-        if not reset_pref and os.path.exists(self.config_file):
-            self.read(self.config_file)
+        if not reset_pref and self._saved_text is not None:
+            self.read_string(self._saved_text, source=self.config_file)
             # Cycle all read values and reassign them to invoke validate_type without rewriting read method
             for section in self._section_defaults.keys():
                 for option in self._section_defaults[section].keys():
@@ -91,13 +112,103 @@ class ConfigManager(configparser.ConfigParser):
                 self[GlobalPrefCategoryList.MAIN] = {}
             self[GlobalPrefCategoryList.MAIN]["last_swane_version"] = __version__
 
+        # Written only if validation or a new version changed something
         self.save()
+        self._frozen = read_only
+
+    @staticmethod
+    def global_config_file(global_base_folder: str = None) -> str:
+        """
+        Returns
+        -------
+        The path of the global configuration file
+        """
+        if global_base_folder is None or not os.path.exists(global_base_folder):
+            global_base_folder = os.path.expanduser("~")
+        return os.path.abspath(os.path.join(global_base_folder, "." + strings.APPNAME))
+
+    @staticmethod
+    def global_snapshot(global_base_folder: str = None) -> "ConfigManager":
+        """
+        Returns the read-only global configuration shared by the subject configurations.
+        It is parsed once per process and again only if its file changes.
+
+        Parameters
+        ----------
+        global_base_folder: path, optional
+            An alternative folder for global configuration file. Default is None
+
+        Returns
+        -------
+        A read-only global ConfigManager
+        """
+        config_file = ConfigManager.global_config_file(global_base_folder)
+        try:
+            stat = os.stat(config_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+
+        with ConfigManager._global_snapshots_lock:
+            cached = ConfigManager._global_snapshots.get(config_file)
+            if cached is None or cached[0] != signature:
+                cached = (
+                    signature,
+                    ConfigManager(
+                        global_base_folder=global_base_folder, read_only=True
+                    ),
+                )
+                ConfigManager._global_snapshots[config_file] = cached
+            return cached[1]
+
+    @staticmethod
+    def from_text(
+        text: str, subject_folder: str = None, global_base_folder: str = None
+    ) -> "ConfigManager":
+        """
+        Returns a configuration with the preferences of a to_text() output, eg. to rebuild
+        a workflow in another process. The configuration can be changed but is never saved.
+
+        Parameters
+        ----------
+        text: str
+            The preferences in config file format
+        subject_folder: path, optional
+            The subject folder path. None in global configuration
+        global_base_folder: path, optional
+            An alternative folder for global configuration file. Default is None
+
+        Returns
+        -------
+        A ConfigManager that is never saved
+        """
+        config = ConfigManager(
+            subject_folder=subject_folder,
+            global_base_folder=global_base_folder,
+            read_only=True,
+        )
+        config._frozen = False
+        config.read_string(text, source=config.config_file)
+        return config
+
+    def snapshot(self) -> PreferenceSnapshot:
+        """
+        Returns
+        -------
+        The typed, read-only copy of the current preferences
+        """
+        return PreferenceSnapshot.from_config(self, self._section_defaults)
 
     def reload(self):
         """
         Reload the configuration file
         """
-        self.read(self.config_file)
+        try:
+            with open(self.config_file, encoding="utf-8") as file:
+                self._saved_text = file.read()
+        except OSError:
+            return
+        self.read_string(self._saved_text, source=self.config_file)
 
     def reset_to_defaults(self):
         """
@@ -147,7 +258,8 @@ class ConfigManager(configparser.ConfigParser):
                                 WF_PREFERENCES[data_input][pref].default
                             )
         else:
-            tmp_config = ConfigManager()
+            # Subject sections start from the global values, the subject file overlays them
+            tmp_config = ConfigManager.global_snapshot(self.global_base_folder)
             for data_input in DataInputList:
                 if data_input in WF_PREFERENCES:
                     self._section_defaults[str(data_input)] = WF_PREFERENCES[data_input]
@@ -184,12 +296,49 @@ class ConfigManager(configparser.ConfigParser):
             for key in DEFAULT_WF[workflow_type][category]:
                 self[category][key] = DEFAULT_WF[workflow_type][category][key]
 
-    def save(self):
+    def is_dirty(self) -> bool:
+        """
+        Returns
+        -------
+        True if the preferences differ from the config file content
+        """
+        return self.to_text() != self._saved_text
+
+    def to_text(self) -> str:
+        """
+        Returns
+        -------
+        The preferences in config file format
+        """
+        text = io.StringIO()
+        self.write(text)
+        return text.getvalue()
+
+    def save(self) -> bool:
         """
-        Save the current preferences to the config file
+        Save the current preferences to the config file, if changed.
+        The file is replaced atomically, so a crash cannot leave it truncated.
+
+        Returns
+        -------
+        True if the file was written
         """
-        with open(self.config_file, "w") as openedFile:
-            self.write(openedFile)
+        if self._read_only:
+            return False
+        text = self.to_text()
+        if text == self._saved_text:
+            return False
+
+        temp_file = self.config_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as openedFile:
+            openedFile.write(text)
+        os.replace(temp_file, self.config_file)
+        self._saved_text = text
+
+        if self.global_config:
+            with ConfigManager._global_snapshots_lock:
+                ConfigManager._global_snapshots.pop(self.config_file, None)
+        return True
 
     def get_main_working_directory(self) -> str:
         """
@@ -727,6 +876,8 @@ class ConfigManager(configparser.ConfigParser):
         -------
         True if the application preference has a valide Slicer path
         """
+        if self._frozen:
+            raise TypeError("Read-only configuration")
         if value is not None:
             value = str(self.validate_type(section, option, value))
         super().set(section, option, value)
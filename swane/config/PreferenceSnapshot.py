@@ -0,0 +1,197 @@
+import configparser
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable
+from swane.config.PreferenceEntry import PreferenceEntry
+from swane.config.config_enums import InputTypes
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledPreference:
+    """
+    The conversion of a preference from its configuration string, with the typed default
+    used for invalid values.
+    """
+
+    convert: Callable[[str], object]
+    default: object
+
+    def value(self, text: str) -> object:
+        try:
+            return self.convert(text)
+        except (ValueError, KeyError, AttributeError):
+            return self.default
+
+
+def _to_bool(text: str) -> bool:
+    return configparser.ConfigParser.BOOLEAN_STATES[text.lower()]
+
+
+def compile_preference(entry: PreferenceEntry) -> CompiledPreference:
+    """
+    Compiles a preference definition of preference_list.py.
+
+    Parameters
+    ----------
+    entry : PreferenceEntry
+        The preference definition.
+
+    Returns
+    -------
+    The CompiledPreference of the preference type.
+
+    """
+    default = entry.default
+    if type(default) is list:
+        default = default[0]
+
+    if entry.input_type == InputTypes.BOOLEAN:
+        return CompiledPreference(_to_bool, _to_bool(str(default)))
+    if entry.input_type == InputTypes.INT:
+        return CompiledPreference(int, int(default))
+    if entry.input_type == InputTypes.FLOAT:
+        return CompiledPreference(float, float(default))
+    if entry.input_type == InputTypes.ENUM:
+        value_enum = entry.value_enum
+        return CompiledPreference(lambda text: value_enum[text], default)
+    if isinstance(default, Enum):
+        default = default.name
+    return CompiledPreference(str, "" if default is None else str(default))
+
+
+class PreferenceSection:
+    """
+    The typed, read-only values of a configuration section.
+    Values are read as attributes or by name. Options without a definition keep their string.
+
+    """
+
+    __slots__ = ("_name", "_values")
+
+    def __init__(self, name: str, values: dict):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_values", values)
+
+    def __getattr__(self, option: str):
+        try:
+            return self._values[option]
+        except KeyError:
+            raise AttributeError(
+                "No option %s in section %s" % (option, self._name)
+            ) from None
+
+    def __setattr__(self, key, value):
+        raise TypeError("Read-only preference section")
+
+    def __getitem__(self, option: str):
+        return self._values[option]
+
+    def __contains__(self, option: str) -> bool:
+        return option in self._values
+
+    def __getstate__(self):
+        return self._name, self._values
+
+    def __setstate__(self, state):
+        object.__setattr__(self, "_name", state[0])
+        object.__setattr__(self, "_values", state[1])
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def _typed(self, option: str, value_type: type):
+        value = self._values[option]
+        if isinstance(value, value_type):
+            return value
+        # Option without definition, eg. set at workflow creation
+        if value_type is bool:
+            return _to_bool(value)
+        return value_type(value)
+
+    # Same signatures of the ConfigManager SectionProxy getters, for workflow factories
+    def getboolean_safe(self, option: str) -> bool:
+        return self._typed(option, bool)
+
+    def getint_safe(self, option: str) -> int:
+        return self._typed(option, int)
+
+    def getfloat_safe(self, option: str) -> float:
+        return self._typed(option, float)
+
+    def getenum_safe(self, option: str) -> Enum:
+        value = self._values[option]
+        if not isinstance(value, Enum):
+            raise ValueError(
+                "No value_enum for %s - %s" % (str(self._name), str(option))
+            )
+        return value
+
+
+class PreferenceSnapshot:
+    """
+    Typed copy of a ConfigManager, compiled once from the preference definitions.
+    Values are converted and validated when the snapshot is created, so reading them
+    while the workflows are built requires no parsing.
+
+    """
+
+    # Compiled definitions, by section name
+    _compiled: dict = {}
+
+    def __init__(self, sections: dict[str, PreferenceSection]):
+        self._sections = sections
+
+    @staticmethod
+    def compiled_section(name: str, definitions: dict) -> dict:
+        """
+        Returns the compiled definitions of a section, compiling them on first use.
+        """
+        cached = PreferenceSnapshot._compiled.get(name)
+        if cached is None or cached[0] is not definitions:
+            cached = (
+                definitions,
+                {
+                    option: compile_preference(entry)
+                    for option, entry in definitions.items()
+                },
+            )
+            PreferenceSnapshot._compiled[name] = cached
+        return cached[1]
+
+    @staticmethod
+    def from_config(config: configparser.ConfigParser, section_defaults: dict):
+        """
+        Parameters
+        ----------
+        config : configparser.ConfigParser
+            The configuration to copy.
+        section_defaults : dict
+            The preference definitions of each configuration section.
+
+        Returns
+        -------
+        The PreferenceSnapshot of the configuration.
+
+        """
+        sections = {}
+        for name in config.sections():
+            compiled = {}
+            if name in section_defaults:
+                compiled = PreferenceSnapshot.compiled_section(
+                    name, section_defaults[name]
+                )
+            values = {}
+            for option, text in config.items(name, raw=True):
+                if option in compiled:
+                    values[option] = compiled[option].value(text)
+                else:
+                    values[option] = text
+            sections[name] = PreferenceSection(name, values)
+        return PreferenceSnapshot(sections)
+
+    def __getitem__(self, section) -> PreferenceSection:
+        return self._sections[str(section)]
+
+    def __contains__(self, section) -> bool:
+        return str(section) in self._sections
@@ -31,6 +31,12 @@ class CoreLimit(Enum):
     HARD_CAP = "Hard Cap"
 
 
+class ResumeCheck(Enum):
+    NIPYPE = "Nipype hash check"
+    FAST = "Manifest lookup"
+    STRICT = "Manifest lookup with file verification"
+
+
 class BetweenModFlirtCost(Enum):
     MULTUAL_INFORMATION = "Mutual information"
     NORMALIZED_MUTUAL_INFORMATION = "Normalized mutual information"
@@ -22,6 +22,10 @@ try:
         XTRACT_DATA_DIR = ""
 except:
     XTRACT_DATA_DIR = ""
+# Content-addressed cache of the packed xtract protocol masks, shared between subjects
+XTRACT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), "." + strings.APPNAME + "_cache", "xtract_bundles"
+)
 DEFAULT_N_SAMPLES = 5000
 
 TRACTS = {
@@ -332,6 +336,26 @@ WF_PREFERENCES[category]["track_procs"] = PreferenceEntry(
     pref_requirement={DataInputList.DTI: [("tractography", True)]},
     pref_requirement_fail_tooltip="Tractography disabled",
 )
+WF_PREFERENCES[category]["track_adaptive"] = PreferenceEntry(
+    input_type=InputTypes.BOOLEAN,
+    label="Stop tractography when the tract distribution converges",
+    tooltip="Samples are added in increments until the normalised tract density stops changing",
+    default="false",
+    pref_requirement={DataInputList.DTI: [("tractography", True)]},
+    pref_requirement_fail_tooltip="Tractography disabled",
+)
+WF_PREFERENCES[category]["track_adaptive_tolerance"] = PreferenceEntry(
+    input_type=InputTypes.FLOAT,
+    label="Tract distribution convergence tolerance",
+    tooltip="Maximum change of the normalised tract density between two increments",
+    default=0.01,
+    range=[0.0001, 1],
+    decimals=4,
+    pref_requirement={
+        DataInputList.DTI: [("tractography", True), ("track_adaptive", True)]
+    },
+    pref_requirement_fail_tooltip="Adaptive tractography disabled",
+)
 
 for tract in TRACTS.keys():
     WF_PREFERENCES[category][tract] = PreferenceEntry(
@@ -597,12 +621,29 @@ GLOBAL_PREFERENCES[category]["max_subj_gpu"] = PreferenceEntry(
     pref_requirement={GlobalPrefCategoryList.PERFORMANCE: [("cuda", True)]},
     pref_requirement_fail_tooltip="Requires CUDA",
 )
+GLOBAL_PREFERENCES[category]["resume_check"] = PreferenceEntry(
+    input_type=InputTypes.ENUM,
+    label="Completed steps check on resume",
+    value_enum=ResumeCheck,
+    default=ResumeCheck.FAST,
+    informative_text={
+        ResumeCheck.NIPYPE: "Inputs of every step are hashed again, slow for large analyses",
+        ResumeCheck.FAST: "Steps recorded as completed with the same settings are skipped without reading their files",
+        ResumeCheck.STRICT: "As manifest lookup, but the files of every step are checked for changes",
+    },
+)
 GLOBAL_PREFERENCES[category]["resource_monitor"] = PreferenceEntry(
     input_type=InputTypes.BOOLEAN,
     label="Enable resource monitor",
     default="false",
     section=True,
 )
+GLOBAL_PREFERENCES[category]["graph_on_demand"] = PreferenceEntry(
+    input_type=InputTypes.BOOLEAN,
+    label="Draw workflow graphs only when opened",
+    tooltip="Graphs are drawn when selected in the workflow list, instead of at workflow generation",
+    default="false",
+)
 category = GlobalPrefCategoryList.SYNTH
 GLOBAL_PREFERENCES[category] = {}
 GLOBAL_PREFERENCES[category]["strip"] = PreferenceEntry(
@@ -647,6 +688,14 @@ GLOBAL_PREFERENCES[category]["reconall"] = PreferenceEntry(
     pref_requirement_fail_tooltip="SynthStrip requires at least %.1f GB RAM"
     % ResourceManager.synth_reconall_ram_requirements(),
 )
+GLOBAL_PREFERENCES[category]["server"] = PreferenceEntry(
+    input_type=InputTypes.BOOLEAN,
+    label="Keep Synth models loaded in a background process",
+    tooltip="SynthStrip, SynthSeg and SynthMorph models are loaded once by a background FreeSurfer python process and reused by every Synth step, falling back to the command line when a step cannot be served",
+    default=True,
+    dependency="is_freesurfer_synth",
+    dependency_fail_tooltip="Synth tools recon-all requires FreeSurfer 8.1.0",
+)
 category = GlobalPrefCategoryList.OPTIONAL_SERIES
 GLOBAL_PREFERENCES[category] = {}
 for data_input in DataInputList:
@@ -6,6 +6,7 @@ from os.path import abspath
 import swane_supplement
 from swane.utils.ResourceManager import ResourceManager
 from swane.config.ConfigManager import ConfigManager
+from swane.config.PreferenceSnapshot import PreferenceSnapshot
 from swane.utils.SubjectInputStateList import SubjectInputStateList
 from swane.utils.DataInputList import DataInputList as DIL, FMRI_NUM
 from swane.config.config_enums import (
@@ -14,8 +15,10 @@ from swane.config.config_enums import (
     BlockDesign,
     GlobalPrefCategoryList,
     FreesurferStep,
+    ResumeCheck,
 )
 from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
+from swane.nipype_pipeline.engine.TransformRegistry import TransformRegistry
 from swane.nipype_pipeline.workflows.linear_reg_workflow import linear_reg_workflow
 from swane.nipype_pipeline.workflows.fMRI_task_workflow import fMRI_task_workflow
 from swane.nipype_pipeline.workflows.fMRI_resting_state_workflow import (
@@ -53,6 +56,8 @@ class MainWorkflow(CustomWorkflow):
     max_cpu: int = -1
     max_gpu: int = -1
     multicore_node_limit: CoreLimit = CoreLimit.SOFT_CAP
+    resume_check: ResumeCheck = ResumeCheck.NIPYPE
+    synth_server: bool = False
     memory_gb: float = -1
     freesurfer_step: FreesurferStep = FreesurferStep.DISABLED
     is_hippo_amyg_labels: bool = False
@@ -64,7 +69,7 @@ class MainWorkflow(CustomWorkflow):
     freesurfer: CustomWorkflow
     sym: CustomWorkflow
     flair: CustomWorkflow
-    mni1: CustomWorkflow
+    transform_registry: TransformRegistry
     flat1: CustomWorkflow
     flair2d: CustomWorkflow
     t2_cor: CustomWorkflow
@@ -81,6 +86,8 @@ class MainWorkflow(CustomWorkflow):
     base_dir: str
     global_config: ConfigManager
     subject_config: ConfigManager
+    global_prefs: PreferenceSnapshot
+    subject_prefs: PreferenceSnapshot
     dependency_manager: DependencyManager
     subject_input_state_list: SubjectInputStateList
 
@@ -125,6 +132,7 @@ class MainWorkflow(CustomWorkflow):
         self.set_analyses_request()
 
         self.launch_3dt1_analysis()
+        self.set_transform_spaces()
         self.launch_ai_analysis()
         self.launch_freesurfer_analysis()
         self.launch_3dflair_analysis()
@@ -140,78 +148,72 @@ class MainWorkflow(CustomWorkflow):
         self.launch_dti_analysis()
         self.launch_fMRI_task_analysis()
         self.launch_fMRI_resting_state_analysis()
+        self.transform_registry.build()
 
         # Remove reference to original variables to prevent crash during subprocess spawn in MacOS
         # Maybe this can be solved setting fork subprocess method too
         self.global_config = None
         self.subject_config = None
+        self.global_prefs = None
+        self.subject_prefs = None
         self.dependency_manager = None
         self.subject_input_state_list = None
 
     def set_resources_configuration(self):
+        # Typed preferences, read without parsing while the workflows are built
+        self.global_prefs = self.global_config.snapshot()
+        performance = self.global_prefs[GlobalPrefCategoryList.PERFORMANCE]
+
         # CPU cores and memory management
-        self.is_resource_monitor = self.global_config.getboolean_safe(
-            GlobalPrefCategoryList.PERFORMANCE, "resource_monitor"
-        )
-        self.max_cpu = self.global_config.getint_safe(
-            GlobalPrefCategoryList.PERFORMANCE, "max_subj_cpu"
-        )
+        self.is_resource_monitor = performance.resource_monitor
+        self.max_cpu = performance.max_subj_cpu
         if self.max_cpu < 1:
             self.max_cpu = cpu_count()
-        self.multicore_node_limit = self.global_config.getenum_safe(
-            GlobalPrefCategoryList.PERFORMANCE, "multicore_node_limit"
-        )
+        self.multicore_node_limit = performance.multicore_node_limit
+        self.resume_check = performance.resume_check
+        self.synth_server = self.global_prefs[GlobalPrefCategoryList.SYNTH].server
         # GPU management
-        self.max_gpu = self.global_config.getint_safe(
-            GlobalPrefCategoryList.PERFORMANCE, "max_subj_gpu"
-        )
+        self.max_gpu = performance.max_subj_gpu
         if self.max_gpu < 0:
             self.max_gpu = MonitoredMultiProcPlugin.gpu_count()
 
         # RAM management
-        self.memory_gb = self.global_config.getfloat_safe(
-            GlobalPrefCategoryList.PERFORMANCE, "ram_gb"
-        )
+        self.memory_gb = performance.ram_gb
 
         try:
             # propagate global cuda setting in workflow setting
             self.subject_config[DIL.DTI]["cuda"] = str(
-                ResourceManager.is_cuda()
-                and self.global_config.getboolean_safe(
-                    GlobalPrefCategoryList.PERFORMANCE, "cuda"
-                )
+                ResourceManager.is_cuda() and performance.cuda
             )
         except:
             self.subject_config[DIL.DTI]["cuda"] = "false"
 
-        # self.subject_config.sections()
+        self.subject_prefs = self.subject_config.snapshot()
 
     def set_analyses_request(self):
         # Check for FreeSurfer requirement and request
         if self.dependency_manager.is_freesurfer():
-            self.freesurfer_step = self.subject_config.get_workflow_freesurfer_pref()
+            self.freesurfer_step = self.subject_prefs[DIL.T13D].freesurfer_step
             self.is_hippo_amyg_labels = (
                 self.dependency_manager.is_freesurfer_matlab()
-                and self.subject_config.get_workflow_hippo_pref()
+                and self.subject_prefs[DIL.T13D].hippo_amyg_labels
             )
 
         # Check for FLAT1 requirement and request
         self.is_flat1 = (
-            self.subject_config.getboolean_safe(DIL.T13D, "flat1")
+            self.subject_prefs[DIL.T13D].flat1
             and self.subject_input_state_list[DIL.FLAIR3D].loaded
         )
         # Check for Asymmetry Index request
         self.is_ai = (
-            self.subject_config.getboolean_safe(DIL.PET, "ai")
+            self.subject_prefs[DIL.PET].ai
             and self.subject_input_state_list[DIL.PET].loaded
         ) or (
-            self.subject_config.getboolean_safe(DIL.ASL, "ai")
+            self.subject_prefs[DIL.ASL].ai
             and self.subject_input_state_list[DIL.ASL].loaded
         )
         # Check for Tractography request
-        self.is_tractography = self.subject_config.getboolean_safe(
-            DIL.DTI, "tractography"
-        )
+        self.is_tractography = self.subject_prefs[DIL.DTI].tractography
         # Check if Slicer is installed to allow venous ct segmente_endocranium
         self.is_slicer = self.dependency_manager.is_slicer(self.global_config)
 
@@ -220,8 +222,9 @@ class MainWorkflow(CustomWorkflow):
         self.t1 = ref_workflow(
             name=DIL.T13D.value.workflow_name,
             dicom_dir=ref_dir,
-            config=self.subject_config[DIL.T13D],
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            config=self.subject_prefs[DIL.T13D],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
+            max_cpu=self.max_cpu,
         )
         self.t1.long_name = "3D T1w analysis"
         self.add_nodes([self.t1])
@@ -239,6 +242,28 @@ class MainWorkflow(CustomWorkflow):
             sub_folder=self.Result_DIR,
         )
 
+    def set_transform_spaces(self):
+        # Shared nonlinear registrations between reference and standard spaces
+        self.transform_registry = TransformRegistry(self)
+        self.transform_registry.add_space(
+            "ref",
+            [self.t1, "outputnode.reference_brain"],
+            "Reference",
+            head_source=[self.t1, "outputnode.reference"],
+        )
+        for resolution in (1, 2):
+            mni = os.path.join(
+                os.environ["FSLDIR"], "data/standard/MNI152_T1_%dmm" % resolution
+            )
+            self.transform_registry.add_space(
+                "mni%d" % resolution,
+                abspath(mni + "_brain.nii.gz"),
+                "MNI atlas",
+                template="mni",
+                resolution=resolution,
+                head_source=abspath(mni + ".nii.gz"),
+            )
+
     def launch_ai_analysis(self):
         if not self.is_ai:
             return
@@ -246,7 +271,7 @@ class MainWorkflow(CustomWorkflow):
         # Non linear registration for Asymmetry Index
         self.sym = nonlinear_reg_workflow(
             name="sym",
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.sym.long_name = "Symmetric atlas registration"
 
@@ -268,7 +293,7 @@ class MainWorkflow(CustomWorkflow):
             is_hippo_amyg_labels=self.is_hippo_amyg_labels,
             max_cpu=self.max_cpu,
             multicore_node_limit=self.multicore_node_limit,
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.freesurfer.long_name = "Freesurfer analysis"
 
@@ -327,9 +352,10 @@ class MainWorkflow(CustomWorkflow):
         self.flair = linear_reg_workflow(
             name=DIL.FLAIR3D.value.workflow_name,
             dicom_dir=flair_dir,
-            config=self.subject_config[DIL.FLAIR3D],
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            config=self.subject_prefs[DIL.FLAIR3D],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
             bias_field_correction=True,
+            max_cpu=self.max_cpu,
         )
         self.flair.long_name = "3D Flair analysis"
         self.add_nodes([self.flair])
@@ -369,29 +395,11 @@ class MainWorkflow(CustomWorkflow):
         if not self.is_flat1:
             return
 
-        # Non linear registration to MNI1mm Atlas for FLAT1
-        self.mni1 = nonlinear_reg_workflow(
-            name="mni1",
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
-        )
-        self.mni1.long_name = "MNI atlas registration"
-
-        mni1_inputnode = self.mni1.get_node("inputnode")
-        mni1_path = abspath(
-            os.path.join(
-                os.environ["FSLDIR"], "data/standard/MNI152_T1_1mm_brain.nii.gz"
-            )
-        )
-        mni1_inputnode.inputs.atlas = mni1_path
-        self.connect(
-            self.t1, "outputnode.reference_brain", self.mni1, "inputnode.in_file"
-        )
-
         # FLAT1 analysis
         self.flat1 = flat1_workflow(
             name="FLAT1",
-            mni1_dir=mni1_path,
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            mni1_dir=self.transform_registry.spaces["mni1"].source,
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.flat1.long_name = "FLAT1 analysis"
 
@@ -407,18 +415,15 @@ class MainWorkflow(CustomWorkflow):
             self.flat1,
             "inputnode.flair_brain",
         )
-        self.connect(
-            self.mni1,
-            "outputnode.fieldcoeff_file",
-            self.flat1,
-            "inputnode.ref_2_mni1_warp",
-        )
-        self.connect(
-            self.mni1,
-            "outputnode.inverse_warp",
-            self.flat1,
-            "inputnode.ref_2_mni1_inverse_warp",
+
+        # Non linear registration to MNI1mm Atlas for FLAT1
+        ref_2_mni1 = self.transform_registry.request(
+            "ref",
+            "mni1",
+            use_synth=self.global_prefs[GlobalPrefCategoryList.SYNTH].morph,
         )
+        ref_2_mni1.connect_forward(self.flat1, "inputnode.ref_2_mni1_warp")
+        ref_2_mni1.connect_inverse(self.flat1, "inputnode.ref_2_mni1_inverse_warp")
 
         self.flat1.sink_result(
             save_path=self.base_dir,
@@ -453,7 +458,7 @@ class MainWorkflow(CustomWorkflow):
                     dicom_dir=flair_dir,
                     config=None,
                     is_volumetric=False,
-                    synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+                    synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
                 )
                 self.flair2d.long_name = "2D %s FLAIR analysis" % plane.value
                 self.add_nodes([self.flair2d])
@@ -491,7 +496,7 @@ class MainWorkflow(CustomWorkflow):
             config=None,
             is_volumetric=True,  # perform better with volumetric settings
             is_partial_coverage=True,
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.t2_cor.long_name = "2D coronal T2 analysis"
         self.add_nodes([self.t2_cor])
@@ -534,9 +539,10 @@ class MainWorkflow(CustomWorkflow):
         self.mdc = linear_reg_workflow(
             name=DIL.MDC.value.workflow_name,
             dicom_dir=mdc_dir,
-            config=self.subject_config[DIL.MDC],
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            config=self.subject_prefs[DIL.MDC],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
             bias_field_correction=True,
+            max_cpu=self.max_cpu,
         )
         self.mdc.long_name = "Post-contrast 3D T1w analysis"
         self.add_nodes([self.mdc])
@@ -572,8 +578,8 @@ class MainWorkflow(CustomWorkflow):
             name=DIL.ASL.value.workflow_name,
             dicom_dir=asl_dir,
             freesurfer_step=self.freesurfer_step,
-            config=self.subject_config[DIL.ASL],
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            config=self.subject_prefs[DIL.ASL],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.asl.long_name = "Arterial Spin Labelling analysis"
 
@@ -638,7 +644,7 @@ class MainWorkflow(CustomWorkflow):
                     sub_folder=self.Result_DIR,
                 )
 
-        if self.subject_config.getboolean_safe(DIL.ASL, "ai"):
+        if self.subject_prefs[DIL.ASL].ai:
             self.connect(
                 self.sym,
                 "outputnode.fieldcoeff_file",
@@ -685,8 +691,8 @@ class MainWorkflow(CustomWorkflow):
             name=DIL.PET.value.workflow_name,
             dicom_dir=pet_dir,
             freesurfer_step=self.freesurfer_step,
-            config=self.subject_config[DIL.PET],
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            config=self.subject_prefs[DIL.PET],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.pet.long_name = "Pet analysis"
 
@@ -757,7 +763,7 @@ class MainWorkflow(CustomWorkflow):
             # self.connect(pet, "outputnode.registered_file", pet_ai, "inputnode.in_file")
             # self.connect(freesurfer, "outputnode.vol_label_file_nii", pet_ai, "inputnode.seg_file")
 
-        if self.subject_config.getboolean_safe(DIL.PET, "ai"):
+        if self.subject_prefs[DIL.PET].ai:
             self.connect(
                 self.sym,
                 "outputnode.fieldcoeff_file",
@@ -815,7 +821,7 @@ class MainWorkflow(CustomWorkflow):
         self.venous_ct = venous_ct_workflow(
             DIL.VENOUS_CT.value.workflow_name,
             venous_ct_dir=venous_ct_dir,
-            config=self.subject_config[DIL.VENOUS_CT],
+            config=self.subject_prefs[DIL.VENOUS_CT],
             venous2_ct_dir=venous2_ct_dir,
             slicer_path=self.global_config.get_slicer_path(),
         )
@@ -856,9 +862,9 @@ class MainWorkflow(CustomWorkflow):
         self.venous_mr = venous_mr_workflow(
             DIL.VENOUS_MR.value.workflow_name,
             venous_mr_dir=venous_mr_dir,
-            config=self.subject_config[DIL.VENOUS_MR],
+            config=self.subject_prefs[DIL.VENOUS_MR],
             venous2_mr_dir=venous2_mr_dir,
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
         )
         self.venous_mr.long_name = "Venous MRA analysis"
 
@@ -891,7 +897,7 @@ class MainWorkflow(CustomWorkflow):
         self.seeg_ct_dir = seeg_ct_workflow(
             DIL.SEEG_CT.value.workflow_name,
             seeg_ct_dir=seeg_ct_dir,
-            config=self.subject_config[DIL.SEEG_CT],
+            config=self.subject_prefs[DIL.SEEG_CT],
         )
         self.seeg_ct_dir.long_name = "SEEG CT analysis"
 
@@ -925,10 +931,11 @@ class MainWorkflow(CustomWorkflow):
         self.dti_preproc = dti_preproc_workflow(
             name=DIL.DTI.value.workflow_name,
             dti_dir=dti_dir,
-            config=self.subject_config[DIL.DTI],
+            config=self.subject_prefs[DIL.DTI],
             max_cpu=self.max_cpu,
             multicore_node_limit=self.multicore_node_limit,
-            synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+            synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
+            mni_registration=False,
         )
         self.dti_preproc.long_name = "Diffusion Tensor Imaging preprocessing"
         self.connect(
@@ -949,17 +956,24 @@ class MainWorkflow(CustomWorkflow):
         )
 
         if self.is_tractography:
+            mni1_2_ref = self.transform_registry.request(
+                "mni1",
+                "ref",
+                use_synth=self.global_prefs[GlobalPrefCategoryList.SYNTH].morph,
+            )
             for tract in TRACTS.keys():
                 try:
-                    if not self.subject_config.getboolean_safe(DIL.DTI, tract):
+                    if not self.subject_prefs[DIL.DTI].getboolean_safe(tract):
                         continue
                 except:
                     continue
 
                 tract_workflow = tractography_workflow(
                     name=tract,
-                    config=self.subject_config[DIL.DTI],
-                    synth_config=self.global_config[GlobalPrefCategoryList.SYNTH],
+                    config=self.subject_prefs[DIL.DTI],
+                    synth_config=self.global_prefs[GlobalPrefCategoryList.SYNTH],
+                    subject_name=self.name,
+                    max_cpu=self.max_cpu,
                 )
                 if tract_workflow is not None:
                     tract_workflow.long_name = TRACTS[tract][0] + " tractography"
@@ -1005,12 +1019,7 @@ class MainWorkflow(CustomWorkflow):
                         tract_workflow,
                         "inputnode.ref2diff_mat",
                     )
-                    self.connect(
-                        self.dti_preproc,
-                        "outputnode.mni2ref_warp",
-                        tract_workflow,
-                        "inputnode.mni2ref_warp",
-                    )
+                    mni1_2_ref.connect_forward(tract_workflow, "inputnode.mni2ref_warp")
 
                     for side in SIDES:
                         tract_workflow.sink_result(
@@ -1040,7 +1049,7 @@ class MainWorkflow(CustomWorkflow):
             self.fMRI = fMRI_task_workflow(
                 name=DIL["FMRI_%d" % y].value.workflow_name,
                 dicom_dir=dicom_dir,
-                config=self.subject_config[DIL["FMRI_%d" % y]],
+                config=self.subject_prefs[DIL["FMRI_%d" % y]],
                 base_dir=self.base_dir,
             )
             self.fMRI.long_name = "Task fMRI analysis - %d" % y
@@ -1058,7 +1067,7 @@ class MainWorkflow(CustomWorkflow):
                     sub_folder=os.path.join(self.Result_DIR, "fMRI"),
                 )
                 if (
-                    self.subject_config.getenum_safe(DIL["FMRI_%d" % y], "block_design")
+                    self.subject_prefs[DIL["FMRI_%d" % y]].block_design
                     == BlockDesign.RARB
                 ):
                     self.fMRI.sink_result(
@@ -1080,10 +1089,18 @@ class MainWorkflow(CustomWorkflow):
         self.fMRI_resting_state = fMRI_resting_state_workflow(
             name=DIL.FMRI_RS.value.workflow_name,
             dicom_dir=dicom_dir,
-            config=self.subject_config[DIL.FMRI_RS],
+            config=self.subject_prefs[DIL.FMRI_RS],
             base_dir=self.base_dir,
+            max_cpu=self.max_cpu,
+            mni_registration=False,
         )
         self.fMRI_resting_state.long_name = "Resting state fMRI analysis"
+        if self.subject_prefs[DIL.FMRI_RS].aroma:
+            # AROMA applies the FNIRT warp with an affine premat, SynthMorph is not suitable
+            ref_2_mni2 = self.transform_registry.request("ref", "mni2", use_synth=False)
+            ref_2_mni2.connect_forward(
+                self.fMRI_resting_state, "mni_inputnode.ref_2_mni_warp"
+            )
         self.connect(
             self.t1,
             "outputnode.reference_brain",
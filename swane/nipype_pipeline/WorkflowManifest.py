@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+from swane import __version__
+from swane.config.ConfigManager import ConfigManager
+from swane.utils.DataInputList import DataInputList
+from swane.utils.DependencyManager import DependencyManager
+from swane.utils.SubjectInputStateList import SubjectInputStateList, SubjectInputState
+from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
+
+
+class RecordedDependencies:
+    """
+    The dependency checks answered when a workflow was generated.
+    Used in place of the DependencyManager to rebuild the same workflow without probing
+    the tools again.
+
+    """
+
+    def __init__(self, freesurfer: bool, freesurfer_matlab: bool, slicer: bool):
+        self.freesurfer = freesurfer
+        self.freesurfer_matlab = freesurfer_matlab
+        self.slicer = slicer
+
+    def is_freesurfer(self) -> bool:
+        return self.freesurfer
+
+    def is_freesurfer_matlab(self) -> bool:
+        return self.freesurfer_matlab
+
+    def is_slicer(self, config: ConfigManager = None) -> bool:
+        return self.slicer
+
+
+class WorkflowManifest:
+    """
+    Compact JSON description of a MainWorkflow: the preferences, the loaded inputs and the
+    dependency checks it is generated from, with the signature of each of its nodes.
+    The workflow process rebuilds the workflow from it instead of receiving the pickled
+    graph, and the saved node signatures are comparable with WorkflowDiff.
+
+    """
+
+    FILE_NAME = "workflow_manifest.json"
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    @staticmethod
+    def create(
+        workflow: MainWorkflow,
+        global_config: ConfigManager,
+        subject_config: ConfigManager,
+        dependency_manager: DependencyManager,
+        subject_input_state_list: SubjectInputStateList,
+    ) -> "WorkflowManifest":
+        """
+        Describes a workflow just generated. Must be called before any change of the
+        preferences used to generate it.
+
+        Parameters
+        ----------
+        workflow : MainWorkflow
+            The generated workflow.
+        global_config : ConfigManager
+            The app global configurations used for the workflow.
+        subject_config : ConfigManager
+            The subject specific configurations used for the workflow.
+        dependency_manager: DependencyManager
+            The state of application dependency
+        subject_input_state_list : SubjectInputStateList
+            The list of all available input data from the DICOM directory.
+
+        Returns
+        -------
+        The WorkflowManifest of the workflow, without node signatures.
+
+        """
+        return WorkflowManifest(
+            {
+                "version": __version__,
+                "name": workflow.name,
+                "base_dir": workflow.base_dir,
+                "global_base_folder": global_config.global_base_folder,
+                "global_config": global_config.to_text(),
+                "subject_folder": os.path.dirname(subject_config.config_file),
+                "subject_config": subject_config.to_text(),
+                "dicom_dir": subject_input_state_list.dicom_dir,
+                "inputs": {
+                    data_input.name: [state.loaded, state.volumes]
+                    for data_input, state in subject_input_state_list.items()
+                },
+                "dependencies": {
+                    "freesurfer": dependency_manager.is_freesurfer(),
+                    "freesurfer_matlab": dependency_manager.is_freesurfer_matlab(),
+                    "slicer": dependency_manager.is_slicer(global_config),
+                },
+                "structure": WorkflowManifest.structure_digest(workflow),
+                "nodes": None,
+            }
+        )
+
+    @staticmethod
+    def structure_digest(workflow: MainWorkflow) -> str:
+        """
+        Returns the sha256 of the names of the workflow nodes, in topological order.
+        Cheaper than the node signatures, it is enough to check that a rebuilt workflow
+        has the same nodes.
+
+        """
+        names = []
+        pending = [workflow.get_node_array()]
+        while len(pending) > 0:
+            node_list = pending.pop()
+            for entry in node_list.values():
+                names.append("%s:%s" % (entry.fullname, entry.long_name))
+                if len(entry.node_list) > 0:
+                    pending.append(entry.node_list)
+        return hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+
+    @property
+    def nodes(self) -> dict:
+        """
+        Returns
+        -------
+        The node signatures, as returned by WorkflowDiff.signatures(), None if not set.
+        """
+        return self.data["nodes"]
+
+    @nodes.setter
+    def nodes(self, signatures: dict):
+        self.data["nodes"] = signatures
+
+    def to_json(self) -> str:
+        return json.dumps(self.data)
+
+    def handoff_json(self) -> str:
+        """
+        Returns
+        -------
+        The manifest without node signatures, to pass to the workflow process.
+        """
+        return json.dumps(dict(self.data, nodes=None))
+
+    @staticmethod
+    def from_json(text: str) -> "WorkflowManifest":
+        return WorkflowManifest(json.loads(text))
+
+    def save(self, workflow_dir: str):
+        """
+        Writes the manifest in the workflow directory.
+        """
+        os.makedirs(workflow_dir, exist_ok=True)
+        manifest_file = os.path.join(workflow_dir, WorkflowManifest.FILE_NAME)
+        with open(manifest_file + ".tmp", "w", encoding="utf-8") as file:
+            file.write(self.to_json())
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+    @staticmethod
+    def load(workflow_dir: str) -> "WorkflowManifest":
+        """
+        Reads the manifest of the previous execution.
+
+        Returns
+        -------
+        The WorkflowManifest or None if not found or unreadable.
+
+        """
+        manifest_file = os.path.join(workflow_dir, WorkflowManifest.FILE_NAME)
+        try:
+            with open(manifest_file, encoding="utf-8") as file:
+                return WorkflowManifest.from_json(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def build_workflow(self) -> MainWorkflow:
+        """
+        Generates the described workflow again.
+
+        Returns
+        -------
+        The MainWorkflow.
+
+        """
+        global_config = ConfigManager.from_text(
+            self.data["global_config"],
+            global_base_folder=self.data["global_base_folder"],
+        )
+        subject_config = ConfigManager.from_text(
+            self.data["subject_config"],
+            subject_folder=self.data["subject_folder"],
+            global_base_folder=self.data["global_base_folder"],
+        )
+        subject_input_state_list = SubjectInputStateList(
+            self.data["dicom_dir"], global_config
+        )
+        for name, (loaded, volumes) in self.data["inputs"].items():
+            state = SubjectInputState()
+            state.loaded = loaded
+            state.volumes = volumes
+            subject_input_state_list[DataInputList[name]] = state
+
+        return MainWorkflow(
+            name=self.data["name"],
+            base_dir=self.data["base_dir"],
+            global_config=global_config,
+            subject_config=subject_config,
+            dependency_manager=RecordedDependencies(**self.data["dependencies"]),
+            subject_input_state_list=subject_input_state_list,
+        )
+
+    def matches(self, workflow: MainWorkflow) -> bool:
+        """
+        Returns
+        -------
+        True if the workflow, eg. rebuilt with build_workflow(), has the described nodes.
+        """
+        return self.data["structure"] == WorkflowManifest.structure_digest(workflow)
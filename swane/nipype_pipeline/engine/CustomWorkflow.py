@@ -1,5 +1,6 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
 
+from functools import lru_cache
 from nipype.pipeline.engine import Workflow
 from nipype import Node, logging, MapNode
 from nipype.interfaces.utility import IdentityInterface
@@ -17,49 +18,125 @@ class CustomWorkflow(Workflow):
 
     """
 
+    # Incremented by every structural change of any CustomWorkflow, invalidates the caches
+    _structure_generation = 0
+
     @staticmethod
-    def format_node_name(node):
+    def _structure_changed():
+        CustomWorkflow._structure_generation += 1
+
+    def _cached(self, key: str, compute):
         """
-        Returns the explicit name of a Node.
+        Returns a value derived from the workflow structure, computing it only if the
+        structure of any CustomWorkflow changed since the last call.
 
         """
+        cache = getattr(self, "_structure_cache", None)
+        if cache is None or cache["generation"] != CustomWorkflow._structure_generation:
+            # Replaced, not cleared, as graph drawing threads may be reading it
+            cache = {"generation": CustomWorkflow._structure_generation}
+            self._structure_cache = cache
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache[key] = value
+        return value
+
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        CustomWorkflow._structure_changed()
+
+    def disconnect(self, *args):
+        super().disconnect(*args)
+        CustomWorkflow._structure_changed()
 
-        default_node_name = None
-        if (
-            hasattr(node, "interface")
-            and type(node.interface).__name__ in strings.node_names
-        ):
-            default_node_name = strings.node_names[type(node.interface).__name__]
-        if hasattr(node, "long_name"):
-            formatted_name = node.long_name
-            if "%s" in node.long_name and default_node_name is not None:
-                formatted_name = node.long_name % default_node_name
+    def add_nodes(self, nodes):
+        super().add_nodes(nodes)
+        CustomWorkflow._structure_changed()
+
+    def remove_nodes(self, nodes):
+        super().remove_nodes(nodes)
+        CustomWorkflow._structure_changed()
+
+    def _reset_hierarchy(self):
+        super()._reset_hierarchy()
+        CustomWorkflow._structure_changed()
+
+    def _generate_flatgraph(self):
+        super()._generate_flatgraph()
+        CustomWorkflow._structure_changed()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _format_name(interface_name: str, long_name: str, name: str) -> str:
+        default_node_name = strings.node_names.get(interface_name)
+        if long_name is not None:
+            formatted_name = long_name
+            if "%s" in long_name and default_node_name is not None:
+                formatted_name = long_name % default_node_name
         elif default_node_name is not None:
             formatted_name = default_node_name
         else:
-            formatted_name = node.name
+            formatted_name = name
 
         formatted_name = formatted_name.strip()
         formatted_name = formatted_name[0].upper() + formatted_name[1:]
         return formatted_name
 
+    @staticmethod
+    def format_node_name(node):
+        """
+        Returns the explicit name of a Node.
+
+        """
+
+        return CustomWorkflow._format_name(
+            type(node.interface).__name__ if hasattr(node, "interface") else None,
+            getattr(node, "long_name", None),
+            node.name,
+        )
+
+    def topological_order(self) -> tuple:
+        """
+        Returns the nodes of the workflow graph in topological order.
+
+        """
+
+        def compute():
+            import networkx as nx
+
+            return tuple(nx.topological_sort(self._graph))
+
+        return self._cached("topological_order", compute)
+
+    def _node_rows(self) -> tuple:
+        """
+        Returns the (node, long_name) pairs of the nodes listed by get_node_array.
+
+        """
+
+        def compute():
+            return tuple(
+                (node, self.format_node_name(node))
+                for node in self.topological_order()
+                if not (
+                    hasattr(node, "interface")
+                    and isinstance(node.interface, IdentityInterface)
+                )
+            )
+
+        return self._cached("node_rows", compute)
+
     def get_node_array(self) -> dict:
         """
         Returns a List of NodeListEntry objects for the Nodes in a Workflow.
 
         """
 
-        from networkx import topological_sort
-
         outlist = {}
-        for node in topological_sort(self._graph):
-            if hasattr(node, "interface") and isinstance(
-                node.interface, IdentityInterface
-            ):
-                continue
-
+        for node, long_name in self._node_rows():
             outlist[node.name] = NodeListEntry()
-            outlist[node.name].long_name = self.format_node_name(node)
+            outlist[node.name].long_name = long_name
             outlist[node.name].fullname = node.fullname
             if isinstance(node, CustomWorkflow):
                 outlist[node.name].node_list = node.get_node_array()
@@ -71,20 +148,16 @@ class CustomWorkflow(Workflow):
         Nodes with IdentityInterface are skipped.
         """
 
-        from networkx import topological_sort
+        def compute():
+            node_list = []
+            for node, _ in self._node_rows():
+                if isinstance(node, CustomWorkflow):
+                    node_list.extend(node._get_basic_node_array())
+                else:
+                    node_list.append(node)
+            return tuple(node_list)
 
-        node_list = []
-        for node in topological_sort(self._graph):
-            if hasattr(node, "interface") and isinstance(
-                node.interface, IdentityInterface
-            ):
-                continue
-
-            if isinstance(node, CustomWorkflow):
-                node_list.extend(node._get_basic_node_array())
-            else:
-                node_list.append(node)
-        return node_list
+        return list(self._cached("basic_node_array", compute))
 
     def get_interface_array(self):
         """
@@ -140,8 +213,6 @@ class CustomWorkflow(Workflow):
 
         """
 
-        import networkx as nx
-
         if prefix is None:
             prefix = "  "
         if hierarchy is None:
@@ -164,7 +235,7 @@ class CustomWorkflow(Workflow):
             level = 3  # Loop back to blue
 
         dotlist = ['%slabel="%s";' % (prefix, self.name)]
-        for node in nx.topological_sort(self._graph):
+        for node in self.topological_order():
             fullname = ".".join(hierarchy + [node.fullname])
             nodename = fullname.replace(".", "_")
             if not isinstance(node, Workflow):
@@ -189,7 +260,7 @@ class CustomWorkflow(Workflow):
                             ('%s[label="%s"];') % (nodename, node_class_name)
                         )
 
-        for node in nx.topological_sort(self._graph):
+        for node in self.topological_order():
             if isinstance(node, Workflow):
                 fullname = ".".join(hierarchy + [node.fullname])
                 nodename = fullname.replace(".", "_")
@@ -4,6 +4,8 @@ import traceback
 from nipype.interfaces.base import isdefined
 from nipype.pipeline.plugins.multiproc import MultiProcPlugin
 from swane.nipype_pipeline.engine.WorkflowReport import WorkflowReport, WorkflowSignals
+from swane.nipype_pipeline.engine.ResumeManifest import ResumeManifest
+from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
 from swane import strings
 import numpy as np
 from logging import INFO
@@ -234,10 +236,22 @@ class MonitoredMultiProcPlugin(MultiProcPlugin):
         if "queue" in plugin_args:
             self.queue = plugin_args["queue"]
 
+        # Manifest of completed nodes, to skip them on resume without hash checks
+        self.manifest = None
+        self._manifest_graph = None
+        self._manifest_signatures = {}
+        self._manifest_hits = set()
+        if plugin_args.get("resume_manifest"):
+            self.manifest = ResumeManifest(
+                plugin_args["resume_manifest"],
+                strict=plugin_args.get("resume_strict", False),
+            )
+
         super().__init__(plugin_args=plugin_args)
 
         # it's mandatory delete this argument to avoid plugin copy generated by MapNodes to raise exceptions
         plugin_args["queue"] = None
+        plugin_args["resume_manifest"] = None
 
     def _prerun_check(self, graph):
         """Check if any node exceeds the available resources"""
@@ -333,7 +347,78 @@ class MonitoredMultiProcPlugin(MultiProcPlugin):
 
         return ret
 
+    def _manifest_signature(self, jobid) -> str:
+        if jobid not in self._manifest_signatures:
+            self._manifest_signatures[jobid] = WorkflowDiff.node_signature(
+                self.procs[jobid], self._manifest_graph
+            )
+        return self._manifest_signatures[jobid]
+
+    def _manifest_check(self, jobid) -> bool:
+        """
+        Skips a node recorded as completed in the resume manifest with the same signature.
+        Only nodes whose predecessors were skipped the same way are eligible, so a node
+        downstream of a re-executed one always gets the nipype hash check.
+
+        Returns
+        -------
+        True if the node was skipped.
+
+        """
+        node = self.procs[jobid]
+        if (
+            self.manifest is None
+            or isinstance(node, MapNode)
+            or node not in self._manifest_graph
+        ):
+            return False
+        if any(
+            predecessor not in self._manifest_hits
+            for predecessor in self._manifest_graph.predecessors(node)
+        ):
+            return False
+        output_dir = node.output_dir()
+        # Downstream nodes load this result, a deleted node dir is never trusted
+        if not os.path.exists(
+            os.path.join(output_dir, "result_%s.pklz" % node.name)
+        ) or not self.manifest.is_valid(output_dir, self._manifest_signature(jobid)):
+            # The node goes through the nipype check and maybe runs again
+            self.manifest.forget_node(output_dir)
+            return False
+
+        logger.debug("Skipping node %s recorded in resume manifest.", node)
+        self._manifest_hits.add(node)
+        self.proc_done[jobid] = True
+        self.proc_pending[jobid] = True
+        self._task_finished_cb(jobid, cached=True)
+        self._remove_node_dirs()
+        return True
+
+    def close_manifest(self):
+        """
+        Closes the resume manifest, waiting for its pending content hashes.
+        """
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
     def _task_finished_cb(self, jobid, cached=False):
+        # Records completed nodes in the resume manifest
+        if (
+            self.manifest is not None
+            and jobid not in self.mapnodesubids
+            and self.procs[jobid] not in self._manifest_hits
+            and not isinstance(self.procs[jobid], MapNode)
+            and self._manifest_graph is not None
+            and self.procs[jobid] in self._manifest_graph
+        ):
+            try:
+                self.manifest.record_node(
+                    self.procs[jobid].output_dir(), self._manifest_signature(jobid)
+                )
+            except:
+                traceback.print_exc()
+
         # Implements signaling for generic node completion
         if jobid not in self.mapnodesubids:
             try:
@@ -419,7 +504,12 @@ class MonitoredMultiProcPlugin(MultiProcPlugin):
         gc.collect()
 
         # Submit jobs
+        self._manifest_graph = graph
         for jobid in jobids:
+            # Completed nodes are skipped before loading their inputs
+            if self._manifest_check(jobid):
+                continue
+
             # First expand mapnodes
             if isinstance(self.procs[jobid], MapNode):
                 try:
@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ResumeManifest:
+    """
+    Persistent record of the completed nodes of a workflow and of the files they produced.
+    Each file is stored with size, mtime, inode and a content hash computed once in background
+    after the node completion, so that on resume a node can be accepted with a lookup
+    instead of hashing its inputs.
+
+    """
+
+    FILE_NAME = "resume_manifest.sqlite"
+    HASH_CHUNK = 16 * 1024 * 1024
+
+    def __init__(self, manifest_file: str, strict: bool = False):
+        """
+        Parameters
+        ----------
+        manifest_file : str
+            The sqlite database path.
+        strict : bool, optional
+            If True, the recorded files are verified on lookup. The default is False.
+
+        """
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._hash_executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+        self._connection = sqlite3.connect(manifest_file, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS nodes "
+                "(output_dir TEXT PRIMARY KEY, signature TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                "output_dir TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, "
+                "inode INTEGER, content_hash TEXT)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS files_output_dir ON files (output_dir)"
+            )
+
+    @staticmethod
+    def content_hash(path: str) -> str:
+        """
+        Returns the sha256 of a file content.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(ResumeManifest.HASH_CHUNK), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_stat(path: str) -> tuple[int, int, int]:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def record_node(self, output_dir: str, signature: str):
+        """
+        Records a completed node with the files in its output directory.
+        Content hashes are computed in background.
+
+        Parameters
+        ----------
+        output_dir : str
+            The node output directory.
+        signature : str
+            The node signature, as computed by WorkflowDiff.node_signature.
+
+        """
+        files = []
+        for root, _, file_names in os.walk(output_dir):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    files.append((path, output_dir) + ResumeManifest.file_stat(path))
+                except OSError:
+                    continue
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM files WHERE output_dir = ?", (output_dir,)
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files "
+                "(path, output_dir, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?)",
+                files,
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO nodes (output_dir, signature) VALUES (?, ?)",
+                (output_dir, signature),
+            )
+
+        for path, _, size, mtime_ns, inode in files:
+            self._hash_executor.submit(self._store_hash, path, size, mtime_ns, inode)
+
+    def _store_hash(self, path: str, size: int, mtime_ns: int, inode: int):
+        try:
+            content_hash = ResumeManifest.content_hash(path)
+            # The file could change during hashing
+            if ResumeManifest.file_stat(path) != (size, mtime_ns, inode):
+                return
+        except OSError:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE files SET content_hash = ? "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (content_hash, path, size, mtime_ns, inode),
+            )
+
+    def forget_node(self, output_dir: str):
+        """
+        Removes a node and its files from the manifest, before it is executed again.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM nodes WHERE output_dir = ?", (output_dir,)
+            )
+            self._connection.execute(
+                "DELETE FROM files WHERE output_dir = ?", (output_dir,)
+            )
+
+    def is_valid(self, output_dir: str, signature: str) -> bool:
+        """
+        Checks if a node was completed with the same signature.
+        In strict mode, every recorded file must be unchanged: a file with different
+        stats is accepted only if its content hash is still the recorded one.
+
+        Parameters
+        ----------
+        output_dir : str
+            The node output directory.
+        signature : str
+            The current node signature.
+
+        Returns
+        -------
+        True if the node can be skipped.
+
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT signature FROM nodes WHERE output_dir = ?", (output_dir,)
+            ).fetchone()
+            if row is None or row[0] != signature:
+                return False
+            if not self.strict:
+                return True
+            files = self._connection.execute(
+                "SELECT path, size, mtime_ns, inode, content_hash FROM files "
+                "WHERE output_dir = ?",
+                (output_dir,),
+            ).fetchall()
+
+        for path, size, mtime_ns, inode, content_hash in files:
+            try:
+                stat = ResumeManifest.file_stat(path)
+                if stat == (size, mtime_ns, inode):
+                    continue
+                if (
+                    content_hash is None
+                    or ResumeManifest.content_hash(path) != content_hash
+                ):
+                    return False
+            except OSError:
+                return False
+            # Same content, the new stats spare the hashing next time
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "UPDATE files SET size = ?, mtime_ns = ?, inode = ? WHERE path = ?",
+                    stat + (path,),
+                )
+        return True
+
+    def close(self):
+        """
+        Waits for the pending content hashes and closes the database.
+        """
+        self._hash_executor.shutdown(wait=True)
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,600 @@
+from __future__ import annotations
+
+import io
+import os
+import sys
+import ast
+import json
+import time
+import shlex
+import pickle
+import shutil
+import socket
+import argparse
+import importlib
+import threading
+import traceback
+import subprocess
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+# This module must import only the standard library, as the server runs in FreeSurfer python
+
+
+def find_script(tool: str) -> str:
+    """
+    Returns the python script of a Synth tool, None if not found.
+    FreeSurfer bin commands may be shell wrappers of the python/scripts ones.
+    """
+    candidates = [shutil.which(tool)]
+    if "FREESURFER_HOME" in os.environ:
+        candidates.insert(
+            0, os.path.join(os.environ["FREESURFER_HOME"], "python", "scripts", tool)
+        )
+    for candidate in candidates:
+        if candidate is None:
+            continue
+        try:
+            with open(candidate, "rb") as file:
+                first_line = file.readline()
+        except OSError:
+            continue
+        if first_line.startswith(b"#!") and b"python" in first_line:
+            return candidate
+    return None
+
+
+def split_script(path: str) -> tuple:
+    """
+    Splits a script in its definitions (imports, functions, classes and constants)
+    and in the statements that execute a request.
+
+    Returns
+    -------
+    The compiled definitions and request statements.
+
+    """
+    with open(path, "r") as file:
+        module = ast.parse(file.read(), path)
+    definitions = []
+    statements = []
+    for node in module.body:
+        if isinstance(
+            node,
+            (
+                ast.Import,
+                ast.ImportFrom,
+                ast.FunctionDef,
+                ast.AsyncFunctionDef,
+                ast.ClassDef,
+            ),
+        ):
+            definitions.append(node)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)) and not any(
+            isinstance(child, ast.Call) for child in ast.walk(node)
+        ):
+            definitions.append(node)
+        else:
+            statements.append(node)
+    return (
+        compile(ast.Module(body=definitions, type_ignores=[]), path, "exec"),
+        compile(ast.Module(body=statements, type_ignores=[]), path, "exec"),
+    )
+
+
+def option_value(args: list[str], flags: list[str]):
+    """
+    Returns the value following the last of the flags in args, None if not found.
+    """
+    value = None
+    for index, arg in enumerate(args[:-1]):
+        if arg in flags:
+            value = args[index + 1]
+    return value
+
+
+class SynthTool:
+    """
+    Serves the requests of a FreeSurfer Synth command from models loaded by the server.
+    Subclasses parse the command arguments, load a model and run it.
+
+    """
+
+    NAME = None
+    # True if a loaded model can serve concurrent requests
+    THREAD_SAFE = False
+
+    def parse(self, args: list[str], cwd: str) -> dict:
+        """
+        Returns the request options, None if the request must be executed from the command line.
+        """
+        raise NotImplementedError
+
+    def model_key(self, options: dict) -> tuple:
+        """
+        Returns the model and the number of threads of a request.
+        """
+        raise NotImplementedError
+
+    def load(self, model, threads: int):
+        """
+        Returns the loaded model, kept by the backend for the following requests.
+        """
+        raise NotImplementedError
+
+    def run(self, loaded, options: dict) -> dict:
+        """
+        Executes a request with a loaded model.
+
+        Returns
+        -------
+        The dict with returncode, stdout and stderr.
+
+        """
+        raise NotImplementedError
+
+
+class SynthStripTool(SynthTool):
+    """
+    mri_synthstrip on the CPU. The network is built and its weights are read once for each
+    model file, using the model and the conform functions defined by the FreeSurfer script.
+
+    """
+
+    NAME = "mri_synthstrip"
+    THREAD_SAFE = True
+    MODEL_VERSION = "1"
+
+    def __init__(self):
+        self.definitions = None
+
+    def script_definitions(self) -> dict:
+        if self.definitions is None:
+            script = find_script(self.NAME)
+            if script is None:
+                raise FileNotFoundError("%s script not found" % self.NAME)
+            definitions = {"__name__": "swane_synthstrip", "__file__": script}
+            exec(split_script(script)[0], definitions)
+            for name in ["StripModel", "conform", "extend_sdt"]:
+                if name not in definitions:
+                    raise LookupError("%s not defined by %s" % (name, script))
+            self.definitions = definitions
+        return self.definitions
+
+    def parse(self, args: list[str], cwd: str) -> dict:
+        parser = argparse.ArgumentParser(prog=self.NAME, add_help=False)
+        parser.add_argument("-i", "--image", required=True)
+        parser.add_argument("-o", "--out")
+        parser.add_argument("-m", "--mask")
+        parser.add_argument("-b", "--border", type=float, default=1)
+        parser.add_argument("-t", "--threads", type=int)
+        parser.add_argument("--no-csf", action="store_true")
+        parser.add_argument("--model")
+        try:
+            options, unknown = parser.parse_known_args(args[1:])
+        except SystemExit:
+            return None
+        # eg. --gpu
+        if len(unknown) > 0:
+            return None
+        options = vars(options)
+        for name in ["image", "out", "mask", "model"]:
+            if options[name] is not None:
+                options[name] = os.path.join(cwd, options[name])
+        return options
+
+    def model_key(self, options: dict) -> tuple:
+        model = options["model"]
+        if model is None:
+            model = os.path.join(
+                os.environ.get("FREESURFER_HOME", ""),
+                "models",
+                "synthstrip.%s%s.pt"
+                % ("nocsf." if options["no_csf"] else "", self.MODEL_VERSION),
+            )
+        return model, options["threads"]
+
+    def load(self, model, threads: int):
+        import torch
+
+        definitions = self.script_definitions()
+        if threads is not None:
+            torch.set_num_threads(threads)
+        network = definitions["StripModel"]()
+        network.eval()
+        checkpoint = torch.load(model, map_location=torch.device("cpu"))
+        network.load_state_dict(checkpoint["model_state_dict"])
+        return network
+
+    def run(self, loaded, options: dict) -> dict:
+        import numpy as np
+        import torch
+        import surfa as sf
+
+        definitions = self.script_definitions()
+        image = sf.load_volume(options["image"])
+        if image.nframes > 1:
+            raise ValueError("multi-frame images are stripped from the command line")
+
+        conformed = definitions["conform"](image)
+        data = conformed.data.astype(np.float32)
+        data -= data.min()
+        data = (data / np.percentile(data, 99)).clip(0, 1)
+        with torch.no_grad():
+            sdt = loaded(torch.from_numpy(data[None, None, ...])).cpu().numpy()
+        sdt = definitions["extend_sdt"](
+            conformed.new(sdt.squeeze()), border=options["border"]
+        )
+        sdt = sdt.resample_like(image, fill=100)
+        mask = (sdt < options["border"]).connected_component_mask(k=1, fill=True)
+
+        if options["out"] is not None:
+            masked = image.copy()
+            masked[mask.data == 0] = np.min([0, image.min()])
+            masked.save(options["out"])
+        if options["mask"] is not None:
+            image.new(mask.data.astype(np.uint8)).save(options["mask"])
+        return {
+            "returncode": 0,
+            "stdout": "Running SynthStrip model version %s\n" % self.MODEL_VERSION,
+            "stderr": "",
+        }
+
+
+class ScriptTool(SynthTool):
+    """
+    Runs a FreeSurfer Synth script in process. The script imports and definitions are
+    executed once, while its FACTORIES are replaced by versions returning the models
+    built for the previous requests with the same arguments.
+    Scripts read sys.argv and the working directory, so their requests are executed
+    one at a time.
+
+    """
+
+    FACTORIES = []
+    THREADS_FLAGS = []
+    # sys.argv, the working directory and the standard streams are shared by the scripts
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.script = None
+        self.definitions = None
+        self.statements = None
+        self.resident = None
+
+    def parse(self, args: list[str], cwd: str) -> dict:
+        return {"args": args, "cwd": cwd}
+
+    def model_key(self, options: dict) -> tuple:
+        return None, option_value(options["args"], self.THREADS_FLAGS)
+
+    def resolve(self, name: str) -> tuple:
+        """
+        Returns the object owning a dotted name in the script definitions and the
+        attribute name, None if not found.
+        """
+        parts = name.split(".")
+        if parts[0] in self.definitions:
+            owner = self.definitions
+        else:
+            try:
+                owner = {parts[0]: importlib.import_module(parts[0])}
+            except ImportError:
+                return None
+        for part in parts[:-1]:
+            owner = (
+                owner[part] if isinstance(owner, dict) else getattr(owner, part, None)
+            )
+            if owner is None:
+                return None
+        if isinstance(owner, dict):
+            return (owner, parts[-1]) if parts[-1] in owner else None
+        return (owner, parts[-1]) if hasattr(owner, parts[-1]) else None
+
+    def make_resident(self, name: str, factory):
+        def resident_factory(*args, **kwargs):
+            try:
+                key = (name, pickle.dumps((args, kwargs)))
+            except Exception:
+                # Arguments that cannot be compared between requests
+                return factory(*args, **kwargs)
+            if key not in self.resident:
+                self.resident[key] = factory(*args, **kwargs)
+            return self.resident[key]
+
+        return resident_factory
+
+    def load(self, model, threads: int):
+        with ScriptTool.lock:
+            if self.definitions is None:
+                self.script = find_script(self.NAME)
+                if self.script is None:
+                    raise FileNotFoundError("%s script not found" % self.NAME)
+                definitions, self.statements = split_script(self.script)
+                self.definitions = {"__name__": "__main__", "__file__": self.script}
+                exec(definitions, self.definitions)
+                replaced = 0
+                for name in self.FACTORIES:
+                    found = self.resolve(name)
+                    if found is None:
+                        continue
+                    owner, attribute = found
+                    if isinstance(owner, dict):
+                        owner[attribute] = self.make_resident(name, owner[attribute])
+                    else:
+                        setattr(
+                            owner,
+                            attribute,
+                            self.make_resident(name, getattr(owner, attribute)),
+                        )
+                    replaced += 1
+                if replaced == 0:
+                    self.definitions = None
+                    raise LookupError("%s models cannot be kept loaded" % self.script)
+        # The factory results for this model and threads
+        return {}
+
+    def run(self, loaded, options: dict) -> dict:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        returncode = 0
+        with ScriptTool.lock:
+            old_argv = sys.argv
+            old_cwd = os.getcwd()
+            self.resident = loaded
+            try:
+                os.chdir(options["cwd"])
+                sys.argv = [self.script] + options["args"][1:]
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    # Functions keep the definitions as globals, the request variables do not
+                    exec(self.statements, dict(self.definitions))
+            except SystemExit as exit_exception:
+                if exit_exception.code is None:
+                    returncode = 0
+                elif isinstance(exit_exception.code, int):
+                    returncode = exit_exception.code
+                else:
+                    stderr.write(str(exit_exception.code))
+                    returncode = 1
+            finally:
+                self.resident = None
+                sys.argv = old_argv
+                os.chdir(old_cwd)
+
+        return {
+            "returncode": returncode,
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+        }
+
+
+class SynthSegTool(ScriptTool):
+    """
+    mri_synthseg, keeping the networks built by build_model.
+
+    """
+
+    NAME = "mri_synthseg"
+    FACTORIES = ["build_model"]
+    THREADS_FLAGS = ["--threads"]
+    MODEL_FLAGS = ["--parc", "--robust", "--v1", "--ct", "--photo"]
+
+    def model_key(self, options: dict) -> tuple:
+        model = " ".join(arg for arg in options["args"] if arg in self.MODEL_FLAGS)
+        return model, option_value(options["args"], self.THREADS_FLAGS)
+
+
+class SynthMorphTool(ScriptTool):
+    """
+    mri_synthmorph register, keeping the voxelmorph networks. The apply command has no
+    model and is executed from the command line.
+
+    """
+
+    NAME = "mri_synthmorph"
+    FACTORIES = [
+        "voxelmorph.networks.VxmAffineFeatureDetector",
+        "voxelmorph.networks.HyperVxmJoint",
+        "voxelmorph.networks.HyperVxmDense",
+    ]
+    THREADS_FLAGS = ["-j", "--threads"]
+
+    def parse(self, args: list[str], cwd: str) -> dict:
+        if len(args) < 2 or args[1] != "register":
+            return None
+        return super().parse(args, cwd)
+
+    def model_key(self, options: dict) -> tuple:
+        model = option_value(options["args"], ["-m", "--model"])
+        return model, option_value(options["args"], self.THREADS_FLAGS)
+
+
+class ResidentModelBackend:
+    """
+    Executes the Synth requests with models loaded once and kept in memory, keyed by
+    tool, model and threads. Requests for different models run concurrently, a model
+    not safe for concurrent use serves one request at a time.
+    A request that cannot be served in process is sent back to the command line.
+
+    """
+
+    def __init__(self, tools: list[SynthTool] = None):
+        """
+        Parameters
+        ----------
+        tools : list[SynthTool], optional
+            The served tools. The default are SynthStrip, SynthSeg and SynthMorph.
+
+        """
+        if tools is None:
+            tools = [SynthStripTool(), SynthSegTool(), SynthMorphTool()]
+        self.tools = {tool.NAME: tool for tool in tools}
+        self.models = {}
+        self.failed = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def model_lock(self, key: tuple) -> threading.Lock:
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def __call__(self, args: list[str], cwd: str) -> dict:
+        tool = self.tools.get(args[0])
+        if tool is None:
+            return {"fallback": True, "error": "unsupported command"}
+        options = tool.parse(args, cwd)
+        if options is None:
+            return {"fallback": True, "error": "unsupported arguments"}
+
+        key = (tool.NAME,) + tuple(tool.model_key(options))
+        with self.model_lock(key):
+            if key in self.failed:
+                return {"fallback": True, "error": self.failed[key]}
+            if key not in self.models:
+                try:
+                    self.models[key] = tool.load(*key[1:])
+                except Exception:
+                    # eg. missing framework, not loaded again at every request
+                    self.failed[key] = traceback.format_exc()
+                    return {"fallback": True, "error": self.failed[key]}
+            if not tool.THREAD_SAFE:
+                return tool.run(self.models[key], options)
+        return tool.run(self.models[key], options)
+
+
+class SynthRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            args = request["args"]
+            if len(args) == 0 or args[0] not in self.server.tools:
+                reply = {"fallback": True, "error": "unsupported command"}
+            else:
+                reply = self.server.backend(args, request["cwd"])
+        except Exception:
+            reply = {"fallback": True, "error": traceback.format_exc()}
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+class SynthModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Local server for FreeSurfer Synth tools, reached by the workflow nodes over a Unix socket.
+    Requests are the node command lines, executed by the backend with the models loaded
+    by the previous requests. Loaded models stay in memory until the workflow ends,
+    while the node memory reservations cover only the request being executed.
+
+    """
+
+    SOCKET_ENV = "SWANE_SYNTH_SOCKET"
+    TOOLS = ["mri_synthstrip", "mri_synthseg", "mri_synthmorph"]
+    START_TIMEOUT = 30
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, backend=None, tools: list[str] = None):
+        """
+        Parameters
+        ----------
+        socket_path : str
+            The Unix socket path.
+        backend : callable, optional
+            Executes a request, called with the argument list and the working directory.
+            The default is a ResidentModelBackend.
+        tools : list[str], optional
+            The accepted commands. The default is TOOLS.
+
+        """
+        self.backend = backend if backend is not None else ResidentModelBackend()
+        self.tools = tools if tools is not None else SynthModelServer.TOOLS
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, SynthRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+    @staticmethod
+    def request(socket_path: str, cmdline: str, cwd: str) -> dict:
+        """
+        Sends a command line to the server and waits for its execution.
+
+        Parameters
+        ----------
+        socket_path : str
+            The Unix socket path.
+        cmdline : str
+            The Synth tool command line.
+        cwd : str
+            The working directory of the command.
+
+        Returns
+        -------
+        The dict with returncode, stdout and stderr, None if the command must be
+        executed from the command line.
+
+        """
+        request = json.dumps({"args": shlex.split(cmdline), "cwd": cwd})
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                client.sendall(request.encode("utf-8") + b"\n")
+                with client.makefile("rb") as reply_file:
+                    reply = json.loads(reply_file.readline())
+        except (OSError, ValueError):
+            return None
+        if reply.get("fallback", False):
+            return None
+        return reply
+
+    @staticmethod
+    def start(socket_path: str) -> subprocess.Popen:
+        """
+        Launches the server in FreeSurfer python and waits until it accepts connections.
+
+        Returns
+        -------
+        The server process, None if it could not be started.
+
+        """
+        interpreter = shutil.which("fspython")
+        if interpreter is None and "FREESURFER_HOME" in os.environ:
+            interpreter = os.path.join(os.environ["FREESURFER_HOME"], "bin", "fspython")
+        if interpreter is None or not os.path.exists(interpreter):
+            return None
+
+        process = subprocess.Popen(
+            [interpreter, os.path.abspath(__file__), socket_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + SynthModelServer.START_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(socket_path)
+                return process
+            except OSError:
+                time.sleep(0.2)
+        SynthModelServer.stop(process)
+        return None
+
+    @staticmethod
+    def stop(process: subprocess.Popen):
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == "__main__":
+    with SynthModelServer(sys.argv[1]) as server:
+        server.serve_forever()
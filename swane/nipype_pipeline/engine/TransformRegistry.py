@@ -0,0 +1,241 @@
+from nipype import logging
+from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
+from swane.nipype_pipeline.workflows.nonlinear_reg_workflow import (
+    nonlinear_reg_workflow,
+)
+
+logger = logging.getLogger("nipype.workflow")
+
+
+class TransformSpace:
+    def __init__(
+        self,
+        name: str,
+        source: str | list[CustomWorkflow | str],
+        long_name: str,
+        template: str = None,
+        resolution: float = 0,
+        head_source: str | list[CustomWorkflow | str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        name : str
+            The space name.
+        source : str | list[CustomWorkflow | str]
+            The brain image of the space, as file path or as [workflow, "node.field"].
+        long_name : str
+            The space name displayed in the GUI.
+        template : str, optional
+            The template family. Spaces of the same template (eg. MNI152 1mm and 2mm)
+            share the registration, computed at the finest requested resolution.
+        resolution : float, optional
+            The template resolution in mm.
+        head_source : str | list[CustomWorkflow | str], optional
+            The image of the space with skull, used by the nonlinear step of the
+            registration while the linear one uses the brain. The default is None.
+
+        """
+        self.name = name
+        self.source = source
+        self.head_source = head_source
+        self.long_name = long_name
+        self.family = template if template is not None else name
+        self.resolution = resolution
+
+
+class TransformRequest:
+    def __init__(self, key: tuple, moving: TransformSpace, reference: TransformSpace):
+        self.key = key
+        self.moving = moving
+        self.reference = reference
+        self.forward_consumers = []
+        self.inverse_consumers = []
+
+    def connect_forward(self, consumer: CustomWorkflow, field: str):
+        """
+        Connects the moving to reference warp to a consumer input ("node.field").
+        """
+        self.forward_consumers.append((consumer, field))
+
+    def connect_inverse(self, consumer: CustomWorkflow, field: str):
+        """
+        Connects the reference to moving warp to a consumer input ("node.field").
+        """
+        self.inverse_consumers.append((consumer, field))
+
+
+class TransformRegistry:
+    """
+    Subject level registry of the nonlinear registrations between image spaces.
+    Sub-workflows request a transform instead of building their own registration chain.
+    Requests are canonicalised (direction and template resolution are not part of the key),
+    each unique registration is built once and every consumer gets the forward or inverse warp.
+
+    """
+
+    FORWARD_FIELD = "outputnode.fieldcoeff_file"
+    INVERSE_FIELD = "outputnode.inverse_warp"
+
+    def __init__(self, workflow: CustomWorkflow):
+        """
+        Parameters
+        ----------
+        workflow : CustomWorkflow
+            The subject workflow that will contain the registrations.
+
+        """
+        self.workflow = workflow
+        self.spaces = {}
+        self.requests = []
+        self.registrations = {}
+
+    def add_space(
+        self,
+        name: str,
+        source: str | list[CustomWorkflow | str],
+        long_name: str,
+        template: str = None,
+        resolution: float = 0,
+        head_source: str | list[CustomWorkflow | str] = None,
+    ):
+        self.spaces[name] = TransformSpace(
+            name,
+            source,
+            long_name,
+            template=template,
+            resolution=resolution,
+            head_source=head_source,
+        )
+
+    def canonical_key(self, moving: str, reference: str, use_synth: bool) -> tuple:
+        """
+        Returns the key shared by the requests satisfied by the same registration.
+        """
+        families = sorted([self.spaces[moving].family, self.spaces[reference].family])
+        return tuple(families) + (use_synth,)
+
+    def request(self, moving: str, reference: str, use_synth: bool) -> TransformRequest:
+        """
+        Requests the nonlinear registration between two spaces added with add_space.
+
+        Parameters
+        ----------
+        moving : str
+            The moving space name.
+        reference : str
+            The reference space name.
+        use_synth : bool
+            If True, the registration is computed by SynthMorph, else by FLIRT+FNIRT.
+
+        Returns
+        -------
+        The request, whose warps are connected to the consumers by build().
+
+        """
+        transform_request = TransformRequest(
+            self.canonical_key(moving, reference, use_synth),
+            self.spaces[moving],
+            self.spaces[reference],
+        )
+        self.requests.append(transform_request)
+        return transform_request
+
+    def _finest_space(self, family: str, key: tuple) -> TransformSpace:
+        candidates = []
+        for transform_request in self.requests:
+            if transform_request.key != key:
+                continue
+            for space in (transform_request.moving, transform_request.reference):
+                if space.family == family:
+                    candidates.append(space)
+        return min(candidates, key=lambda space: space.resolution)
+
+    def _connect_source(
+        self, source: str | list[CustomWorkflow | str], registration, field: str
+    ):
+        if type(source) == str:
+            setattr(registration.get_node("inputnode").inputs, field, source)
+        else:
+            self.workflow.connect(
+                source[0], source[1], registration, "inputnode." + field
+            )
+
+    def build(self):
+        """
+        Adds every unique registration to the subject workflow and connects the
+        consumers of all the requests. Must be called once, after all the requests.
+        """
+        # Requests without consumers do not need a registration
+        self.requests = [
+            transform_request
+            for transform_request in self.requests
+            if transform_request.forward_consumers
+            or transform_request.inverse_consumers
+        ]
+        for transform_request in self.requests:
+            key = transform_request.key
+            if key not in self.registrations:
+                # The first request sets the direction of the registration
+                moving = self._finest_space(transform_request.moving.family, key)
+                reference = self._finest_space(transform_request.reference.family, key)
+                name = "%s_2_%s" % (moving.family, reference.family)
+                if key[-1]:
+                    name += "_synth"
+                registration = nonlinear_reg_workflow(
+                    name=name,
+                    synth_config=None,
+                    use_synth=key[-1],
+                    in_file_head=moving.head_source is not None,
+                    atlas_head=reference.head_source is not None,
+                )
+                registration.long_name = "%s to %s registration" % (
+                    moving.long_name,
+                    reference.long_name,
+                )
+                self._connect_source(moving.source, registration, "in_file")
+                self._connect_source(reference.source, registration, "atlas")
+                if moving.head_source is not None:
+                    self._connect_source(
+                        moving.head_source, registration, "in_file_head"
+                    )
+                if reference.head_source is not None:
+                    self._connect_source(
+                        reference.head_source, registration, "atlas_head"
+                    )
+                self.registrations[key] = (registration, moving.family)
+
+            registration, moving_family = self.registrations[key]
+            if transform_request.moving.family == moving_family:
+                forward_field = TransformRegistry.FORWARD_FIELD
+                inverse_field = TransformRegistry.INVERSE_FIELD
+            else:
+                forward_field = TransformRegistry.INVERSE_FIELD
+                inverse_field = TransformRegistry.FORWARD_FIELD
+            for consumer, field in transform_request.forward_consumers:
+                self.workflow.connect(registration, forward_field, consumer, field)
+            for consumer, field in transform_request.inverse_consumers:
+                self.workflow.connect(registration, inverse_field, consumer, field)
+
+        logger.info(self.report())
+
+    def get_registration(self, key: tuple) -> CustomWorkflow:
+        """
+        Returns the registration workflow built for a request key, None if not built.
+        """
+        if key not in self.registrations:
+            return None
+        return self.registrations[key][0]
+
+    def redundant_registrations(self) -> int:
+        """
+        Returns the number of registrations that would be built without the registry.
+        """
+        return len(self.requests) - len(self.registrations)
+
+    def report(self) -> str:
+        return "%d registrations requested, %d built, %d redundant removed" % (
+            len(self.requests),
+            len(self.registrations),
+            self.redundant_registrations(),
+        )
@@ -0,0 +1,318 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import networkx as nx
+from nipype.interfaces.base import isdefined
+from nipype.utils.filemanip import loadpkl
+from nipype.interfaces.base.traits_extension import BasePath
+from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
+
+
+class WorkflowDiff:
+    """
+    Compares a workflow with the signatures of its previous execution, node by node.
+    A node signature covers its interface, its hashed inputs, the stats of its input files
+    and its incoming connections, so only the nodes whose signature changed, and their descendants, need to re-run.
+
+    """
+
+    SIGNATURE_FILE = "workflow_signatures.json"
+
+    def __init__(self, old_signatures: dict, workflow: CustomWorkflow):
+        """
+        Parameters
+        ----------
+        old_signatures : dict
+            The signatures of the previous execution, as returned by signatures().
+        workflow : CustomWorkflow
+            The new workflow, with base_dir set.
+
+        """
+        graph = workflow._create_flat_graph()
+        self.new_signatures = WorkflowDiff.signatures(workflow, graph)
+        self.old_signatures = old_signatures
+
+        changed = {
+            node
+            for node in graph.nodes()
+            if WorkflowDiff._signature_of(old_signatures, node.fullname)
+            != self.new_signatures[node.fullname]["signature"]
+        }
+        affected = set(changed)
+        for node in changed:
+            affected.update(nx.descendants(graph, node))
+
+        # Topological order, as the nodes will be executed
+        self.changed_nodes = [
+            node.fullname for node in nx.topological_sort(graph) if node in changed
+        ]
+        self.rerun_nodes = [
+            node.fullname for node in nx.topological_sort(graph) if node in affected
+        ]
+        self.removed_nodes = sorted(
+            set(old_signatures.keys()) - set(self.new_signatures.keys())
+        )
+        self.estimated_seconds, self.unknown_cost_nodes = self._estimate_cost()
+
+    @staticmethod
+    def _signature_of(signatures: dict, fullname: str) -> str:
+        if fullname not in signatures:
+            return None
+        return signatures[fullname]["signature"]
+
+    @staticmethod
+    def is_existing_path(trait_type) -> bool:
+        """
+        Returns True for File and Directory traits, or lists of them, that must exist.
+        """
+        if isinstance(trait_type, BasePath):
+            return trait_type.exists
+        inner_traits = getattr(trait_type, "inner_traits", None)
+        if not callable(inner_traits):
+            return False
+        return any(
+            WorkflowDiff.is_existing_path(inner.trait_type) for inner in inner_traits()
+        )
+
+    @staticmethod
+    def path_stamp(value) -> list[str]:
+        """
+        Describes the existing files and folders referenced by an input value, so that a
+        file changed on disk at the same path changes the signature.
+
+        Parameters
+        ----------
+        value
+            An input value, a path or a list of them.
+
+        Returns
+        -------
+        A "path:size:mtime" entry for every file, folder content included.
+
+        """
+        if isinstance(value, (list, tuple)):
+            stamps = []
+            for item in value:
+                stamps.extend(WorkflowDiff.path_stamp(item))
+            return stamps
+        if not isinstance(value, str) or not os.path.isabs(value):
+            return []
+
+        paths = []
+        if os.path.isfile(value):
+            paths.append(value)
+        elif os.path.isdir(value):
+            # eg. the DICOM folders of the input series
+            for folder, _, files in os.walk(value):
+                paths.extend(os.path.join(folder, file) for file in files)
+        stamps = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamps.append("%s:%d:%d" % (path, stat.st_size, stat.st_mtime_ns))
+        return stamps
+
+    @staticmethod
+    def node_signature(node, graph: nx.DiGraph) -> str:
+        """
+        Computes the signature of a node in a flat graph.
+
+        Parameters
+        ----------
+        node : Node
+            The node.
+        graph : nx.DiGraph
+            The flat graph of the workflow.
+
+        Returns
+        -------
+        The sha256 of the node interface, inputs, input files and incoming connections.
+
+        """
+        connections = []
+        connected_inputs = set()
+        for source in graph.predecessors(node):
+            for source_output, dest_input in graph.get_edge_data(source, node)[
+                "connect"
+            ]:
+                connections.append(
+                    "%s:%r->%s" % (source.fullname, source_output, dest_input)
+                )
+                connected_inputs.add(dest_input)
+
+        interface = node.interface
+        items = [
+            "%s.%s" % (type(interface).__module__, type(interface).__name__),
+            repr(getattr(node, "iterfield", None)),
+        ]
+        # Connected inputs are set only at execution, the connection stands for them
+        for name, value in sorted(node.inputs.get().items()):
+            trait = node.inputs.trait(name)
+            if (
+                name in connected_inputs
+                or not isdefined(value)
+                or trait is None
+                or trait.nohash
+            ):
+                continue
+            items.append("%s=%r" % (name, value))
+            if trait.hash_files is not False and WorkflowDiff.is_existing_path(
+                trait.trait_type
+            ):
+                items.extend(WorkflowDiff.path_stamp(value))
+        items.extend(sorted(connections))
+        return hashlib.sha256("\n".join(items).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def signatures(workflow: CustomWorkflow, graph: nx.DiGraph = None) -> dict:
+        """
+        Computes the signature, the long name and the output directory of every node.
+
+        Parameters
+        ----------
+        workflow : CustomWorkflow
+            The workflow, with base_dir set.
+        graph : nx.DiGraph, optional
+            The flat graph of the workflow, computed if not provided.
+
+        Returns
+        -------
+        A dict of node info keyed by node fullname.
+
+        """
+        if graph is None:
+            graph = workflow._create_flat_graph()
+        signatures = {}
+        for node in graph.nodes():
+            output_dir = os.path.join(
+                workflow.base_dir, *(node._hierarchy or "").split("."), node.name
+            )
+            signatures[node.fullname] = {
+                "signature": WorkflowDiff.node_signature(node, graph),
+                "long_name": CustomWorkflow.format_node_name(node),
+                "output_dir": output_dir,
+            }
+        return signatures
+
+    @staticmethod
+    def save(signatures: dict, workflow_dir: str):
+        """
+        Writes the signatures in the workflow directory.
+        """
+        os.makedirs(workflow_dir, exist_ok=True)
+        signature_file = os.path.join(workflow_dir, WorkflowDiff.SIGNATURE_FILE)
+        with open(signature_file + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(signatures, file)
+        os.replace(signature_file + ".tmp", signature_file)
+
+    @staticmethod
+    def load(workflow_dir: str) -> dict:
+        """
+        Reads the signatures of the previous execution.
+
+        Returns
+        -------
+        The signatures dict or None if not found or unreadable.
+
+        """
+        signature_file = os.path.join(workflow_dir, WorkflowDiff.SIGNATURE_FILE)
+        try:
+            with open(signature_file, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def executed_dirs(output_dir: str) -> list[str]:
+        """
+        Returns the existing directories of a node, including the ones of each iterables
+        parameterization, created by nipype as "_parameter" sub-folders of the node parent.
+
+        """
+        parent, name = os.path.split(output_dir)
+        dirs = glob.glob(
+            os.path.join(glob.escape(parent), "_*", "**", glob.escape(name)),
+            recursive=True,
+        )
+        if os.path.isdir(output_dir):
+            dirs.insert(0, output_dir)
+        return dirs
+
+    def _estimate_cost(self) -> tuple[float, int]:
+        """
+        Sums the durations of the previous execution of the nodes to re-run.
+
+        Returns
+        -------
+        The estimated seconds and the number of nodes without a previous duration.
+
+        """
+        seconds = 0.0
+        unknown = 0
+        for fullname in self.rerun_nodes:
+            output_dir = self.new_signatures[fullname]["output_dir"]
+            name = os.path.basename(output_dir)
+            # Missing result files are skipped, nipype loaders wait for them to appear
+            result_files = [
+                os.path.join(executed_dir, "result_%s.pklz" % name)
+                for executed_dir in WorkflowDiff.executed_dirs(output_dir)
+            ]
+            result_files = [file for file in result_files if os.path.isfile(file)]
+            if len(result_files) == 0:
+                unknown += 1
+                continue
+            for result_file in result_files:
+                try:
+                    seconds += float(loadpkl(result_file).runtime.duration)
+                except Exception:
+                    unknown += 1
+        return seconds, unknown
+
+    def invalidate(self):
+        """
+        Deletes the previous outputs of the nodes to re-run, so nipype cannot reuse them.
+        """
+        for fullname in self.rerun_nodes:
+            for executed_dir in WorkflowDiff.executed_dirs(
+                self.new_signatures[fullname]["output_dir"]
+            ):
+                shutil.rmtree(executed_dir, ignore_errors=True)
+
+    def is_empty(self) -> bool:
+        return len(self.rerun_nodes) == 0
+
+    def summary(self) -> str:
+        """
+        Returns
+        -------
+        The number of nodes to re-run and their estimated cost.
+
+        """
+        summary = "%d nodes will re-run (%d changed), estimated time %d min" % (
+            len(self.rerun_nodes),
+            len(self.changed_nodes),
+            round(self.estimated_seconds / 60),
+        )
+        if self.unknown_cost_nodes > 0:
+            summary += " plus %d nodes never executed" % self.unknown_cost_nodes
+        return summary
+
+    def report(self) -> str:
+        """
+        Returns
+        -------
+        The summary followed by the list of the nodes to re-run, changed ones marked by *.
+
+        """
+        lines = [self.summary()]
+        for fullname in self.rerun_nodes:
+            marker = "*" if fullname in self.changed_nodes else " "
+            lines.append(
+                "%s %s (%s)"
+                % (marker, self.new_signatures[fullname]["long_name"], fullname)
+            )
+        return "\n".join(lines)
@@ -0,0 +1,231 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import shlex
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    InputMultiPath,
+    OutputMultiPath,
+    CommandLine,
+    isdefined,
+)
+from nipype.interfaces.fsl import ConvertWarp
+from nipype.utils.filemanip import split_filename
+from swane.nipype_pipeline.nodes.PackMasks import PackMasks
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class BatchApplyWarpInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(
+        File(exists=True), mandatory=True, desc="the label images to warp"
+    )
+    warp_file = File(
+        exists=True,
+        mandatory=True,
+        desc="the FNIRT coefficient file or the SynthMorph warp file",
+    )
+    ref_file = File(exists=True, mandatory=True, desc="the reference image")
+    use_synth = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Set to True if warp_file comes from SynthMorph",
+    )
+    out_files = traits.List(File, desc="the output images, one for each input")
+    unpack_masks = traits.Int(
+        0,
+        usedefault=True,
+        desc="if greater than 0, in_files are PackMasks bundles of this number of masks "
+        "and out_files are the unpacked warped masks",
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class BatchApplyWarpOutputSpec(TraitedSpec):
+    out_files = OutputMultiPath(File(), desc="the warped label images")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class BatchApplyWarp(BaseInterface):
+    """
+    Applies one nonlinear warp to many label images with nearest neighbour interpolation and uint8 output.
+    The warp is loaded once: FSL coefficients are converted into a single absolute field that is
+    sampled in-process for every image, SynthMorph warps are applied with one mri_synthmorph call.
+
+    """
+
+    input_spec = BatchApplyWarpInputSpec
+    output_spec = BatchApplyWarpOutputSpec
+
+    ABS_WARP_FILE = "abs_warp.nii.gz"
+
+    @staticmethod
+    def fsl_scaled_voxel_affine(img) -> np.ndarray:
+        """
+        Returns the affine from voxel indexes to FSL scaled mm coordinates,
+        with x axis flipped for images with neurological (positive determinant) orientation.
+        """
+        shape = img.shape
+        zooms = img.header.get_zooms()[:3]
+        affine = np.diag(list(zooms) + [1.0])
+        if np.linalg.det(img.affine[:3, :3]) > 0:
+            affine[0, 0] = -zooms[0]
+            affine[0, 3] = (shape[0] - 1) * zooms[0]
+        return affine
+
+    @staticmethod
+    def warp_indexes(abs_warp: np.ndarray, in_img) -> tuple:
+        """
+        Converts an FSL absolute warp field into nearest neighbour voxel indexes of the input image.
+
+        Returns
+        -------
+        The tuple of x, y, z indexes of the valid voxels and the mask of valid reference voxels
+        """
+        to_voxel = np.linalg.inv(BatchApplyWarp.fsl_scaled_voxel_affine(in_img))
+        coords = abs_warp.reshape(-1, 3) @ to_voxel[:3, :3].T + to_voxel[:3, 3]
+        indexes = np.rint(coords).astype(np.int64)
+        valid = np.all((indexes >= 0) & (indexes < np.array(in_img.shape[:3])), axis=1)
+        indexes = indexes[valid]
+        return (indexes[:, 0], indexes[:, 1], indexes[:, 2]), valid
+
+    @staticmethod
+    def iter_resampled_labels(abs_warp_nii, in_files: list):
+        """
+        Yields every label image resampled in the absolute warp reference space as uint8 array.
+        Voxel indexes are computed once for each distinct input geometry.
+        """
+        abs_warp = np.asarray(abs_warp_nii.dataobj, dtype=np.float32)
+        ref_shape = abs_warp.shape[:3]
+        index_cache = {}
+        for in_file in in_files:
+            in_img = nib.load(in_file)
+            key = (in_img.shape[:3], in_img.affine.tobytes())
+            if key not in index_cache:
+                index_cache[key] = BatchApplyWarp.warp_indexes(abs_warp, in_img)
+            indexes, valid = index_cache[key]
+
+            labels = np.asanyarray(in_img.dataobj)
+            if labels.ndim > 3:
+                labels = labels[..., 0]
+            out = np.zeros(int(np.prod(ref_shape)), dtype=np.uint8)
+            out[valid] = np.clip(np.rint(labels[indexes]), 0, 255)
+            yield out.reshape(ref_shape)
+
+    @staticmethod
+    def save_labels(labels: np.ndarray, ref_nii, out_file: str):
+        out_nii = nib.Nifti1Image(labels, ref_nii.affine, ref_nii.header)
+        out_nii.set_data_dtype(np.uint8)
+        out_nii.header.set_slope_inter(1, 0)
+        out_nii.header.set_intent("none")
+        nib.save(out_nii, out_file)
+
+    @staticmethod
+    def resample_labels(abs_warp_nii, in_files: list, out_files: list):
+        """
+        Resamples every label image in the absolute warp reference space.
+        """
+        for labels, out_file in zip(
+            BatchApplyWarp.iter_resampled_labels(abs_warp_nii, in_files), out_files
+        ):
+            BatchApplyWarp.save_labels(labels, abs_warp_nii, out_file)
+
+    @staticmethod
+    def unpack_labels(packed_volumes, ref_nii, out_files: list):
+        """
+        Unpacks warped PackMasks bundle volumes in memory and saves every mask.
+        """
+        packed = np.stack(list(packed_volumes))
+        for mask, out_file in zip(PackMasks.unpack(packed, len(out_files)), out_files):
+            BatchApplyWarp.save_labels(mask, ref_nii, out_file)
+
+    @staticmethod
+    def synth_apply_args(warp_file: str, in_files: list, out_files: list) -> str:
+        """
+        Returns the mri_synthmorph apply arguments to warp every input file in its output file.
+        mri_synthmorph apply accepts many input/output pairs for the same warp.
+        """
+        paths = [warp_file]
+        for in_file, out_file in zip(in_files, out_files):
+            paths.extend([in_file, out_file])
+        return "-m nearest -t uint8 " + " ".join(shlex.quote(path) for path in paths)
+
+    def _run_interface(self, runtime):
+        out_files = self._gen_outfilenames()
+        if self.inputs.unpack_masks > 0:
+            # Bundles are warped in place of the masks and unpacked afterwards
+            warped_files = [
+                abspath("packed_%d.nii.gz" % index)
+                for index in range(len(self.inputs.in_files))
+            ]
+        else:
+            warped_files = out_files
+
+        if self.inputs.use_synth:
+            synth_apply = CommandLine(
+                "mri_synthmorph apply",
+                args=BatchApplyWarp.synth_apply_args(
+                    self.inputs.warp_file, self.inputs.in_files, warped_files
+                ),
+                terminal_output="allatonce",
+            )
+            synth_apply.run()
+            if self.inputs.unpack_masks > 0:
+                BatchApplyWarp.unpack_labels(
+                    [np.asanyarray(nib.load(f).dataobj) for f in warped_files],
+                    nib.load(warped_files[0]),
+                    out_files,
+                )
+        else:
+            # Evaluate the spline coefficients only once in an absolute field
+            convert_warp = ConvertWarp()
+            convert_warp.inputs.reference = self.inputs.ref_file
+            convert_warp.inputs.warp1 = self.inputs.warp_file
+            convert_warp.inputs.out_abswarp = True
+            convert_warp.inputs.out_file = abspath(BatchApplyWarp.ABS_WARP_FILE)
+            convert_warp.run()
+
+            abs_warp_nii = nib.load(abspath(BatchApplyWarp.ABS_WARP_FILE))
+            if self.inputs.unpack_masks > 0:
+                BatchApplyWarp.unpack_labels(
+                    BatchApplyWarp.iter_resampled_labels(
+                        abs_warp_nii, self.inputs.in_files
+                    ),
+                    abs_warp_nii,
+                    out_files,
+                )
+            else:
+                BatchApplyWarp.resample_labels(
+                    abs_warp_nii, self.inputs.in_files, out_files
+                )
+
+        return runtime
+
+    def _gen_outfilenames(self):
+        if self.inputs.unpack_masks > 0:
+            n_outputs = self.inputs.unpack_masks
+        else:
+            n_outputs = len(self.inputs.in_files)
+        if isdefined(self.inputs.out_files) and len(self.inputs.out_files) == n_outputs:
+            return [abspath(out_file) for out_file in self.inputs.out_files]
+        if self.inputs.unpack_masks > 0:
+            return [
+                abspath("%d_mask_warped.nii.gz" % index) for index in range(n_outputs)
+            ]
+
+        # Protocol masks often share the same file name, prefix them with their index
+        out_files = []
+        for index, in_file in enumerate(self.inputs.in_files):
+            _, base, ext = split_filename(in_file)
+            out_files.append(abspath("%d_%s_warped%s" % (index, base, ext)))
+        return out_files
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_files"] = self._gen_outfilenames()
+        return outputs
@@ -0,0 +1,108 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from scipy import ndimage
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    InputMultiPath,
+    OutputMultiPath,
+    isdefined,
+)
+from nipype.utils.filemanip import split_filename
+from swane.nipype_pipeline.nodes.BatchApplyWarp import BatchApplyWarp
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class BatchApplyXFMInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(File(exists=True), mandatory=True, desc="the images")
+    reference = File(exists=True, mandatory=True, desc="the reference image")
+    in_matrix_file = File(
+        exists=True, mandatory=True, desc="the FLIRT matrix from input to reference"
+    )
+    interp = traits.Enum(
+        "trilinear",
+        "nearestneighbour",
+        usedefault=True,
+        desc="the interpolation method",
+    )
+    out_files = traits.List(File, desc="the output images, one for each input")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class BatchApplyXFMOutputSpec(TraitedSpec):
+    out_files = OutputMultiPath(File(exists=True), desc="the images in reference space")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class BatchApplyXFM(BaseInterface):
+    """
+    In-process equivalent of flirt -applyxfm for many images with the same matrix and reference.
+    Sampling coordinates are computed once for each distinct input geometry.
+
+    """
+
+    input_spec = BatchApplyXFMInputSpec
+    output_spec = BatchApplyXFMOutputSpec
+
+    @staticmethod
+    def reference_coordinates(matrix: np.ndarray, in_img, ref_img) -> np.ndarray:
+        """
+        Returns the input voxel coordinates of every reference voxel, as a (3, n_voxels) array.
+        """
+        in_from_ref = (
+            np.linalg.inv(BatchApplyWarp.fsl_scaled_voxel_affine(in_img))
+            @ np.linalg.inv(matrix)
+            @ BatchApplyWarp.fsl_scaled_voxel_affine(ref_img)
+        )
+        ref_indexes = np.indices(ref_img.shape[:3]).reshape(3, -1)
+        return in_from_ref[:3, :3] @ ref_indexes + in_from_ref[:3, 3:4]
+
+    def _run_interface(self, runtime):
+        ref_img = nib.load(self.inputs.reference)
+        matrix = np.loadtxt(self.inputs.in_matrix_file)
+        order = 1 if self.inputs.interp == "trilinear" else 0
+
+        coords_cache = {}
+        for in_file, out_file in zip(self.inputs.in_files, self._gen_outfilenames()):
+            in_img = nib.load(in_file)
+            key = (in_img.shape[:3], in_img.affine.tobytes())
+            if key not in coords_cache:
+                coords_cache[key] = BatchApplyXFM.reference_coordinates(
+                    matrix, in_img, ref_img
+                )
+
+            data = np.asarray(in_img.dataobj, dtype=np.float32)
+            if data.ndim > 3:
+                data = data[..., 0]
+            resampled = ndimage.map_coordinates(
+                data, coords_cache[key], order=order, mode="constant", cval=0
+            ).reshape(ref_img.shape[:3])
+
+            out_nii = nib.Nifti1Image(resampled, ref_img.affine, ref_img.header)
+            out_nii.set_data_dtype(np.float32)
+            out_nii.header.set_slope_inter(1, 0)
+            nib.save(out_nii, out_file)
+
+        return runtime
+
+    def _gen_outfilenames(self):
+        if isdefined(self.inputs.out_files) and len(self.inputs.out_files) == len(
+            self.inputs.in_files
+        ):
+            return [abspath(out_file) for out_file in self.inputs.out_files]
+        out_files = []
+        for index, in_file in enumerate(self.inputs.in_files):
+            _, base, ext = split_filename(in_file)
+            out_files.append(abspath("%d_%s_flirt%s" % (index, base, ext)))
+        return out_files
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_files"] = self._gen_outfilenames()
+        return outputs
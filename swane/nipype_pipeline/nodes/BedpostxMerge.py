@@ -0,0 +1,114 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    OutputMultiPath,
+)
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class BedpostxMergeInputSpec(BaseInterfaceInputSpec):
+    mask = File(
+        exists=True, mandatory=True, desc="the full bet binary mask, for geometry"
+    )
+    chunk_slices = traits.List(
+        traits.List(traits.Int),
+        mandatory=True,
+        desc="the first and last+1 z slice of every chunk",
+    )
+    fsamples = traits.List(
+        traits.List(File(exists=True)),
+        mandatory=True,
+        desc="the f samples of every fibre for each chunk",
+    )
+    phsamples = traits.List(
+        traits.List(File(exists=True)),
+        mandatory=True,
+        desc="the phi samples of every fibre for each chunk",
+    )
+    thsamples = traits.List(
+        traits.List(File(exists=True)),
+        mandatory=True,
+        desc="the theta samples of every fibre for each chunk",
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class BedpostxMergeOutputSpec(TraitedSpec):
+    merged_fsamples = OutputMultiPath(
+        File(exists=True), desc="the merged f samples of every fibre"
+    )
+    merged_phsamples = OutputMultiPath(
+        File(exists=True), desc="the merged phi samples of every fibre"
+    )
+    merged_thsamples = OutputMultiPath(
+        File(exists=True), desc="the merged theta samples of every fibre"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class BedpostxMerge(BaseInterface):
+    """
+    Merges the xfibres samples of every chunk in full volumes, like bedpostx postprocessing.
+
+    """
+
+    input_spec = BedpostxMergeInputSpec
+    output_spec = BedpostxMergeOutputSpec
+
+    SAMPLES = {
+        "merged_fsamples": ("fsamples", "merged_f%dsamples.nii.gz"),
+        "merged_phsamples": ("phsamples", "merged_ph%dsamples.nii.gz"),
+        "merged_thsamples": ("thsamples", "merged_th%dsamples.nii.gz"),
+    }
+
+    def _merge(self, chunk_files: list, out_file: str):
+        mask_nii = nib.load(self.inputs.mask)
+        merged = None
+        for chunk_file, (z0, z1) in zip(chunk_files, self.inputs.chunk_slices):
+            chunk = np.asarray(nib.load(chunk_file).dataobj, dtype=np.float32)
+            if chunk.ndim == 3:
+                chunk = chunk[..., np.newaxis]
+            if merged is None:
+                merged = np.zeros(mask_nii.shape[:3] + chunk.shape[3:], np.float32)
+            merged[:, :, z0:z1] = chunk
+
+        out_nii = nib.Nifti1Image(merged, mask_nii.affine, mask_nii.header)
+        out_nii.set_data_dtype(np.float32)
+        out_nii.header.set_slope_inter(1, 0)
+        nib.save(out_nii, out_file)
+
+    def _run_interface(self, runtime):
+        if not (
+            len(self.inputs.chunk_slices)
+            == len(self.inputs.fsamples)
+            == len(self.inputs.phsamples)
+            == len(self.inputs.thsamples)
+        ):
+            raise RuntimeError("Chunk number mismatch")
+
+        for output, (input_name, out_template) in BedpostxMerge.SAMPLES.items():
+            chunk_samples = getattr(self.inputs, input_name)
+            for fibre in range(len(chunk_samples[0])):
+                self._merge(
+                    [samples[fibre] for samples in chunk_samples],
+                    abspath(out_template % (fibre + 1)),
+                )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        n_fibres = len(self.inputs.fsamples[0])
+        for output, (_, out_template) in BedpostxMerge.SAMPLES.items():
+            outputs[output] = [
+                abspath(out_template % (fibre + 1)) for fibre in range(n_fibres)
+            ]
+        return outputs
@@ -0,0 +1,107 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    OutputMultiPath,
+)
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class BedpostxSplitInputSpec(BaseInterfaceInputSpec):
+    dwi = File(exists=True, mandatory=True, desc="diffusion weighted image data file")
+    mask = File(exists=True, mandatory=True, desc="bet binary mask file")
+    slices_per_chunk = traits.Int(
+        4, usedefault=True, desc="number of z slices in every chunk"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class BedpostxSplitOutputSpec(TraitedSpec):
+    dwi_chunks = OutputMultiPath(File(exists=True), desc="the dwi chunks")
+    mask_chunks = OutputMultiPath(File(exists=True), desc="the mask chunks")
+    chunk_slices = traits.List(
+        traits.List(traits.Int), desc="the first and last+1 z slice of every chunk"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class BedpostxSplit(BaseInterface):
+    """
+    Splits masked diffusion data in chunks of z slices to run xfibres on each of them as a separate job.
+    Slices outside the mask are skipped.
+    The diffusion data is read once (memory-mapped when uncompressed) and sliced in memory.
+
+    """
+
+    input_spec = BedpostxSplitInputSpec
+    output_spec = BedpostxSplitOutputSpec
+
+    DWI_CHUNK_FILE = "data_chunk_%04d.nii.gz"
+    MASK_CHUNK_FILE = "nodif_brain_mask_chunk_%04d.nii.gz"
+
+    @staticmethod
+    def chunk_affine(affine: np.ndarray, z0: int) -> np.ndarray:
+        """
+        Returns the affine of a chunk, with the origin moved to its first slice.
+        """
+        chunk_affine = affine.copy()
+        chunk_affine[:3, 3] = (affine @ np.array([0, 0, z0, 1]))[:3]
+        return chunk_affine
+
+    def _run_interface(self, runtime):
+        dwi_nii = nib.load(self.inputs.dwi, mmap=True)
+        mask_nii = nib.load(self.inputs.mask)
+        mask = np.asanyarray(mask_nii.dataobj) > 0
+        if mask.shape[:3] != dwi_nii.shape[:3]:
+            raise RuntimeError("Mask and dwi dimensions mismatch")
+
+        self._dwi_chunks = []
+        self._mask_chunks = []
+        self._chunk_slices = []
+
+        masked_slices = np.flatnonzero(mask.any(axis=(0, 1)))
+        if masked_slices.size == 0:
+            raise RuntimeError("Empty mask")
+        step = max(1, self.inputs.slices_per_chunk)
+
+        dwi = np.asanyarray(dwi_nii.dataobj)
+        for z0 in range(masked_slices[0], masked_slices[-1] + 1, step):
+            z1 = min(z0 + step, masked_slices[-1] + 1)
+            if not mask[:, :, z0:z1].any():
+                continue
+            index = len(self._chunk_slices)
+            dwi_file = abspath(BedpostxSplit.DWI_CHUNK_FILE % index)
+            mask_file = abspath(BedpostxSplit.MASK_CHUNK_FILE % index)
+            dwi_chunk = nib.Nifti1Image(
+                dwi[:, :, z0:z1, ...],
+                BedpostxSplit.chunk_affine(dwi_nii.affine, z0),
+                dwi_nii.header,
+            )
+            dwi_chunk.set_data_dtype(dwi_nii.get_data_dtype())
+            nib.save(dwi_chunk, dwi_file)
+            mask_chunk = nib.Nifti1Image(
+                mask[:, :, z0:z1].astype(np.uint8),
+                BedpostxSplit.chunk_affine(mask_nii.affine, z0),
+                mask_nii.header,
+            )
+            mask_chunk.set_data_dtype(np.uint8)
+            nib.save(mask_chunk, mask_file)
+            self._dwi_chunks.append(dwi_file)
+            self._mask_chunks.append(mask_file)
+            self._chunk_slices.append([int(z0), int(z1)])
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["dwi_chunks"] = self._dwi_chunks
+        outputs["mask_chunks"] = self._mask_chunks
+        outputs["chunk_slices"] = self._chunk_slices
+        return outputs
@@ -0,0 +1,155 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import nibabel as nib
+import numpy as np
+from nibabel import orientations
+from nibabel.volumeutils import native_code
+from os.path import abspath
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+)
+from nipype.utils.filemanip import split_filename
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class FuncPreprocInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="the 4D functional image")
+    nvols = traits.Int(mandatory=True, desc="original file volumes")
+    del_start_vols = traits.Int(0, usedefault=True, desc="volumes to delete from start")
+    del_end_vols = traits.Int(0, usedefault=True, desc="volumes to delete from end")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class FuncPreprocOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="the trimmed, reoriented float series")
+    ref_file = File(exists=True, desc="the middle volume of the output series")
+    nvols = traits.Int(desc="new number of volumes")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class FuncPreproc(BaseInterface):
+    """
+    Removes edge volumes, converts in radiological RL PA IS orientation and in float values
+    a 4D functional series, extracting its middle volume as motion correction reference.
+    The input is read one volume at a time and the output is written uncompressed as
+    the volumes are processed, equivalent to DeleteVolumes, ForceOrient, fslmaths -odt float
+    and fslroi in sequence.
+    Neurological inputs are flipped along x with the inverse flip in the affine, which is
+    the net result of fslswapdim -x followed by fslorient -swaporient in ForceOrient: every
+    voxel keeps its world position, with no left-right swap.
+
+    """
+
+    input_spec = FuncPreprocInputSpec
+    output_spec = FuncPreprocOutputSpec
+
+    # Radiological convention, RL PA IS
+    TARGET_AXCODES = ("L", "A", "S")
+
+    @staticmethod
+    def reorientation(affine: np.ndarray, shape: tuple) -> tuple:
+        """
+        Computes the voxel axes transformation to RL PA IS orientation.
+
+        Parameters
+        ----------
+        affine : np.ndarray
+            The input voxel to world affine.
+        shape : tuple
+            The input 3D shape.
+
+        Returns
+        -------
+        The orientation transform for nibabel.orientations.apply_orientation and the
+        output affine, mapping the reoriented voxels to the same world coordinates.
+
+        """
+        transform = orientations.ornt_transform(
+            orientations.io_orientation(affine),
+            orientations.axcodes2ornt(FuncPreproc.TARGET_AXCODES),
+        )
+        out_affine = affine @ orientations.inv_ornt_aff(transform, shape)
+        return transform, out_affine
+
+    @staticmethod
+    def write_header(file, in_nii, shape: tuple, affine: np.ndarray):
+        """
+        Writes the header of an uncompressed float32 NIfTI, with data following at vox_offset.
+        """
+        header = in_nii.header.copy()
+        # Volumes are written in native byte order
+        if header.endianness != native_code:
+            header = header.as_byteswapped(native_code)
+        header.set_data_shape(shape)
+        header.set_data_dtype(np.float32)
+        header.set_slope_inter(1, 0)
+        header.set_qform(affine, int(in_nii.header["qform_code"]) or 1)
+        header.set_sform(affine, int(in_nii.header["sform_code"]) or 1)
+        # Orientation change permutes the spatial zooms
+        in_zooms = in_nii.header.get_zooms()
+        spatial_zooms = np.sqrt(np.sum(affine[:3, :3] ** 2, axis=0))
+        header.set_zooms(tuple(spatial_zooms) + tuple(in_zooms[3 : len(shape)]))
+        header["vox_offset"] = 352
+        file.write(header.binaryblock)
+        # No extensions
+        file.write(b"\x00" * 4)
+
+    def _run_interface(self, runtime):
+        in_nii = nib.load(self.inputs.in_file, mmap=True)
+        first_vol = self.inputs.del_start_vols
+        n_out = self._out_nvols()
+        if n_out < 1 or first_vol + n_out > in_nii.shape[3]:
+            raise ValueError(
+                "Cannot keep %d volumes from %d of %s"
+                % (n_out, first_vol, self.inputs.in_file)
+            )
+
+        transform, out_affine = FuncPreproc.reorientation(
+            in_nii.affine, in_nii.shape[:3]
+        )
+        out_shape = tuple(
+            int(in_nii.shape[int(axis)]) for axis in np.argsort(transform[:, 0])
+        ) + (n_out,)
+        ref_index = int(n_out / 2)
+        ref_data = None
+
+        with open(self._gen_outfilename(), "wb") as out_file:
+            FuncPreproc.write_header(out_file, in_nii, out_shape, out_affine)
+            # Volumes in increasing order, so compressed inputs are read sequentially
+            for index in range(n_out):
+                volume = np.asarray(
+                    in_nii.dataobj[..., first_vol + index], dtype=np.float32
+                )
+                volume = orientations.apply_orientation(volume, transform)
+                out_file.write(volume.tobytes(order="F"))
+                if index == ref_index:
+                    ref_data = volume
+
+        ref_nii = nib.Nifti1Image(ref_data, out_affine)
+        ref_nii.set_data_dtype(np.float32)
+        ref_nii.header.set_xyzt_units(*in_nii.header.get_xyzt_units())
+        nib.save(ref_nii, self._gen_reffilename())
+
+        return runtime
+
+    def _out_nvols(self) -> int:
+        return self.inputs.nvols - self.inputs.del_start_vols - self.inputs.del_end_vols
+
+    def _gen_outfilename(self):
+        _, base, _ = split_filename(self.inputs.in_file)
+        return abspath(base + ".nii")
+
+    def _gen_reffilename(self):
+        _, base, _ = split_filename(self.inputs.in_file)
+        return abspath(base + "_ref.nii")
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_file"] = self._gen_outfilename()
+        outputs["ref_file"] = self._gen_reffilename()
+        outputs["nvols"] = self._out_nvols()
+        return outputs
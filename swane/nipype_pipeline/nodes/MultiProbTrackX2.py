@@ -0,0 +1,441 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import os
+import glob
+import shutil
+import psutil
+import tempfile
+import subprocess
+import numpy as np
+import nibabel as nib
+from multiprocessing.pool import ThreadPool
+from nipype.interfaces.fsl import Info
+from swane.nipype_pipeline.nodes.CustomProbTrackX2 import CustomProbTrackX2
+from swane.nipype_pipeline.nodes.SeedPartition import SeedPartition
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    InputMultiPath,
+    File,
+    isdefined,
+)
+
+SHM_DIR = "/dev/shm"
+SHM_PREFIX = "swane_samples_"
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class MultiProbTrackX2InputSpec(BaseInterfaceInputSpec):
+    fsamples = InputMultiPath(File(exists=True), mandatory=True)
+    phsamples = InputMultiPath(File(exists=True), mandatory=True)
+    thsamples = InputMultiPath(File(exists=True), mandatory=True)
+    mask = File(
+        exists=True, mandatory=True, desc="bet binary mask file in diffusion space"
+    )
+    seed_ref = File(exists=True, desc="reference vol to define seed space")
+    xfm = File(exists=True, desc="transformation matrix taking seed space to DTI space")
+    inv_xfm = File(desc="transformation matrix taking DTI space to seed space")
+    mask_files = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+        desc="protocol masks, referenced by index in protocols",
+    )
+    protocols = traits.List(
+        traits.Dict(),
+        mandatory=True,
+        desc="list of protocols, each a dict with seed (list of mask indexes), "
+        "waypoints (list of mask indexes), avoid and stop (mask index or None) "
+        "and wayorder (bool)",
+    )
+    random_seeds = traits.List(
+        traits.Int(), mandatory=True, desc="one probtrackx run for each seed"
+    )
+    n_samples = traits.Int(
+        5000, usedefault=True, desc="number of samples per run (maximum if adaptive)"
+    )
+    adaptive = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Run probtrackx in increments until the normalised fdt_paths converge",
+    )
+    n_increments = traits.Int(
+        10, usedefault=True, desc="number of increments n_samples is split in"
+    )
+    tolerance = traits.Float(
+        0.01,
+        usedefault=True,
+        desc="maximum change of the normalised fdt_paths to stop adding increments",
+    )
+    use_gpu = traits.Bool(False, usedefault=True, desc="Use probtrackx2_gpu")
+    use_shm = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Stage bedpostx samples in shared memory. The copy is not counted in the "
+        "node mem_gb and each probtrackx still loads its own samples, enable it only "
+        "if the samples folder is on a slow disk",
+    )
+    num_threads = traits.Int(
+        1, usedefault=True, nohash=True, desc="Number of concurrent probtrackx runs"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class MultiProbTrackX2OutputSpec(TraitedSpec):
+    fdt_paths = traits.List(
+        File(exists=True), desc="fdt_paths of every run, by protocol and then seed"
+    )
+    way_total = traits.List(
+        File(exists=True), desc="waytotal of every run, by protocol and then seed"
+    )
+    samples_used = traits.List(traits.Int(), desc="samples actually used by every run")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class MultiProbTrackX2(BaseInterface):
+    """
+    Runs probtrackx2 for a list of protocols and random seeds sharing the same bedpostx samples.
+    The samples are linked once under a common base name and read from there by every run,
+    optionally copied in shared memory.
+    In adaptive mode every run stops adding sample increments when its connectivity distribution converges.
+
+    """
+
+    input_spec = MultiProbTrackX2InputSpec
+    output_spec = MultiProbTrackX2OutputSpec
+
+    def _run_interface(self, runtime):
+        # Same environment for every run, set before the runs start
+        self._environ = dict(os.environ, **CustomProbTrackX2().inputs.environ)
+        stage_dir, samples_base_name = self._stage_samples()
+        try:
+            jobs = []
+            for protocol_index, protocol in enumerate(self.inputs.protocols):
+                protocol_dir = self._gen_protocol_dir(protocol_index)
+                os.makedirs(protocol_dir, exist_ok=True)
+                self._write_mask_lists(protocol, protocol_dir)
+                for seed_index, random_seed in enumerate(self.inputs.random_seeds):
+                    run_dir = self._gen_run_dir(protocol_index, seed_index)
+                    os.makedirs(run_dir, exist_ok=True)
+                    jobs.append(
+                        (
+                            protocol,
+                            protocol_dir,
+                            run_dir,
+                            random_seed,
+                            samples_base_name,
+                        )
+                    )
+
+            with ThreadPool(MultiProbTrackX2.pool_size(self.inputs)) as pool:
+                if self.inputs.adaptive:
+                    self._samples_used = pool.map(self._run_adaptive_job, jobs)
+                else:
+                    pool.map(self._run_job, jobs)
+        finally:
+            if stage_dir is not None:
+                shutil.rmtree(stage_dir, ignore_errors=True)
+
+        return runtime
+
+    @staticmethod
+    def pool_size(inputs) -> int:
+        """
+        Returns the number of concurrent probtrackx runs, each one loading its own samples.
+        """
+        if inputs.use_gpu:
+            return 1
+        n_runs = len(inputs.protocols) * len(inputs.random_seeds)
+        return max(1, min(inputs.num_threads, n_runs))
+
+    def _stage_samples(self) -> tuple[str | None, str]:
+        """
+        Places the bedpostx samples under a common base name. Samples are symlinked in the
+        node directory, or copied to shared memory if use_shm is set and there is enough room.
+
+        Returns
+        -------
+        The staging directory to remove after the runs (None if symlinked) and the samples base name.
+
+        """
+        samples = {
+            "th": self.inputs.thsamples,
+            "ph": self.inputs.phsamples,
+            "f": self.inputs.fsamples,
+        }
+        total_size = sum(
+            os.path.getsize(file) for files in samples.values() for file in files
+        )
+
+        stage_dir = None
+        if self.inputs.use_shm and os.path.isdir(SHM_DIR):
+            MultiProbTrackX2._remove_stale_stages()
+        if (
+            self.inputs.use_shm
+            and os.path.isdir(SHM_DIR)
+            and shutil.disk_usage(SHM_DIR).free > 2 * total_size
+        ):
+            # The process id lets a later run remove the copy of a killed process
+            stage_dir = tempfile.mkdtemp(
+                prefix="%s%d_" % (SHM_PREFIX, os.getpid()), dir=SHM_DIR
+            )
+            samples_dir = stage_dir
+        else:
+            samples_dir = os.path.abspath("samples")
+            os.makedirs(samples_dir, exist_ok=True)
+
+        samples_base_name = os.path.join(samples_dir, "merged")
+        for sample_type, files in samples.items():
+            for fiber, file in enumerate(files, start=1):
+                staged_file = "%s_%s%dsamples%s" % (
+                    samples_base_name,
+                    sample_type,
+                    fiber,
+                    MultiProbTrackX2._get_ext(file),
+                )
+                if stage_dir is not None:
+                    shutil.copyfile(file, staged_file)
+                elif not os.path.lexists(staged_file):
+                    os.symlink(os.path.abspath(file), staged_file)
+
+        return stage_dir, samples_base_name
+
+    @staticmethod
+    def _remove_stale_stages():
+        """
+        Removes the shared memory samples left by killed processes.
+        """
+        for stage_dir in glob.glob(os.path.join(SHM_DIR, SHM_PREFIX + "*")):
+            try:
+                pid = int(os.path.basename(stage_dir)[len(SHM_PREFIX) :].split("_")[0])
+            except ValueError:
+                continue
+            if not psutil.pid_exists(pid):
+                shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def _gen_cmdline(
+        self,
+        protocol: dict,
+        protocol_dir: str,
+        run_dir: str,
+        random_seed: int,
+        samples_base_name: str,
+        n_samples: int,
+    ) -> str:
+        probtrackx = CustomProbTrackX2()
+        probtrackx.inputs.fsamples = self.inputs.fsamples
+        probtrackx.inputs.phsamples = self.inputs.phsamples
+        probtrackx.inputs.thsamples = self.inputs.thsamples
+        probtrackx.inputs.samples_base_name = samples_base_name
+        probtrackx.inputs.mask = self.inputs.mask
+        for name in ["seed_ref", "xfm", "inv_xfm"]:
+            value = getattr(self.inputs, name)
+            if isdefined(value):
+                setattr(probtrackx.inputs, name, value)
+        probtrackx.inputs.out_dir = run_dir
+        probtrackx.inputs.n_samples = n_samples
+        probtrackx.inputs.random_seed = random_seed
+        probtrackx.inputs.loop_check = True
+        probtrackx.inputs.wayorder = protocol.get("wayorder", False)
+        probtrackx.inputs.rand_fib = 1
+        probtrackx.inputs.sample_random_points = 1
+        probtrackx.inputs.opd = True
+        probtrackx.inputs.use_gpu = self.inputs.use_gpu
+
+        probtrackx.inputs.seed = self._mask_arg(protocol["seed"], protocol_dir, "seeds")
+        probtrackx.inputs.waypoints = self._mask_arg(
+            protocol["waypoints"], protocol_dir, "waypoints"
+        )
+        if protocol.get("avoid") is not None:
+            probtrackx.inputs.avoid_mp = self.inputs.mask_files[protocol["avoid"]]
+        if protocol.get("stop") is not None:
+            probtrackx.inputs.stop_mask = self.inputs.mask_files[protocol["stop"]]
+
+        return probtrackx.cmdline
+
+    def _mask_arg(self, indexes: list[int], protocol_dir: str, name: str) -> str:
+        # A single mask is passed directly, more masks are listed in a text file
+        if len(indexes) == 1:
+            return self.inputs.mask_files[indexes[0]]
+        return os.path.join(protocol_dir, name + ".txt")
+
+    def _write_mask_lists(self, protocol: dict, protocol_dir: str):
+        # Written once before the runs, which read them concurrently
+        for key, name in [("seed", "seeds"), ("waypoints", "waypoints")]:
+            if len(protocol[key]) > 1:
+                with open(
+                    self._mask_arg(protocol[key], protocol_dir, name), "w"
+                ) as file:
+                    file.write(
+                        "\n".join(self.inputs.mask_files[i] for i in protocol[key])
+                    )
+
+    def _run_job(self, job: tuple) -> int:
+        protocol, protocol_dir, run_dir, random_seed, samples_base_name = job
+        self._run_probtrackx(
+            self._gen_cmdline(
+                protocol,
+                protocol_dir,
+                run_dir,
+                random_seed,
+                samples_base_name,
+                self.inputs.n_samples,
+            ),
+            run_dir,
+        )
+        return self.inputs.n_samples
+
+    def _run_adaptive_job(self, job: tuple) -> int:
+        """
+        Runs probtrackx in increments of n_samples/n_increments samples, each one with its own seed.
+        After every increment the change of the accumulated fdt_paths, normalised to unit sum,
+        is measured as total variation distance and the run stops when it is below tolerance.
+
+        Returns
+        -------
+        The number of samples used.
+
+        """
+        protocol, protocol_dir, run_dir, random_seed, samples_base_name = job
+        n_increments = max(1, self.inputs.n_increments)
+        increment_samples = max(1, self.inputs.n_samples // n_increments)
+        increment_seeds = SeedPartition.partition(str(random_seed), n_increments)
+
+        fdt_paths = None
+        distribution = None
+        waytotal = 0
+        samples_used = 0
+        for increment, increment_seed in enumerate(increment_seeds):
+            increment_dir = os.path.join(run_dir, "increment%d" % increment)
+            os.makedirs(increment_dir, exist_ok=True)
+            self._run_probtrackx(
+                self._gen_cmdline(
+                    protocol,
+                    protocol_dir,
+                    increment_dir,
+                    increment_seed,
+                    samples_base_name,
+                    increment_samples,
+                ),
+                increment_dir,
+            )
+            samples_used += increment_samples
+
+            increment_nii = nib.load(
+                os.path.join(increment_dir, os.path.basename(self._fdt_paths(run_dir)))
+            )
+            if fdt_paths is None:
+                fdt_paths = np.zeros(increment_nii.shape, dtype=np.float64)
+            fdt_paths += np.asanyarray(increment_nii.dataobj)
+            waytotal += MultiProbTrackX2._read_waytotal(
+                os.path.join(increment_dir, "waytotal")
+            )
+            shutil.rmtree(increment_dir, ignore_errors=True)
+
+            change, distribution = MultiProbTrackX2.distribution_change(
+                distribution, fdt_paths
+            )
+            if change < self.inputs.tolerance:
+                break
+
+        out_nii = nib.Nifti1Image(
+            fdt_paths.astype(np.float32), increment_nii.affine, increment_nii.header
+        )
+        out_nii.set_data_dtype(np.float32)
+        nib.save(out_nii, self._fdt_paths(run_dir))
+        with open(os.path.join(run_dir, "waytotal"), "w") as file:
+            file.write(str(waytotal))
+
+        return samples_used
+
+    @staticmethod
+    def distribution_change(
+        previous: np.ndarray | None, fdt_paths: np.ndarray
+    ) -> tuple[float, np.ndarray | None]:
+        """
+        Normalises the accumulated fdt_paths to unit sum and compares it with the previous distribution.
+
+        Parameters
+        ----------
+        previous : np.ndarray | None
+            The previous normalised distribution, None if not available.
+        fdt_paths : np.ndarray
+            The accumulated fdt_paths.
+
+        Returns
+        -------
+        The total variation distance from the previous distribution (infinite if not
+        comparable) and the new normalised distribution (None if no streamline was kept).
+
+        """
+        total = fdt_paths.sum()
+        if total <= 0:
+            return np.inf, None
+        distribution = fdt_paths / total
+        if previous is None:
+            return np.inf, distribution
+        return float(0.5 * np.abs(distribution - previous).sum()), distribution
+
+    def _run_probtrackx(self, cmdline: str, run_dir: str):
+        result = subprocess.run(
+            cmdline,
+            shell=True,
+            cwd=run_dir,
+            env=self._environ,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                "probtrackx2 failed in %s:\n%s" % (run_dir, result.stderr)
+            )
+
+    @staticmethod
+    def _read_waytotal(waytotal_file: str) -> int:
+        waytotal = 0
+        if os.path.exists(waytotal_file):
+            with open(waytotal_file, "r") as file:
+                for line in file.readlines():
+                    if line.strip():
+                        waytotal += int(float(line))
+        return waytotal
+
+    @staticmethod
+    def _fdt_paths(run_dir: str) -> str:
+        return os.path.join(
+            run_dir, "fdt_paths" + Info.output_type_to_ext(Info.output_type())
+        )
+
+    @staticmethod
+    def _get_ext(file: str) -> str:
+        for ext in [".nii.gz", ".nii"]:
+            if file.endswith(ext):
+                return ext
+        return os.path.splitext(file)[1]
+
+    @staticmethod
+    def _gen_protocol_dir(protocol_index: int) -> str:
+        return os.path.abspath("protocol%d" % protocol_index)
+
+    def _gen_run_dir(self, protocol_index: int, seed_index: int) -> str:
+        return os.path.join(
+            self._gen_protocol_dir(protocol_index), "seed%d" % seed_index
+        )
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["fdt_paths"] = []
+        outputs["way_total"] = []
+        for protocol_index in range(len(self.inputs.protocols)):
+            for seed_index in range(len(self.inputs.random_seeds)):
+                run_dir = self._gen_run_dir(protocol_index, seed_index)
+                outputs["fdt_paths"].append(self._fdt_paths(run_dir))
+                outputs["way_total"].append(os.path.join(run_dir, "waytotal"))
+        if self.inputs.adaptive and hasattr(self, "_samples_used"):
+            outputs["samples_used"] = self._samples_used
+        else:
+            outputs["samples_used"] = [self.inputs.n_samples] * len(
+                outputs["fdt_paths"]
+            )
+        return outputs
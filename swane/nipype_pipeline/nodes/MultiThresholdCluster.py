@@ -0,0 +1,167 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import math
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from scipy import ndimage
+from scipy.special import ndtr
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    OutputMultiPath,
+    isdefined,
+)
+from nipype.utils.filemanip import split_filename
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class MultiThresholdClusterInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="the zstat image")
+    mask_file = File(exists=True, desc="mask applied to the zstat before clustering")
+    thresholds = traits.List(
+        traits.Float(), mandatory=True, desc="the cluster forming z thresholds"
+    )
+    connectivity = traits.Enum(
+        26, 6, 18, usedefault=True, desc="the voxel connectivity of clusters"
+    )
+    dlh = traits.Float(mandatory=True, desc="smoothness estimate = sqrt(det(Lambda))")
+    volume = traits.Int(mandatory=True, desc="number of voxels in the mask")
+    pthreshold = traits.Float(
+        0.05, usedefault=True, desc="p-threshold of the GRF corrected cluster p-value"
+    )
+    out_files = traits.List(File, desc="the output images, one for each threshold")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class MultiThresholdClusterOutputSpec(TraitedSpec):
+    out_files = OutputMultiPath(
+        File(exists=True), desc="zstat of significant clusters, one for each threshold"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class MultiThresholdCluster(BaseInterface):
+    """
+    In-process equivalent of FSL cluster --othresh for many thresholds on the same zstat.
+    Clusters are labelled with scipy and kept if their Gaussian Random Field corrected
+    p-value (the same formula of FSL) is below pthreshold.
+
+    """
+
+    input_spec = MultiThresholdClusterInputSpec
+    output_spec = MultiThresholdClusterOutputSpec
+
+    @staticmethod
+    def cluster_log_p(
+        size: np.ndarray, threshold: float, dlh: float, volume: int, dims: int = 3
+    ) -> np.ndarray:
+        """
+        Computes the log of the GRF corrected p-values for clusters of the given sizes.
+
+        Parameters
+        ----------
+        size : np.ndarray
+            The cluster sizes in voxels.
+        threshold : float
+            The cluster forming z threshold.
+        dlh : float
+            The smoothness estimate (from smoothest).
+        volume : int
+            The number of voxels in the search volume.
+        dims : int, optional
+            The image dimensionality. The default is 3.
+
+        Returns
+        -------
+        The log p-value of every cluster.
+
+        """
+        # Expected number of clusters
+        em = (
+            volume
+            * (2 * math.pi) ** (-(dims + 1) / 2)
+            * dlh
+            * (threshold**2 - 1) ** ((dims - 1) / 2)
+            * math.exp(-(threshold**2) / 2)
+        )
+        em = max(em, 0)
+        beta = (math.gamma(1 + dims / 2) * em / (volume * ndtr(-threshold))) ** (
+            2 / dims
+        )
+        arg = -em * np.exp(-beta * np.power(size, 2 / dims))
+        # 1 - exp(arg) loses precision for tiny arguments
+        with np.errstate(divide="ignore"):
+            return np.log(-np.expm1(arg))
+
+    @staticmethod
+    def significant_clusters(
+        zstat: np.ndarray,
+        threshold: float,
+        connectivity: int,
+        dlh: float,
+        volume: int,
+        pthreshold: float,
+    ) -> np.ndarray:
+        """
+        Returns the boolean mask of the voxels in significant clusters.
+        """
+        structure = ndimage.generate_binary_structure(
+            3, {6: 1, 18: 2, 26: 3}[connectivity]
+        )
+        labels, n_labels = ndimage.label(zstat > threshold, structure=structure)
+        if n_labels == 0:
+            return np.zeros(zstat.shape, dtype=bool)
+        sizes = np.bincount(labels.ravel())[1:]
+        dims = 2 if zstat.shape[2] == 1 else 3
+        log_p = MultiThresholdCluster.cluster_log_p(sizes, threshold, dlh, volume, dims)
+        keep = np.concatenate([[False], log_p < math.log(pthreshold)])
+        return keep[labels]
+
+    def _run_interface(self, runtime):
+        zstat_nii = nib.load(self.inputs.in_file)
+        zstat = np.asarray(zstat_nii.dataobj, dtype=np.float32)
+        if zstat.ndim > 3:
+            zstat = zstat[..., 0]
+        if isdefined(self.inputs.mask_file):
+            zstat[np.asanyarray(nib.load(self.inputs.mask_file).dataobj) == 0] = 0
+
+        for threshold, out_file in zip(
+            self.inputs.thresholds, self._gen_outfilenames()
+        ):
+            significant = MultiThresholdCluster.significant_clusters(
+                zstat,
+                threshold,
+                self.inputs.connectivity,
+                self.inputs.dlh,
+                self.inputs.volume,
+                self.inputs.pthreshold,
+            )
+            out_nii = nib.Nifti1Image(
+                np.where(significant, zstat, 0).astype(np.float32),
+                zstat_nii.affine,
+                zstat_nii.header,
+            )
+            out_nii.set_data_dtype(np.float32)
+            nib.save(out_nii, out_file)
+
+        return runtime
+
+    def _gen_outfilenames(self):
+        if isdefined(self.inputs.out_files) and len(self.inputs.out_files) == len(
+            self.inputs.thresholds
+        ):
+            return [abspath(out_file) for out_file in self.inputs.out_files]
+        _, base, ext = split_filename(self.inputs.in_file)
+        return [
+            abspath("%s_threshold%.1f%s" % (base, threshold, ext))
+            for threshold in self.inputs.thresholds
+        ]
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_files"] = self._gen_outfilenames()
+        return outputs
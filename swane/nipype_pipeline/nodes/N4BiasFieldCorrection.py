@@ -23,6 +23,28 @@ class N4BiasFieldCorrectionInputSpec(BaseInterfaceInputSpec):
         desc="Set to True if the input image is already skull stripped",
     )
     mask_file = File(exists=True, desc="the mask image")
+    num_threads = traits.Int(
+        1, usedefault=True, nohash=True, desc="number of threads used by N4"
+    )
+    shrink_factor = traits.Int(
+        4,
+        usedefault=True,
+        desc="Downsampling factor used to fit the bias field, 1 to fit at full resolution",
+    )
+    preset = traits.Enum(
+        "standard",
+        "fast",
+        "accurate",
+        usedefault=True,
+        desc="Iteration and convergence preset",
+    )
+    n_iterations = traits.List(
+        traits.Int,
+        desc="Maximum iterations for each fitting level, overrides the preset",
+    )
+    convergence_threshold = traits.Float(
+        desc="Convergence threshold, overrides the preset"
+    )
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
@@ -33,13 +55,22 @@ class N4BiasFieldCorrectionOutputSpec(TraitedSpec):
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
 class N4BiasFieldCorrection(BaseInterface):
     """
-    Apply N4 bias field correction algorithm
+    Apply N4 bias field correction algorithm.
+    The bias field is fitted on a downsampled image and the log bias field is then reconstructed
+    at full resolution to correct the input.
 
     """
 
     input_spec = N4BiasFieldCorrectionInputSpec
     output_spec = N4BiasFieldCorrectionOutputSpec
 
+    # Maximum iterations per fitting level and convergence threshold for each preset
+    PRESETS = {
+        "fast": ([50, 40, 30], 0.001),
+        "standard": ([50, 50, 50, 50], 0.001),
+        "accurate": ([100, 100, 100, 100], 0.000001),
+    }
+
     def _run_interface(self, runtime):
         self.inputs.out_file = self._gen_outfilename()
 
@@ -75,8 +106,33 @@ class N4BiasFieldCorrection(BaseInterface):
                 )
 
         # --- N4 ---
+        n_threads = max(1, self.inputs.num_threads)
+
+        n_iterations, convergence_threshold = N4BiasFieldCorrection.PRESETS[
+            self.inputs.preset
+        ]
+        if isdefined(self.inputs.n_iterations) and len(self.inputs.n_iterations) > 0:
+            n_iterations = self.inputs.n_iterations
+        if isdefined(self.inputs.convergence_threshold):
+            convergence_threshold = self.inputs.convergence_threshold
+
         corrector = sitk.N4BiasFieldCorrectionImageFilter()
-        corrected = corrector.Execute(img, mask)
+        corrector.SetNumberOfThreads(n_threads)
+        corrector.SetMaximumNumberOfIterations(list(n_iterations))
+        corrector.SetConvergenceThreshold(convergence_threshold)
+
+        # fit the bias field on the downsampled image
+        shrink = [
+            max(1, min(self.inputs.shrink_factor, size)) for size in img.GetSize()
+        ]
+        if max(shrink) > 1:
+            corrector.Execute(sitk.Shrink(img, shrink), sitk.Shrink(mask, shrink))
+        else:
+            corrector.Execute(img, mask)
+
+        # reconstruct the bias field at full resolution and apply it
+        log_bias_field = corrector.GetLogBiasFieldAsImage(img)
+        corrected = img / sitk.Cast(sitk.Exp(log_bias_field), img.GetPixelID())
 
         # save output
         sitk.WriteImage(corrected, self.inputs.out_file)
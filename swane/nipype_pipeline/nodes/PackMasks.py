@@ -0,0 +1,179 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import os
+import shutil
+import hashlib
+import tempfile
+import nibabel as nib
+import numpy as np
+from os.path import abspath
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    Directory,
+    InputMultiPath,
+    OutputMultiPath,
+    isdefined,
+)
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class PackMasksInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+        desc="the binary masks to pack, all with the same geometry",
+    )
+    cache_dir = Directory(
+        desc="directory of the content-addressed bundle cache, shared between subjects"
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class PackMasksOutputSpec(TraitedSpec):
+    packed_files = OutputMultiPath(
+        File(exists=True), desc="uint8 volumes, each one packing 8 masks as bits"
+    )
+    n_masks = traits.Int(desc="the number of packed masks")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class PackMasks(BaseInterface):
+    """
+    Packs binary masks as bits of uint8 volumes: bit b of volume v is mask 8*v+b.
+    Bundles are also stored in cache_dir by content hash of the input masks, so each
+    bundle is built only once for every set of masks (eg. for every xtract data version)
+    and hardlinked in the node directory, which keeps its own copy if the cache is cleared.
+
+    """
+
+    input_spec = PackMasksInputSpec
+    output_spec = PackMasksOutputSpec
+
+    BUNDLE_FILE = "bundle_%d.nii.gz"
+
+    @staticmethod
+    def bundle_key(in_files: list) -> str:
+        """
+        Returns the sha256 of the masks content and order.
+        """
+        digest = hashlib.sha256()
+        for in_file in in_files:
+            with open(in_file, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def pack(masks: np.ndarray) -> np.ndarray:
+        """
+        Packs a (n_masks, x, y, z) boolean array in a (ceil(n_masks/8), x, y, z) uint8 array.
+        """
+        return np.packbits(masks, axis=0, bitorder="little")
+
+    @staticmethod
+    def unpack(packed: np.ndarray, n_masks: int) -> np.ndarray:
+        """
+        Unpacks a (ceil(n_masks/8), x, y, z) uint8 array in a (n_masks, x, y, z) uint8 array.
+        """
+        return np.unpackbits(packed, axis=0, count=n_masks, bitorder="little")
+
+    @staticmethod
+    def write_bundle(in_files: list, bundle_dir: str) -> list:
+        """
+        Packs the masks and writes the bundle volumes in bundle_dir.
+
+        Returns
+        -------
+        The list of the bundle volumes.
+
+        """
+        first_nii = nib.load(in_files[0])
+        masks = np.zeros((len(in_files),) + first_nii.shape[:3], dtype=bool)
+        for index, in_file in enumerate(in_files):
+            mask_nii = nib.load(in_file)
+            if mask_nii.shape[:3] != first_nii.shape[:3] or not np.allclose(
+                mask_nii.affine, first_nii.affine
+            ):
+                raise ValueError(
+                    "%s does not match %s geometry" % (in_file, in_files[0])
+                )
+            mask = np.asanyarray(mask_nii.dataobj)
+            if mask.ndim > 3:
+                mask = mask[..., 0]
+            masks[index] = mask > 0
+
+        packed_files = []
+        for volume_index, packed in enumerate(PackMasks.pack(masks)):
+            packed_nii = nib.Nifti1Image(packed, first_nii.affine, first_nii.header)
+            packed_nii.set_data_dtype(np.uint8)
+            packed_nii.header.set_slope_inter(1, 0)
+            packed_file = os.path.join(bundle_dir, PackMasks.BUNDLE_FILE % volume_index)
+            nib.save(packed_nii, packed_file)
+            packed_files.append(packed_file)
+        return packed_files
+
+    def _run_interface(self, runtime):
+        out_dir = abspath("bundle")
+        os.makedirs(out_dir, exist_ok=True)
+        if not isdefined(self.inputs.cache_dir):
+            PackMasks.write_bundle(self.inputs.in_files, out_dir)
+            return runtime
+
+        cache_dir = self._gen_cache_bundle_dir()
+        try:
+            self._build_cache_bundle(cache_dir)
+            for bundle_file in self._bundle_files():
+                cached_file = os.path.join(cache_dir, bundle_file)
+                out_file = os.path.join(out_dir, bundle_file)
+                if os.path.lexists(out_file):
+                    os.remove(out_file)
+                try:
+                    os.link(cached_file, out_file)
+                except OSError:
+                    # eg. cache on another file system
+                    shutil.copyfile(cached_file, out_file)
+        except OSError:
+            # Incomplete or unwritable cache
+            PackMasks.write_bundle(self.inputs.in_files, out_dir)
+
+        return runtime
+
+    def _build_cache_bundle(self, cache_dir: str):
+        if os.path.exists(cache_dir):
+            return
+
+        # Built aside and renamed, so other subjects never see a partial bundle
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=os.path.dirname(cache_dir))
+        try:
+            PackMasks.write_bundle(self.inputs.in_files, build_dir)
+            os.rename(build_dir, cache_dir)
+        except OSError:
+            # Another subject completed the same bundle first
+            if not os.path.exists(cache_dir):
+                raise
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def _gen_cache_bundle_dir(self) -> str:
+        if not hasattr(self, "_bundle_key"):
+            self._bundle_key = PackMasks.bundle_key(self.inputs.in_files)
+        return os.path.join(abspath(self.inputs.cache_dir), self._bundle_key)
+
+    def _bundle_files(self) -> list:
+        return [
+            PackMasks.BUNDLE_FILE % volume_index
+            for volume_index in range((len(self.inputs.in_files) + 7) // 8)
+        ]
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["packed_files"] = [
+            os.path.join(abspath("bundle"), bundle_file)
+            for bundle_file in self._bundle_files()
+        ]
+        outputs["n_masks"] = len(self.inputs.in_files)
+        return outputs
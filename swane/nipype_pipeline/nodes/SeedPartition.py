@@ -0,0 +1,77 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+
+import hashlib
+import numpy as np
+from nipype.interfaces.base import (
+    traits,
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+)
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
+class SeedPartitionInputSpec(BaseInterfaceInputSpec):
+    seeds_n = traits.Int(mandatory=True, desc="The number of needed seeds")
+    identity = traits.Str(
+        mandatory=True,
+        desc="String identifying the seeds owner (eg. subject and tract)",
+    )
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
+class SeedPartitionOutputSpec(TraitedSpec):
+    seeds = traits.List(desc="the list of seeds")
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
+class SeedPartition(BaseInterface):
+    """
+    Generates a list of distinct seeds derived from an identity string. The same identity
+    always gives the same seeds, so nodes depending on them keep their cache between runs.
+
+    """
+
+    input_spec = SeedPartitionInputSpec
+    output_spec = SeedPartitionOutputSpec
+
+    def _run_interface(self, runtime):
+        # Seeds are cheap to derive, they are generated in _list_outputs
+        return runtime
+
+    @staticmethod
+    def partition(identity: str, seeds_n: int) -> list[int]:
+        """
+        Splits the seed space of an identity in non-overlapping streams.
+
+        Parameters
+        ----------
+        identity : str
+            The string from which the root entropy is derived.
+        seeds_n : int
+            The number of seeds.
+
+        Returns
+        -------
+        The list of distinct positive seeds, one for each stream.
+
+        """
+        entropy = int.from_bytes(
+            hashlib.sha256(identity.encode("utf-8")).digest()[:16], "big"
+        )
+        root = np.random.SeedSequence(entropy)
+        seeds = []
+        while len(seeds) < seeds_n:
+            # Independent child sequences, a seed collision is skipped
+            for child in root.spawn(seeds_n - len(seeds)):
+                seed = int(child.generate_state(1)[0] & 0x7FFFFFFF)
+                if seed not in seeds:
+                    seeds.append(seed)
+        return seeds
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["seeds"] = SeedPartition.partition(
+            self.inputs.identity, self.inputs.seeds_n
+        )
+        return outputs
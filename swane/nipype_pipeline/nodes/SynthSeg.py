@@ -1,5 +1,6 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
-from nipype.interfaces.freesurfer.base import FSTraitedSpec, FSCommand
+from nipype.interfaces.freesurfer.base import FSTraitedSpec
+from swane.nipype_pipeline.nodes.SynthServerCommand import SynthServerCommand
 from nipype.interfaces.base import (
     TraitedSpec,
     File,
@@ -89,7 +90,7 @@ class SynthSegOutputSpec(TraitedSpec):
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.freesurfer.base.FSCommand)  -*-
-class SynthSeg(FSCommand):
+class SynthSeg(SynthServerCommand):
     _cmd = "mri_synthseg"
     input_spec = SynthSegInputSpec
     output_spec = SynthSegOutputSpec
@@ -0,0 +1,35 @@
+# -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+import os
+from nipype.interfaces.freesurfer.base import FSCommand
+from swane.nipype_pipeline.engine.SynthModelServer import SynthModelServer
+
+
+# -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.freesurfer.base.FSCommand)  -*-
+class SynthServerCommand(FSCommand):
+    """
+    FreeSurfer Synth command that, if a SynthModelServer is running for the workflow,
+    is executed by the server instead of a new process. Falls back to the command line
+    if the server is not reachable or cannot execute the request.
+
+    """
+
+    def _run_interface(self, runtime, correct_return_codes=(0,)):
+        socket_path = os.environ.get(SynthModelServer.SOCKET_ENV)
+        if not socket_path:
+            return super()._run_interface(runtime, correct_return_codes)
+
+        runtime.cmdline = self.cmdline
+        reply = SynthModelServer.request(socket_path, runtime.cmdline, runtime.cwd)
+        if reply is None:
+            return super()._run_interface(runtime, correct_return_codes)
+
+        runtime.success_codes = correct_return_codes
+        runtime.command_path = socket_path
+        runtime.dependencies = "<skipped>"
+        runtime.returncode = reply["returncode"]
+        runtime.stdout = reply["stdout"]
+        runtime.stderr = reply["stderr"]
+        runtime.merged = "\n".join(
+            [output for output in (runtime.stdout, runtime.stderr) if output]
+        )
+        return runtime
@@ -1,5 +1,6 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
-from nipype.interfaces.freesurfer.base import FSTraitedSpec, FSCommand
+from nipype.interfaces.freesurfer.base import FSTraitedSpec
+from swane.nipype_pipeline.nodes.SynthServerCommand import SynthServerCommand
 from nipype.interfaces.base import (
     TraitedSpec,
     File,
@@ -61,7 +62,7 @@ class SynthStripOutputSpec(TraitedSpec):
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.freesurfer.base.FSCommand)  -*-
-class SynthStrip(FSCommand):
+class SynthStrip(SynthServerCommand):
     _cmd = "mri_synthstrip"
     input_spec = SynthStripInputSpec
     output_spec = SynthStripOutputSpec
@@ -1,5 +1,6 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
 
+import numpy as np
 from nipype.interfaces.base import (
     traits,
     TraitedSpec,
@@ -11,39 +12,91 @@ from scipy.stats import ttest_ind_from_stats
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
 class TTestInputSpec(BaseInterfaceInputSpec):
-    stats_lh = traits.List(mandatory=True, desc="Stats for left side")
-    stats_rh = traits.List(mandatory=True, desc="Stats for right side")
+    stats_lh = traits.List(
+        traits.List(traits.Float),
+        mandatory=True,
+        desc="Stats for left side, a [mean, std, n] list for each label",
+    )
+    stats_rh = traits.List(
+        traits.List(traits.Float),
+        mandatory=True,
+        desc="Stats for right side, a [mean, std, n] list for each label",
+    )
+    correction = traits.Enum(
+        "none",
+        "bonferroni",
+        "fdr",
+        usedefault=True,
+        desc="Multiple comparison correction applied to P values",
+    )
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
 class TTestOutputSpec(TraitedSpec):
-    stat_t = traits.Float(desc="T statistics")
-    stat_p = traits.Float(desc="P value")
+    stat_t = traits.List(traits.Float, desc="T statistics for each label")
+    stat_p = traits.List(traits.Float, desc="P value for each label")
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
 class TTest(BaseInterface):
     """
-    Calculate T statistics of two given distributions
+    Calculate T statistics of two given distributions for every label in a single call
 
     """
 
     input_spec = TTestInputSpec
     output_spec = TTestOutputSpec
 
+    @staticmethod
+    def fdr_correction(p_values: np.ndarray) -> np.ndarray:
+        """
+        Benjamini-Hochberg false discovery rate adjusted P values.
+        """
+        n = p_values.size
+        if n == 0:
+            return p_values
+        order = np.argsort(p_values)
+        ranked = p_values[order] * n / np.arange(1, n + 1)
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        adjusted = np.empty(n)
+        adjusted[order] = np.minimum(ranked, 1)
+        return adjusted
+
     def _run_interface(self, runtime):
-        try:
-            self.t, self.p = ttest_ind_from_stats(
-                mean1=self.inputs.stats_lh[0],
-                std1=self.inputs.stats_lh[1],
-                nobs1=self.inputs.stats_lh[2],
-                mean2=self.inputs.stats_rh[0],
-                std2=self.inputs.stats_rh[1],
-                nobs2=self.inputs.stats_rh[2],
+        if len(self.inputs.stats_lh) != len(self.inputs.stats_rh):
+            raise ValueError("Left and right stats must have the same label number")
+
+        # Only mean, std and voxel number are needed, further values (eg. volume) are ignored
+        stats_lh = np.array([stat[:3] for stat in self.inputs.stats_lh], dtype=float)
+        stats_rh = np.array([stat[:3] for stat in self.inputs.stats_rh], dtype=float)
+        stats_lh = stats_lh.reshape(-1, 3)
+        stats_rh = stats_rh.reshape(-1, 3)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t, p = ttest_ind_from_stats(
+                mean1=stats_lh[:, 0],
+                std1=stats_lh[:, 1],
+                nobs1=stats_lh[:, 2],
+                mean2=stats_rh[:, 0],
+                std2=stats_rh[:, 1],
+                nobs2=stats_rh[:, 2],
             )
-        except:
-            self.t = 0
-            self.p = 0
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        p = np.atleast_1d(np.asarray(p, dtype=float))
+
+        # Labels with undefined statistics (empty or constant regions) are set to 0
+        invalid = ~(np.isfinite(t) & np.isfinite(p))
+        t[invalid] = 0
+        p[invalid] = 0
+
+        valid = ~invalid
+        if self.inputs.correction == "bonferroni":
+            p[valid] = np.minimum(p[valid] * np.count_nonzero(valid), 1)
+        elif self.inputs.correction == "fdr":
+            p[valid] = TTest.fdr_correction(p[valid])
+
+        self.t = t.tolist()
+        self.p = p.tolist()
 
         return runtime
 
@@ -1,6 +1,7 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
 
-from nipype.interfaces.fsl import UnaryMaths, Threshold
+import nibabel as nib
+import numpy as np
 from os.path import abspath
 import os
 from nipype.interfaces.base import (
@@ -9,6 +10,7 @@ from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
     TraitedSpec,
     File,
+    OutputMultiPath,
     isdefined,
 )
 
@@ -16,80 +18,119 @@ from nipype.interfaces.base import (
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterfaceInputSpec)  -*-
 class ThrROIInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, mandatory=True, desc="the input image")
-    seg_val_min = traits.Float(
-        mandatory=True, desc="the min value of interested segmentation"
+    seg_val_min = traits.Float(desc="the min value of interested segmentation")
+    seg_val_max = traits.Float(desc="the max value of interested segmentation")
+    seg_val_ranges = traits.List(
+        traits.Tuple(traits.Float, traits.Float),
+        desc="list of (min, max) values to extract many ROIs from one segmentation load",
     )
-    seg_val_max = traits.Float(
-        mandatory=True, desc="the max value of interested segmentation"
+    combine = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Set to True to save the union of seg_val_ranges ROIs in out_file",
+    )
+    out_datatype = traits.Enum(
+        "uint8",
+        "float32",
+        usedefault=True,
+        desc="the output datatype",
     )
     out_file = File(desc="the output image")
+    out_files = traits.List(File, desc="the output images for seg_val_ranges")
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
 class ThrROIOutputSpec(TraitedSpec):
     out_file = File(desc="the output image")
+    out_files = OutputMultiPath(File(), desc="the output images for seg_val_ranges")
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
 class ThrROI(BaseInterface):
     """
     Extracts a binary ROI from a segmentation using a min and a max value.
+    With seg_val_ranges, extracts one ROI for every range (or their union) loading the segmentation once.
 
     """
 
     input_spec = ThrROIInputSpec
     output_spec = ThrROIOutputSpec
 
-    def _run_interface(self, runtime):
-        self.inputs.out_file = self._gen_outfilename()
-
-        below = Threshold()
-        below.inputs.in_file = self.inputs.in_file
-        below.inputs.direction = "below"
-        below.inputs.thresh = self.inputs.seg_val_min
-        below.inputs.out_file = abspath(
-            "below_" + os.path.basename(self.inputs.in_file)
-        )
-        below_res = below.run()
-
-        above = Threshold()
-        above.inputs.in_file = below_res.outputs.out_file
-        above.inputs.direction = "above"
-        above.inputs.thresh = self.inputs.seg_val_max
-        above.inputs.out_file = abspath(
-            "above_" + os.path.basename(self.inputs.in_file)
-        )
-        above_res = above.run()
+    def _is_multi_roi(self) -> bool:
+        return isdefined(self.inputs.seg_val_ranges) and self.inputs.seg_val_ranges
 
-        bin = UnaryMaths()
-        bin.inputs.in_file = above_res.outputs.out_file
-        bin.inputs.operation = "bin"
-        bin.inputs.out_file = self.inputs.out_file
-        bin.run()
+    def _save_roi(self, roi: np.ndarray, seg_nii, out_file: str):
+        out_nii = nib.Nifti1Image(
+            roi.astype(self.inputs.out_datatype), seg_nii.affine, seg_nii.header
+        )
+        out_nii.set_data_dtype(self.inputs.out_datatype)
+        out_nii.header.set_slope_inter(1, 0)
+        nib.save(out_nii, out_file)
 
-        # todo semplificare il nodo subclassando ImageMaths, esempio sotto
-        # calc_roi = ImageMaths()
-        # calc_roi.inputs.in_file = self.inputs.in_file
-        # calc_roi.inputs.op_string = "-thr %f -uthr %f -bin" % (self.inputs.seg_val_min, self.inputs.seg_val_max)
-        # calc_roi.inputs.out_file = self.inputs.out_file
-        # calc_roi.run()
+    def _run_interface(self, runtime):
+        if self._is_multi_roi():
+            ranges = self.inputs.seg_val_ranges
+        elif isdefined(self.inputs.seg_val_min) and isdefined(self.inputs.seg_val_max):
+            ranges = [(self.inputs.seg_val_min, self.inputs.seg_val_max)]
+        else:
+            raise ValueError("seg_val_min and seg_val_max or seg_val_ranges required")
+
+        seg_nii = nib.load(self.inputs.in_file)
+        seg = np.asanyarray(seg_nii.dataobj)
+        # Same as fslmaths -thr min -uthr max -bin
+        nonzero = seg != 0
+        rois = [
+            (seg >= val_min) & (seg <= val_max) & nonzero for val_min, val_max in ranges
+        ]
+
+        if not self._is_multi_roi() or self.inputs.combine:
+            self._save_roi(np.logical_or.reduce(rois), seg_nii, self._gen_outfilename())
+        else:
+            for roi, out_file in zip(rois, self._gen_outfilenames()):
+                self._save_roi(roi, seg_nii, out_file)
 
         return runtime
 
     def _gen_outfilename(self):
         out_file = self.inputs.out_file
         if not isdefined(out_file) and isdefined(self.inputs.in_file):
+            if self._is_multi_roi():
+                val_min = self.inputs.seg_val_ranges[0][0]
+                val_max = self.inputs.seg_val_ranges[-1][1]
+            else:
+                val_min = self.inputs.seg_val_min
+                val_max = self.inputs.seg_val_max
             out_file = (
                 "ROI_"
-                + str(self.inputs.seg_val_min)
+                + str(val_min)
                 + "_"
-                + str(self.inputs.seg_val_min)
+                + str(val_max)
                 + "_"
                 + os.path.basename(self.inputs.in_file)
             )
         return abspath(out_file)
 
+    def _gen_outfilenames(self):
+        if isdefined(self.inputs.out_files) and len(self.inputs.out_files) == len(
+            self.inputs.seg_val_ranges
+        ):
+            return [abspath(out_file) for out_file in self.inputs.out_files]
+        return [
+            abspath(
+                "ROI_"
+                + str(val_min)
+                + "_"
+                + str(val_max)
+                + "_"
+                + os.path.basename(self.inputs.in_file)
+            )
+            for val_min, val_max in self.inputs.seg_val_ranges
+        ]
+
     def _list_outputs(self):
         outputs = self.output_spec().get()
-        outputs["out_file"] = self._gen_outfilename()
+        if self._is_multi_roi() and not self.inputs.combine:
+            outputs["out_files"] = self._gen_outfilenames()
+        else:
+            outputs["out_file"] = self._gen_outfilename()
         return outputs
@@ -1,6 +1,9 @@
 # -*- DISCLAIMER: this file contains code derived from Nipype (https://github.com/nipy/nipype/blob/master/LICENSE)  -*-
+import math
 import nibabel as nib
 import numpy as np
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import seek_tell
 from os.path import abspath
 import os
 from nipype.interfaces.base import (
@@ -23,53 +26,149 @@ class ZIntNormInputSpec(BaseInterfaceInputSpec):
         desc="Set to True if the input image is already skull stripped",
     )
     mask_file = File(exists=True, desc="the mask image")
+    slab_size = traits.Int(
+        16,
+        usedefault=True,
+        desc="Number of z slices read and written at once",
+    )
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.TraitedSpec)  -*-
 class ZIntNormOutputSpec(TraitedSpec):
     out_file = File(desc="the output unbiased image")
+    peak_mem_gb = traits.Float(
+        desc="the peak memory of the slab buffers and of the loaded compressed inputs (GB)"
+    )
 
 
 # -*- DISCLAIMER: this class extends a Nipype class (nipype.interfaces.base.BaseInterface)  -*-
 class ZIntNorm(BaseInterface):
     """
-    Apply Z score internal normalization
+    Apply Z score internal normalization.
+    Mean and standard deviation are computed with a streaming (Welford) reduction over z slabs of
+    the memory-mapped input and the output is written slab by slab. Compressed inputs cannot be
+    memory-mapped and are loaded once, instead of being decompressed again for every slab.
 
     """
 
     input_spec = ZIntNormInputSpec
     output_spec = ZIntNormOutputSpec
 
+    # Bytes per slab voxel: float64 input, uint8 mask, float32 output and temporaries
+    SLAB_BYTES_PER_VOXEL = 24
+
+    @staticmethod
+    def slab_mem_gb(shape: tuple, slab_size: int) -> float:
+        """
+        Parameters
+        ----------
+        shape: tuple
+            The input image shape
+        slab_size: int
+            Number of z slices processed at once
+
+        Returns
+        -------
+        The memory needed by the slab buffers (GB)
+        """
+        slab_size = max(1, min(slab_size, shape[2] if len(shape) > 2 else 1))
+        slab_voxels = shape[0] * shape[1] * slab_size
+        return slab_voxels * ZIntNorm.SLAB_BYTES_PER_VOXEL / (1024**3)
+
+    @staticmethod
+    def _iter_slabs(shape: tuple, slab_size: int):
+        """
+        Yield the index tuples of every z slab, volume by volume, in on-disk (Fortran) order.
+        """
+        n_z = shape[2] if len(shape) > 2 else 1
+        n_vols = math.prod(shape[3:]) if len(shape) > 3 else 1
+        for vol in range(n_vols):
+            vol_index = (
+                np.unravel_index(vol, shape[3:], order="F") if n_vols > 1 else ()
+            )
+            for z in range(0, n_z, slab_size):
+                yield (
+                    slice(None),
+                    slice(None),
+                    slice(z, min(z + slab_size, n_z)),
+                ) + tuple(vol_index)
+
+    @staticmethod
+    def _slab_source(nii):
+        """
+        Returns the array proxy of an uncompressed image, or its whole data for a compressed one.
+        """
+        ext = os.path.splitext(nii.get_filename())[1]
+        if ext in ImageOpener.compress_ext_map:
+            return np.asanyarray(nii.dataobj)
+        return nii.dataobj
+
+    @staticmethod
+    def _read_mask(mask_source, index: tuple) -> np.ndarray:
+        # The mask is always 3D, apply it to every volume
+        return np.asarray(mask_source[index[:3]], dtype=np.uint8) > 0
+
     def _run_interface(self, runtime):
         self.inputs.out_file = self._gen_outfilename()
+        slab_size = max(1, self.inputs.slab_size)
 
-        # --- LOAD IMAGE ---
-        img_nii = nib.load(self.inputs.in_file)
-        img = img_nii.get_fdata(dtype=np.float32)
-
-        # --- MASK LOGIC ---
+        # --- OPEN IMAGE (memory-mapped when uncompressed) ---
+        img_nii = nib.load(self.inputs.in_file, mmap=True)
+        shape = img_nii.shape
+        img_source = ZIntNorm._slab_source(img_nii)
+        mask_source = None
         if isdefined(self.inputs.mask_file):
-            mask = nib.load(self.inputs.mask_file).get_fdata() > 0
-        else:
-            mask = img > 0
-
-        # --- Z-SCORE NORMALIZATION ---
-        vals = img[mask]
-
-        mean = vals.mean()
-        std = vals.std()
+            mask_nii = nib.load(self.inputs.mask_file, mmap=True)
+            if mask_nii.shape[:3] != shape[:3]:
+                raise RuntimeError("Mask and image dimensions mismatch")
+            mask_source = ZIntNorm._slab_source(mask_nii)
+        loaded_gb = sum(
+            source.nbytes
+            for source in (img_source, mask_source)
+            if isinstance(source, np.ndarray)
+        ) / (1024**3)
+
+        # --- STREAMING STATISTICS (Welford/Chan merge of slab moments) ---
+        count = 0
+        mean = 0.0
+        m2 = 0.0
+        for index in ZIntNorm._iter_slabs(shape, slab_size):
+            slab = np.asarray(img_source[index], dtype=np.float64)
+            if mask_source is not None:
+                vals = slab[ZIntNorm._read_mask(mask_source, index)]
+            else:
+                vals = slab[slab > 0]
+            slab_count = vals.size
+            if slab_count == 0:
+                continue
+            slab_mean = vals.mean()
+            slab_m2 = np.square(vals - slab_mean).sum()
+            delta = slab_mean - mean
+            total = count + slab_count
+            mean += delta * slab_count / total
+            m2 += slab_m2 + delta**2 * count * slab_count / total
+            count = total
+
+        std = math.sqrt(m2 / count) if count > 0 else 0
 
         if std == 0:
             raise RuntimeError("Standard deviation is zero")
 
-        img_norm = np.zeros_like(img, dtype=np.float32)
-        img_norm = (img - mean) / std
-
-        # --- SAVE ---
+        # --- SAVE (header first, then slabs in on-disk order) ---
         hdr = img_nii.header.copy()
         hdr.set_data_dtype(np.float32)
-        out_nii = nib.Nifti1Image(img_norm, img_nii.affine, hdr)
-        nib.save(out_nii, self.inputs.out_file)
+        hdr.set_slope_inter(1, 0)
+        hdr.set_data_offset(0)
+        out_dtype = hdr.get_data_dtype()
+        with ImageOpener(self.inputs.out_file, "wb") as fileobj:
+            hdr.write_to(fileobj)
+            seek_tell(fileobj, hdr.get_data_offset(), write0=True)
+            for index in ZIntNorm._iter_slabs(shape, slab_size):
+                slab = np.asarray(img_source[index], dtype=np.float32)
+                slab = (slab - np.float32(mean)) / np.float32(std)
+                fileobj.write(slab.astype(out_dtype, copy=False).tobytes(order="F"))
+
+        self._peak_mem_gb = ZIntNorm.slab_mem_gb(shape, slab_size) + loaded_gb
 
         return runtime
 
@@ -82,4 +181,6 @@ class ZIntNorm(BaseInterface):
     def _list_outputs(self):
         outputs = self.output_spec().get()
         outputs["out_file"] = self._gen_outfilename()
+        if hasattr(self, "_peak_mem_gb"):
+            outputs["peak_mem_gb"] = self._peak_mem_gb
         return outputs
@@ -1,3 +1,6 @@
+import os
+import nibabel as nib
+from nipype.interfaces.base import isdefined
 from swane.nipype_pipeline.engine.MonitoredMultiProcPlugin import NipypeRamEstimator
 
 
@@ -70,3 +73,120 @@ class FastRamEstimator(NipypeRamEstimator):
             min_gb=1,
             max_gb=8,
         )
+
+
+class AromaFeaturesRamEstimator(NipypeRamEstimator):
+    """
+    RAM estimator for AromaFeatures.
+    The estimate is computed from the 4D spatial maps dimensions and the number of threads.
+    """
+
+    def __init__(self):
+        super().__init__(overhead_gb=0.3, min_gb=0.4, max_gb=8.0)
+
+    def __call__(self, inputs):
+        from swane.nipype_pipeline.nodes.AromaFeatures import AromaFeatures
+
+        debug_lines = []
+        maps_gb = 0.0
+        if isdefined(inputs.in_file) and os.path.exists(inputs.in_file):
+            shape = nib.load(inputs.in_file).header.get_data_shape()
+            maps_gb = AromaFeatures.mem_gb(shape, inputs.num_threads)
+            debug_lines.append(
+                f"in_file: shape={shape}, num_threads={inputs.num_threads}, "
+                f"maps and masks={maps_gb:.3f} GB"
+            )
+        else:
+            debug_lines.append("in_file: undefined")
+
+        mem_gb = maps_gb + self.overhead_gb
+        debug_lines.append(
+            f"Overhead={self.overhead_gb} GB, total estimated RAM={mem_gb:.3f} GB"
+        )
+        mem_gb = self.clamp(mem_gb, self.min_gb, self.max_gb)
+        debug_lines.append(f"Clamp={mem_gb:.3f} GB")
+
+        return float(mem_gb), " | ".join(debug_lines)
+
+
+class MultiProbTrackX2RamEstimator(NipypeRamEstimator):
+    """
+    RAM estimator for MultiProbTrackX2.
+    Every concurrent probtrackx run loads all the bedpostx samples as float.
+    """
+
+    BYTES_PER_SAMPLE = 4
+
+    def __init__(self):
+        super().__init__(overhead_gb=0.3, min_gb=0.5, max_gb=64.0)
+
+    def __call__(self, inputs):
+        from swane.nipype_pipeline.nodes.MultiProbTrackX2 import MultiProbTrackX2
+
+        debug_lines = []
+        samples_gb = 0.0
+        shm_gb = 0.0
+        for name in ["fsamples", "phsamples", "thsamples"]:
+            files = getattr(inputs, name)
+            if not isdefined(files):
+                debug_lines.append(f"{name}: undefined")
+                continue
+            if isinstance(files, str):
+                files = [files]
+            for file in files:
+                shape = nib.load(file).header.get_data_shape()
+                n_samples = 1
+                for dim in shape:
+                    n_samples *= int(dim)
+                samples_gb += n_samples * self.BYTES_PER_SAMPLE / 1024**3
+                if inputs.use_shm:
+                    shm_gb += os.path.getsize(file) / 1024**3
+        pool_size = MultiProbTrackX2.pool_size(inputs)
+        debug_lines.append(
+            f"samples={samples_gb:.3f} GB, concurrent runs={pool_size}, "
+            f"shared memory copy={shm_gb:.3f} GB"
+        )
+
+        mem_gb = samples_gb * pool_size + shm_gb + self.overhead_gb
+        debug_lines.append(
+            f"Overhead={self.overhead_gb} GB, total estimated RAM={mem_gb:.3f} GB"
+        )
+        mem_gb = self.clamp(mem_gb, self.min_gb, self.max_gb)
+        debug_lines.append(f"Clamp={mem_gb:.3f} GB")
+
+        return float(mem_gb), " | ".join(debug_lines)
+
+
+class FilterRegressorRamEstimator(NipypeRamEstimator):
+    """
+    RAM estimator for FSL fsl_regfilt.
+    The whole 4D series is loaded as a double matrix, along with its denoised copy.
+    """
+
+    # input and output series as double
+    BYTES_PER_SAMPLE = 16
+
+    def __init__(self):
+        super().__init__(overhead_gb=0.3, min_gb=0.5, max_gb=12.0)
+
+    def __call__(self, inputs):
+        debug_lines = []
+        series_gb = 0.0
+        if isdefined(inputs.in_file) and os.path.exists(inputs.in_file):
+            shape = nib.load(inputs.in_file).header.get_data_shape()
+            n_samples = 1
+            for dim in shape:
+                n_samples *= int(dim)
+            series_gb = n_samples * self.BYTES_PER_SAMPLE / 1024**3
+            debug_lines.append(f"in_file: shape={shape}, series={series_gb:.3f} GB")
+        else:
+            debug_lines.append("in_file: undefined")
+
+        mem_gb = series_gb + self.overhead_gb
+        debug_lines.append(
+            f"Overhead={self.overhead_gb} GB, total estimated RAM={mem_gb:.3f} GB"
+        )
+        mem_gb = self.clamp(mem_gb, self.min_gb, self.max_gb)
+        debug_lines.append(f"Clamp={mem_gb:.3f} GB")
+
+        return float(mem_gb), " | ".join(debug_lines)
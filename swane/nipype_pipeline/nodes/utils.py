@@ -5,6 +5,7 @@ from nipype.interfaces.fsl import (
     FNIRT,
     InvWarp,
     ConvertXFM,
+    ConvertWarp,
     ApplyWarp,
     ApplyXFM,
 )
@@ -26,6 +27,17 @@ def getn(result_list, index):
     return result_list[index]
 
 
+def get_protocol_runs(result_list, protocol_start, protocol_stop, protocols_n):
+    """
+    Extracts the runs of some protocols from a MultiProbTrackX2 output list, ordered by
+    protocol and then by seed.
+
+    """
+
+    runs_n = len(result_list) // protocols_n
+    return result_list[protocol_start * runs_n : protocol_stop * runs_n]
+
+
 def get_deskull_node(
     name: str,
     use_synth: bool,
@@ -254,6 +266,84 @@ def get_registration_node(
             )
 
 
+def _connect_input(
+    workflow: CustomWorkflow, source: str | list[Node | str], node: Node, field: str
+):
+    if type(source) == str:
+        setattr(node.inputs, field, source)
+    else:
+        workflow.connect(source[0], source[1], node, field)
+
+
+def compose_transforms_node(
+    name: str,
+    workflow: CustomWorkflow,
+    transforms: list[tuple[str | list[Node | str], bool]],
+    reference: str | list[Node | str],
+    name_prefix: str = "",
+    name_suffix: str = "",
+) -> tuple[list[Node | str], bool]:
+    """
+    Concatenates a chain of FSL transforms into a single one, so that an image is resampled once.
+    Consecutive affine matrices are joined with convert_xfm, nonlinear FNIRT coefficients or
+    fields with convertwarp in a relative displacement field in reference space.
+
+    Parameters
+    ----------
+    name : str
+        The base name of the composition nodes.
+    workflow : CustomWorkflow
+        The workflow of the nodes.
+    transforms : list[tuple[str | list[Node | str], bool]]
+        The transforms in application order, each as (transform, is_non_linear).
+    reference : str | list[Node | str]
+        The image in the target space of the whole chain.
+
+    Returns
+    -------
+    The [node, field] of the composite transform and True if it is nonlinear.
+
+    """
+
+    # Join consecutive affine matrices
+    steps = []
+    for index, (transform, non_linear) in enumerate(transforms):
+        if non_linear or len(steps) == 0 or steps[-1][1]:
+            steps.append((transform, non_linear))
+            continue
+        concat_xfm = Node(ConvertXFM(), name="%s_concat_xfm_%d" % (name, index))
+        concat_xfm.long_name = name_prefix + " %s " + name_suffix
+        concat_xfm.inputs.concat_xfm = True
+        _connect_input(workflow, steps[-1][0], concat_xfm, "in_file")
+        _connect_input(workflow, transform, concat_xfm, "in_file2")
+        steps[-1] = ([concat_xfm, "out_file"], False)
+
+    warps = [step for step in steps if step[1]]
+    if len(warps) == 0:
+        return steps[0][0], False
+    if len(warps) > 2:
+        raise ValueError("convertwarp cannot compose more than two warps")
+
+    convert_warp = Node(ConvertWarp(), name=name + "_convert_warp")
+    convert_warp.long_name = name_prefix + " %s " + name_suffix
+    convert_warp.inputs.out_relwarp = True
+    _connect_input(workflow, reference, convert_warp, "reference")
+    # Affine slots before, between and after the warps
+    warp_fields = ["warp1", "warp2"]
+    affine_fields = ["premat", "midmat", "postmat"]
+    warp_index = 0
+    for transform, non_linear in steps:
+        if non_linear:
+            _connect_input(workflow, transform, convert_warp, warp_fields[warp_index])
+            warp_index += 1
+        elif warp_index == len(warps):
+            _connect_input(workflow, transform, convert_warp, "postmat")
+        else:
+            _connect_input(workflow, transform, convert_warp, affine_fields[warp_index])
+
+    return [convert_warp, "out_file"], True
+
+
 def apply_registration_node(
     name: str,
     use_synth: bool,
@@ -266,7 +356,26 @@ def apply_registration_node(
     labelmap: bool = False,
     name_prefix: str = "",
     name_suffix: str = "",
+    transforms: list[tuple[str | list[Node | str], bool]] = None,
 ) -> Node:
+    """
+    Resamples an image with a transform. If transforms is set, the chain of
+    (transform, is_non_linear) is composed and applied in one resampling, warp and
+    non_linear are ignored. SynthMorph warps cannot be composed.
+
+    """
+    if transforms is not None:
+        if use_synth:
+            raise ValueError("SynthMorph transforms cannot be composed")
+        warp, non_linear = compose_transforms_node(
+            name=name,
+            workflow=workflow,
+            transforms=transforms,
+            reference=reference,
+            name_prefix=name_prefix,
+            name_suffix=name_suffix,
+        )
+
     if use_synth:
         apply_node = Node(SynthMorphApply(), name=name + "_morph_apply")
         apply_node.long_name = name_prefix + " %s " + name_suffix
@@ -280,6 +389,8 @@ def apply_registration_node(
         if labelmap:
             apply_node.inputs.interp = "nn"
         workflow.connect(warp[0], warp[1], apply_node, "field_file")
+        if transforms is not None:
+            apply_node.inputs.relwarp = True
         if type(reference) == str:
             apply_node.inputs.ref_file = reference
         else:
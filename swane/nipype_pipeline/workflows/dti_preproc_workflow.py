@@ -3,15 +3,18 @@ from nipype.interfaces.fsl import (
     EddyCorrect,
     DTIFit,
     BEDPOSTX5,
+    XFibres5,
 )
 from nipype.interfaces.freesurfer.utils import LTAConvert
-from nipype.pipeline.engine import Node
+from nipype.pipeline.engine import Node, MapNode
 from swane.config.config_enums import CoreLimit
 from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
 from swane.nipype_pipeline.nodes.CustomDcm2niix import CustomDcm2niix
 from swane.nipype_pipeline.nodes.ForceOrient import ForceOrient
 from swane.nipype_pipeline.nodes.GenEddyFiles import GenEddyFiles
 from swane.nipype_pipeline.nodes.CustomEddy import CustomEddy
+from swane.nipype_pipeline.nodes.BedpostxSplit import BedpostxSplit
+from swane.nipype_pipeline.nodes.BedpostxMerge import BedpostxMerge
 from swane.nipype_pipeline.nodes.utils import (
     get_deskull_node,
     get_registration_node,
@@ -32,6 +35,7 @@ def dti_preproc_workflow(
     base_dir: str = "/",
     max_cpu: int = 0,
     multicore_node_limit: CoreLimit = CoreLimit.SOFT_CAP,
+    mni_registration: bool = True,
 ) -> CustomWorkflow:
     """
     DTI preprocessing workflow with eddy current and motion artifact correction.
@@ -51,9 +55,12 @@ def dti_preproc_workflow(
     synth_config: SectionProxy
         FreeSurfer Synth tools settings.
     max_cpu : int, optional
-        If greater than 0, limit the core usage of bedpostx. The default is 0.
+        If greater than 0, limit the core usage of eddy. The default is 0.
     multicore_node_limit: CORE_LIMIT, optional
-        Preference for bedpostX core usage. The default il CORE_LIMIT.SOFT_CAP
+        Preference for eddy core usage. The default il CORE_LIMIT.SOFT_CAP
+    mni_registration : bool, optional
+        If False, the MNI to reference warp for tractography is not computed here
+        and mni2ref_warp is left unconnected. The default is True.
 
     Input Node Fields
     ----------
@@ -253,52 +260,80 @@ def dti_preproc_workflow(
     is_tractography = config.getboolean_safe("tractography")
     if is_tractography:
 
-        mni = abspath(
-            os.path.join(os.environ["FSLDIR"], "data/standard/MNI152_T1_1mm.nii.gz")
-        )
-        mni_brain = abspath(
-            os.path.join(
-                os.environ["FSLDIR"], "data/standard/MNI152_T1_1mm_brain.nii.gz"
+        if mni_registration:
+            mni = abspath(
+                os.path.join(os.environ["FSLDIR"], "data/standard/MNI152_T1_1mm.nii.gz")
+            )
+            mni_brain = abspath(
+                os.path.join(
+                    os.environ["FSLDIR"], "data/standard/MNI152_T1_1mm_brain.nii.gz"
+                )
             )
-        )
 
-        mni_2_ref = get_registration_node(
-            name="mni_2_ref",
-            name_prefix="MNI atlas",
-            name_suffix="to reference",
-            use_synth=synth_config.getboolean_safe("morph"),
-            workflow=workflow,
-            moving=mni,
-            moving_brain=mni_brain,
-            reference=[inputnode, "reference"],
-            reference_brain=[inputnode, "reference_brain"],
-            flirt_cost="corratio",
-            non_linear=True,
-        )
-        workflow.connect(
-            mni_2_ref.out_registered_node, mni_2_ref.warp, outputnode, "mni2ref_warp"
-        )
+            mni_2_ref = get_registration_node(
+                name="mni_2_ref",
+                name_prefix="MNI atlas",
+                name_suffix="to reference",
+                use_synth=synth_config.getboolean_safe("morph"),
+                workflow=workflow,
+                moving=mni,
+                moving_brain=mni_brain,
+                reference=[inputnode, "reference"],
+                reference_brain=[inputnode, "reference_brain"],
+                flirt_cost="corratio",
+                non_linear=True,
+            )
+            workflow.connect(
+                mni_2_ref.out_registered_node,
+                mni_2_ref.warp,
+                outputnode,
+                "mni2ref_warp",
+            )
 
         # NODE 8: Bayesian estimation of diffusion parameters
-        bedpostx = Node(BEDPOSTX5(), name="dti_bedpostx")
-        bedpostx.inputs.n_fibres = 2
-        bedpostx.inputs.rician = True
-        bedpostx.inputs.sample_every = 25
-        bedpostx.inputs.n_jumps = 1250
-        bedpostx.inputs.burn_in = 1000
-        bedpostx.inputs.use_gpu = is_cuda
-        if not is_cuda:
+        if is_cuda:
             # if cuda is enabled only 1 process is launched
-            if multicore_node_limit == CoreLimit.SOFT_CAP:
-                bedpostx.inputs.environ = {"FSLSUB_PARALLEL": str(max_cpu)}
-            elif multicore_node_limit == CoreLimit.HARD_CAP:
-                bedpostx.inputs.environ = {"FSLSUB_PARALLEL": str(max_cpu)}
-                bedpostx.n_procs = max_cpu
-
-        workflow.connect(eddy, eddy_output_name, bedpostx, "dwi")
-        workflow.connect(b0_deskull, "mask_file", bedpostx, "mask")
-        workflow.connect(conversion, "bvecs", bedpostx, "bvecs")
-        workflow.connect(conversion, "bvals", bedpostx, "bvals")
+            bedpostx = Node(BEDPOSTX5(), name="dti_bedpostx")
+            bedpostx.inputs.n_fibres = 2
+            bedpostx.inputs.rician = True
+            bedpostx.inputs.sample_every = 25
+            bedpostx.inputs.n_jumps = 1250
+            bedpostx.inputs.burn_in = 1000
+            bedpostx.inputs.use_gpu = True
+
+            workflow.connect(eddy, eddy_output_name, bedpostx, "dwi")
+            workflow.connect(b0_deskull, "mask_file", bedpostx, "mask")
+            workflow.connect(conversion, "bvecs", bedpostx, "bvecs")
+            workflow.connect(conversion, "bvals", bedpostx, "bvals")
+        else:
+            # Data are split in slice chunks, every xfibres chunk is a separate job for the scheduler and
+            # is cached on its own, so a resumed run only computes missing chunks
+            bedpostx_split = Node(BedpostxSplit(), name="dti_bedpostx_split")
+            bedpostx_split.long_name = "Diffusion data splitting"
+            workflow.connect(eddy, eddy_output_name, bedpostx_split, "dwi")
+            workflow.connect(b0_deskull, "mask_file", bedpostx_split, "mask")
+
+            xfibres = MapNode(XFibres5(), name="dti_xfibres", iterfield=["dwi", "mask"])
+            xfibres.inputs.n_fibres = 2
+            xfibres.inputs.fudge = 1
+            xfibres.inputs.model = 2
+            xfibres.inputs.cnlinear = True
+            xfibres.inputs.rician = True
+            xfibres.inputs.sample_every = 25
+            xfibres.inputs.n_jumps = 1250
+            xfibres.inputs.burn_in = 1000
+            workflow.connect(bedpostx_split, "dwi_chunks", xfibres, "dwi")
+            workflow.connect(bedpostx_split, "mask_chunks", xfibres, "mask")
+            workflow.connect(conversion, "bvecs", xfibres, "bvecs")
+            workflow.connect(conversion, "bvals", xfibres, "bvals")
+
+            bedpostx = Node(BedpostxMerge(), name="dti_bedpostx")
+            bedpostx.long_name = "Diffusion samples merging"
+            workflow.connect(b0_deskull, "mask_file", bedpostx, "mask")
+            workflow.connect(bedpostx_split, "chunk_slices", bedpostx, "chunk_slices")
+            workflow.connect(xfibres, "fsamples", bedpostx, "fsamples")
+            workflow.connect(xfibres, "phsamples", bedpostx, "phsamples")
+            workflow.connect(xfibres, "thsamples", bedpostx, "thsamples")
 
         workflow.connect(bedpostx, "merged_fsamples", outputnode, "fsamples")
         workflow.connect(b0_deskull, "mask_file", outputnode, "nodiff_mask_file")
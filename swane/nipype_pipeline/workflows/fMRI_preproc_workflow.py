@@ -1,7 +1,6 @@
 from nipype import Node, IdentityInterface, Merge
 from nipype.interfaces.fsl import (
     ImageMaths,
-    ExtractROI,
     MCFLIRT,
     BET,
     ImageStats,
@@ -13,8 +12,7 @@ from swane.nipype_pipeline.nodes.CustomDcm2niix import CustomDcm2niix
 from swane.nipype_pipeline.nodes.FslNVols import FslNVols
 from swane.nipype_pipeline.nodes.CustomSliceTimer import CustomSliceTimer
 from swane.nipype_pipeline.nodes.GetNiftiTR import GetNiftiTR
-from swane.nipype_pipeline.nodes.ForceOrient import ForceOrient
-from swane.nipype_pipeline.nodes.DeleteVolumes import DeleteVolumes
+from swane.nipype_pipeline.nodes.FuncPreproc import FuncPreproc
 from swane.config.config_enums import SliceTiming
 
 
@@ -97,44 +95,14 @@ def fMRI_preproc_workflow(
     getTR.inputs.force_value = TR
     workflow.connect(conversion, "converted_files", getTR, "in_file")
 
-    # NODE 4: Delete specified volumes at start and end of sequence
-    del_vols = Node(DeleteVolumes(), name="%s_del_vols" % name)
-    del_vols.long_name = "Edge volumes trimming"
-    del_vols.inputs.del_start_vols = del_start_vols
-    del_vols.inputs.del_end_vols = del_end_vols
-    workflow.connect(conversion, "converted_files", del_vols, "in_file")
-    workflow.connect(nvols, "nvols", del_vols, "nvols")
-
-    # NODE 5: Orienting in radiological convention
-    reorient = Node(ForceOrient(), name="%s_reorient" % name)
-    workflow.connect(del_vols, "out_file", reorient, "in_file")
-
-    # NODE 5: Convert functional images to float representation.
-    img2float = Node(ImageMaths(), name="%s_img2float" % name)
-    img2float.long_name = "Intensity in float values"
-    img2float.inputs.out_data_type = "float"
-    img2float.inputs.op_string = ""
-    img2float.inputs.suffix = "_dtype"
-    workflow.connect(reorient, "out_file", img2float, "in_file")
-
-    # NODE 6: Extract the middle volume of the first run as the reference
-    extract_ref = Node(ExtractROI(), name="%s_extract_ref" % name)
-    extract_ref.long_name = "Reference volume selection"
-    extract_ref.inputs.t_size = 1
-
-    # Function to extract the middle volume number
-    def get_middle_volume(func):
-        from nibabel import load
-
-        funcfile = func
-        if isinstance(func, list):
-            funcfile = func[0]
-        _, _, _, timepoints = load(funcfile).shape
-        middle = int(timepoints / 2)
-        return middle
-
-    workflow.connect(img2float, "out_file", extract_ref, "in_file")
-    workflow.connect(reorient, ("out_file", get_middle_volume), extract_ref, "t_min")
+    # NODE 4: Delete edge volumes, reorient in radiological convention, convert in float
+    # and extract the middle volume as reference in a single pass over the series
+    func_preproc = Node(FuncPreproc(), name="%s_func_preproc" % name)
+    func_preproc.long_name = "Edge volumes trimming and reference selection"
+    func_preproc.inputs.del_start_vols = del_start_vols
+    func_preproc.inputs.del_end_vols = del_end_vols
+    workflow.connect(conversion, "converted_files", func_preproc, "in_file")
+    workflow.connect(nvols, "nvols", func_preproc, "nvols")
 
     # NODE 7: Realign the functional runs to the middle volume of the first run
     motion_correct = Node(MCFLIRT(), name="%s_motion_correct" % name)
@@ -142,8 +110,8 @@ def fMRI_preproc_workflow(
     motion_correct.inputs.save_plots = True
     motion_correct.inputs.save_rms = True
     motion_correct.inputs.interpolation = "spline"
-    workflow.connect(img2float, "out_file", motion_correct, "in_file")
-    workflow.connect(extract_ref, "roi_file", motion_correct, "ref_file")
+    workflow.connect(func_preproc, "out_file", motion_correct, "in_file")
+    workflow.connect(func_preproc, "ref_file", motion_correct, "ref_file")
 
     # NODE 8: Perform slice timing correction if needed
     # TODO: per resting state NON usare lo slice timing correction
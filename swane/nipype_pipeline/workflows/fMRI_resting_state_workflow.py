@@ -12,19 +12,25 @@ from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
 from swane.nipype_pipeline.workflows.fMRI_preproc_workflow import fMRI_preproc_workflow
 from swane.config.config_enums import SliceTiming
 from ica_aroma_py.services.ICA_AROMA_nodes import (
-    FeatureTimeSeries,
-    FeatureFrequency,
     AromaClassification,
-    FeatureSpatial,
     FeatureSpatialPrep,
-    IsoResample,
+)
+from swane.nipype_pipeline.nodes.AromaFeatures import AromaFeatures
+from swane.nipype_pipeline.nodes.ram_estimators import (
+    AromaFeaturesRamEstimator,
+    FilterRegressorRamEstimator,
 )
 from ica_aroma_py import aroma_mask_out, aroma_mask_edge, aroma_mask_csf
 import os
 
 
 def fMRI_resting_state_workflow(
-    name: str, dicom_dir: str, config: SectionProxy, base_dir: str = "/"
+    name: str,
+    dicom_dir: str,
+    config: SectionProxy,
+    base_dir: str = "/",
+    max_cpu: int = 1,
+    mni_registration: bool = True,
 ) -> CustomWorkflow:
     """
     fMRI resting state anlysis
@@ -39,12 +45,22 @@ def fMRI_resting_state_workflow(
         workflow settings.
     base_dir : path, optional
         The base directory path relative to parent workflow. The default is "/".
+    max_cpu : int, optional
+        Number of threads for AROMA features extraction. The default is 1.
+    mni_registration : bool, optional
+        If False, the reference to MNI warp for AROMA is not computed here and must be
+        connected to mni_inputnode. The default is True.
 
     Input Node Fields
     ----------
     reference_brain : path
         Betted T13D.
 
+    MNI Input Node Fields (if mni_registration is False)
+    ----------
+    ref_2_mni_warp : path
+        Nonlinear FNIRT registration warp from T13D to MNI atlas space.
+
     Output Node Fields
     ----------
     IC : path
@@ -148,59 +164,63 @@ def fMRI_resting_state_workflow(
             os.environ["FSLDIR"], "data", "standard", "MNI152_T1_2mm_brain.nii.gz"
         )
 
-        flirt = Node(FLIRT(), name="ref_2_mni_flirt")
-        flirt.long_name = "%s to atlas"
-        flirt.inputs.searchr_x = [-90, 90]
-        flirt.inputs.searchr_y = [-90, 90]
-        flirt.inputs.searchr_z = [-90, 90]
-        flirt.inputs.dof = 12
-        flirt.inputs.cost = "corratio"
-        flirt.inputs.out_matrix_file = "ref_2_mni.mat"
-        flirt.inputs.reference = mni2
-        workflow.connect(inputnode, "reference_brain", flirt, "in_file")
-
-        # NODE 2: Nonlinear registration
-        fnirt = Node(FNIRT(), name="ref_2_mni_fnirt")
-        fnirt.long_name = "%s to atlas"
-        fnirt.inputs.fieldcoeff_file = True
-        fnirt.inputs.ref_file = mni2
-        workflow.connect(flirt, "out_matrix_file", fnirt, "affine_file")
-        workflow.connect(inputnode, "reference_brain", fnirt, "in_file")
-
         apply_warp = Node(ApplyWarp(), name="func2mni")
         apply_warp.inputs.ref_file = mni2
+        # Uncompressed, so that features extraction can memory-map it
+        apply_warp.inputs.output_type = "NIFTI"
         workflow.connect(flirt_2_ref, "out_matrix_file", apply_warp, "premat")
         workflow.connect(feature_spatial_prep, "out_file", apply_warp, "in_file")
-        workflow.connect(fnirt, "fieldcoeff_file", apply_warp, "field_file")
-
-        feature_spatial = Node(FeatureSpatial(), name="feature_spatial")
-        feature_spatial.inputs.mask_csf = aroma_mask_csf
-        feature_spatial.inputs.mask_edge = aroma_mask_edge
-        feature_spatial.inputs.mask_out = aroma_mask_out
-        workflow.connect(apply_warp, "out_file", feature_spatial, "in_file")
 
-        feature_time_series = Node(FeatureTimeSeries(), name="feature_time_series")
-        workflow.connect(motion_correct, "par_file", feature_time_series, "mc")
+        if mni_registration:
+            flirt = Node(FLIRT(), name="ref_2_mni_flirt")
+            flirt.long_name = "%s to atlas"
+            flirt.inputs.searchr_x = [-90, 90]
+            flirt.inputs.searchr_y = [-90, 90]
+            flirt.inputs.searchr_z = [-90, 90]
+            flirt.inputs.dof = 12
+            flirt.inputs.cost = "corratio"
+            flirt.inputs.out_matrix_file = "ref_2_mni.mat"
+            flirt.inputs.reference = mni2
+            workflow.connect(inputnode, "reference_brain", flirt, "in_file")
+
+            # NODE 2: Nonlinear registration
+            fnirt = Node(FNIRT(), name="ref_2_mni_fnirt")
+            fnirt.long_name = "%s to atlas"
+            fnirt.inputs.fieldcoeff_file = True
+            fnirt.inputs.ref_file = mni2
+            workflow.connect(flirt, "out_matrix_file", fnirt, "affine_file")
+            workflow.connect(inputnode, "reference_brain", fnirt, "in_file")
+            workflow.connect(fnirt, "fieldcoeff_file", apply_warp, "field_file")
+        else:
+            # The warp may be computed at a finer MNI resolution, applywarp resamples it
+            mni_inputnode = Node(
+                IdentityInterface(fields=["ref_2_mni_warp"]), name="mni_inputnode"
+            )
+            workflow.connect(mni_inputnode, "ref_2_mni_warp", apply_warp, "field_file")
+
+        # Spatial, time series and frequency features in a single process
+        aroma_features = Node(AromaFeatures(), name="aroma_features")
+        aroma_features.inputs.mask_csf = aroma_mask_csf
+        aroma_features.inputs.mask_edge = aroma_mask_edge
+        aroma_features.inputs.mask_out = aroma_mask_out
+        aroma_features.inputs.num_threads = max_cpu
+        aroma_features.ram_estimator = AromaFeaturesRamEstimator()
+        workflow.connect(apply_warp, "out_file", aroma_features, "in_file")
+        workflow.connect(motion_correct, "par_file", aroma_features, "mc")
+        workflow.connect(preproc_melodic_output, "mel_mix", aroma_features, "mel_mix")
+        workflow.connect(getTR, "TR", aroma_features, "TR")
         workflow.connect(
-            preproc_melodic_output, "mel_mix", feature_time_series, "mel_mix"
-        )
-
-        feature_frequency = Node(FeatureFrequency(), name="feature_frequency")
-        workflow.connect(getTR, "TR", feature_frequency, "TR")
-        workflow.connect(
-            preproc_melodic_output, "mel_ft_mix", feature_frequency, "mel_ft_mix"
+            preproc_melodic_output, "mel_ft_mix", aroma_features, "mel_ft_mix"
         )
 
         aroma_classification = Node(AromaClassification(), name="aroma_classification")
-        workflow.connect(feature_frequency, "HFC", aroma_classification, "HFC")
-        workflow.connect(
-            feature_time_series, "max_rp_corr", aroma_classification, "max_rp_corr"
-        )
+        workflow.connect(aroma_features, "HFC", aroma_classification, "HFC")
         workflow.connect(
-            feature_spatial, "csf_fract", aroma_classification, "csf_fract"
+            aroma_features, "max_rp_corr", aroma_classification, "max_rp_corr"
         )
+        workflow.connect(aroma_features, "csf_fract", aroma_classification, "csf_fract")
         workflow.connect(
-            feature_spatial, "edge_fract", aroma_classification, "edge_fract"
+            aroma_features, "edge_fract", aroma_classification, "edge_fract"
         )
 
         workflow.connect(
@@ -210,7 +230,8 @@ def fMRI_resting_state_workflow(
             "aroma_classification",
         )
 
-        nonaggr_denoising = Node(FilterRegressor(), name="nonaggr_denoising", mem_gb=5)
+        nonaggr_denoising = Node(FilterRegressor(), name="nonaggr_denoising")
+        nonaggr_denoising.ram_estimator = FilterRegressorRamEstimator()
         nonaggr_denoising.inputs.out_file = "denoised_func_data_nonaggr.nii.gz"
         workflow.connect(highpass, "out_file", nonaggr_denoising, "in_file")
         workflow.connect(
@@ -2,17 +2,17 @@ from nipype import Node, IdentityInterface, SelectFiles
 from nipype.algorithms.modelgen import SpecifyModel
 from nipype.algorithms.rapidart import ArtifactDetect
 from nipype.interfaces.fsl import (
-    ImageMaths,
     Level1Design,
     FEATModel,
     FILMGLS,
     SmoothEstimate,
-    Cluster,
-    ApplyXFM,
 )
 from configparser import SectionProxy
 from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
 from swane.nipype_pipeline.nodes.FMRIGenSpec import FMRIGenSpec
+from swane.nipype_pipeline.nodes.MultiThresholdCluster import MultiThresholdCluster
+from swane.nipype_pipeline.nodes.BatchApplyXFM import BatchApplyXFM
+from swane.nipype_pipeline.nodes.utils import getn
 from swane.config.config_enums import BlockDesign
 from swane.nipype_pipeline.workflows.fMRI_preproc_workflow import fMRI_preproc_workflow
 
@@ -96,7 +96,7 @@ def fMRI_task_workflow(
 
     # Get nodes for further connection
     getTR = workflow.get_node("%s_getTR" % name)
-    del_vols = workflow.get_node("%s_del_vols" % name)
+    func_preproc = workflow.get_node("%s_func_preproc" % name)
     motion_correct = workflow.get_node("%s_motion_correct" % name)
     dilatemask = workflow.get_node("%s_dilatemask" % name)
     flirt_2_ref = workflow.get_node("%s_flirt_2_ref" % name)
@@ -111,7 +111,7 @@ def fMRI_task_workflow(
     genSpec.inputs.task_a_name = task_a_name
     genSpec.inputs.task_b_name = task_b_name
     workflow.connect(getTR, "TR", genSpec, "TR")
-    workflow.connect(del_vols, "nvols", genSpec, "nvols")
+    workflow.connect(func_preproc, "nvols", genSpec, "nvols")
 
     # NODE 28: Determine which of the images in the functional series are outliers
     # based on deviations in intensity and/or movement.
@@ -192,233 +192,57 @@ def fMRI_task_workflow(
         results_select.long_name = "contrast %d result selection" % cont
         workflow.connect(modelestimate, "results_dir", results_select, "base_directory")
 
-        # NODE 35: Mask z-stat with the dilated mask
-        maskfunc4 = Node(ImageMaths(), name="%s_maskfunc4_%d" % (name, cont))
-        maskfunc4.long_name = "Zstat masking"
-        maskfunc4.inputs.suffix = "_mask"
-        maskfunc4.inputs.op_string = "-mas"
-        workflow.connect(results_select, "zstat", maskfunc4, "in_file")
-        workflow.connect(dilatemask, "out_file", maskfunc4, "in_file2")
-
-        # Function to generate the name for the file of output cluster
-        def cluster_file_name(contrasts, thres, run_name, x):
-            return "r-%s_cluster_%s_threshold%.1f.nii.gz" % (
-                run_name,
-                contrasts[x - 1][0],
-                thres,
-            )
-
-        # NODE 36a: Perform clustering on statistical output
-        threshold = 3.1
-        cluster1 = Node(Cluster(), name="%s_cluster_t3_%d" % (name, cont))
-        cluster1.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
-        )
-        cluster1.inputs.threshold = threshold
-        cluster1.inputs.connectivity = 26
-        cluster1.inputs.pthreshold = 0.05
-        cluster1.inputs.out_localmax_txt_file = True
-
-        workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster1,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_threshold_file",
-                        )
-                    ],
-                )
-            ]
-        )
-        workflow.connect(maskfunc4, "out_file", cluster1, "in_file")
-        workflow.connect(results_select, "cope", cluster1, "cope_file")
-        workflow.connect(smoothness, "volume", cluster1, "volume")
-        workflow.connect(smoothness, "dlh", cluster1, "dlh")
-
-        # NODE 37a: Transformation in ref space
-        cluster1_2_ref = Node(ApplyXFM(), name="%s_cluster_t3_%d_to_ref" % (name, cont))
-        cluster1_2_ref.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
-        )
-        cluster1_2_ref.inputs.apply_xfm = True
-        workflow.connect(cluster1, "threshold_file", cluster1_2_ref, "in_file")
-        workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster1_2_ref,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_file",
-                        )
-                    ],
-                )
+        # Function to generate the names for the files of output clusters
+        def cluster_file_names(contrasts, thresholds, run_name, x):
+            return [
+                "r-%s_cluster_%s_threshold%.1f.nii.gz"
+                % (run_name, contrasts[x - 1][0], thres)
+                for thres in thresholds
             ]
-        )
-        workflow.connect(inputnode, "reference_brain", cluster1_2_ref, "reference")
-        workflow.connect(
-            flirt_2_ref, "out_matrix_file", cluster1_2_ref, "in_matrix_file"
-        )
 
+        # NODE 35: Mask z-stat and perform clustering at every threshold
+        thresholds = [3.1, 5, 7]
+        cluster = Node(MultiThresholdCluster(), name="%s_cluster_%d" % (name, cont))
+        cluster.long_name = "contrast " + str(cont) + " %s"
+        cluster.inputs.thresholds = thresholds
+        cluster.inputs.connectivity = 26
+        cluster.inputs.pthreshold = 0.05
         workflow.connect(
-            cluster1_2_ref,
-            "out_file",
-            outputnode,
-            "threshold_file_cont%s_thresh1" % cont,
-        )
-
-        # NODE 36b: Perform clustering on statistical output
-        threshold = 5
-        cluster2 = Node(Cluster(), name="%s_cluster_t5_%d" % (name, cont))
-        cluster2.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
+            genSpec,
+            ("contrasts", cluster_file_names, thresholds, name, cont),
+            cluster,
+            "out_files",
         )
-        cluster2.inputs.threshold = threshold
-        cluster2.inputs.connectivity = 26
-        cluster2.inputs.pthreshold = 0.05
-        cluster2.inputs.out_localmax_txt_file = True
+        workflow.connect(results_select, "zstat", cluster, "in_file")
+        workflow.connect(dilatemask, "out_file", cluster, "mask_file")
+        workflow.connect(smoothness, "volume", cluster, "volume")
+        workflow.connect(smoothness, "dlh", cluster, "dlh")
 
-        workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster2,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_threshold_file",
-                        )
-                    ],
-                )
-            ]
+        # NODE 36: Transformation of all cluster maps in ref space
+        cluster_2_ref = Node(
+            BatchApplyXFM(), name="%s_cluster_%d_to_ref" % (name, cont)
         )
-        workflow.connect(maskfunc4, "out_file", cluster2, "in_file")
-        workflow.connect(results_select, "cope", cluster2, "cope_file")
-        workflow.connect(smoothness, "volume", cluster2, "volume")
-        workflow.connect(smoothness, "dlh", cluster2, "dlh")
-
-        # NODE 37b: Transformation in ref space
-        cluster2_2_ref = Node(ApplyXFM(), name="%s_cluster_t5_%d_to_ref" % (name, cont))
-        cluster2_2_ref.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
+        cluster_2_ref.long_name = (
+            "contrast " + str(cont) + " clusters %s in reference space"
         )
-        cluster2_2_ref.inputs.apply_xfm = True
-        workflow.connect(cluster2, "threshold_file", cluster2_2_ref, "in_file")
+        workflow.connect(cluster, "out_files", cluster_2_ref, "in_files")
         workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster2_2_ref,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_file",
-                        )
-                    ],
-                )
-            ]
+            genSpec,
+            ("contrasts", cluster_file_names, thresholds, name, cont),
+            cluster_2_ref,
+            "out_files",
         )
-        workflow.connect(inputnode, "reference_brain", cluster2_2_ref, "reference")
+        workflow.connect(inputnode, "reference_brain", cluster_2_ref, "reference")
         workflow.connect(
-            flirt_2_ref, "out_matrix_file", cluster2_2_ref, "in_matrix_file"
+            flirt_2_ref, "out_matrix_file", cluster_2_ref, "in_matrix_file"
         )
 
-        workflow.connect(
-            cluster2_2_ref,
-            "out_file",
-            outputnode,
-            "threshold_file_cont%s_thresh2" % cont,
-        )
-
-        # NODE 36c: Perform clustering on statistical output
-        threshold = 7
-        cluster3 = Node(Cluster(), name="%s_cluster_t7_%d" % (name, cont))
-        cluster3.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
-        )
-        cluster3.inputs.threshold = threshold
-        cluster3.inputs.connectivity = 26
-        cluster3.inputs.pthreshold = 0.05
-        cluster3.inputs.out_localmax_txt_file = True
-
-        workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster3,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_threshold_file",
-                        )
-                    ],
-                )
-            ]
-        )
-        workflow.connect(maskfunc4, "out_file", cluster3, "in_file")
-        workflow.connect(results_select, "cope", cluster3, "cope_file")
-        workflow.connect(smoothness, "volume", cluster3, "volume")
-        workflow.connect(smoothness, "dlh", cluster3, "dlh")
-
-        # NODE 37c: Transformation in ref space
-        cluster3_2_ref = Node(ApplyXFM(), name="%s_cluster_t7_%d_to_ref" % (name, cont))
-        cluster3_2_ref.long_name = (
-            "contrast "
-            + str(cont)
-            + " threshold "
-            + str(threshold)
-            + " %s in reference space"
-        )
-        cluster3_2_ref.inputs.apply_xfm = True
-        workflow.connect(cluster3, "threshold_file", cluster3_2_ref, "in_file")
-        workflow.connect(
-            [
-                (
-                    genSpec,
-                    cluster3_2_ref,
-                    [
-                        (
-                            ("contrasts", cluster_file_name, threshold, name, cont),
-                            "out_file",
-                        )
-                    ],
-                )
-            ]
-        )
-        workflow.connect(inputnode, "reference_brain", cluster3_2_ref, "reference")
-        workflow.connect(
-            flirt_2_ref, "out_matrix_file", cluster3_2_ref, "in_matrix_file"
-        )
-
-        workflow.connect(
-            cluster3_2_ref,
-            "out_file",
-            outputnode,
-            "threshold_file_cont%s_thresh3" % cont,
-        )
+        for thresh_i in range(len(thresholds)):
+            workflow.connect(
+                cluster_2_ref,
+                ("out_files", getn, thresh_i),
+                outputnode,
+                "threshold_file_cont%s_thresh%d" % (cont, thresh_i + 1),
+            )
 
     return workflow
@@ -225,6 +225,8 @@ def flat1_workflow(
     binary_flair = Node(ThrROI(), name="%s_binaryFLAIR" % name)
     binary_flair.long_name = "Mean based masking"
     binary_flair.inputs.out_file = "binary_flair.nii.gz"
+    # Keep float output as the following mean filter inherits the input datatype
+    binary_flair.inputs.out_datatype = "float32"
     workflow.connect(cortex_mask, "out_file", binary_flair, "in_file")
     workflow.connect(gm_mean, "out_stat", binary_flair, "seg_val_max")
     workflow.connect(wm_mean, "out_stat", binary_flair, "seg_val_min")
@@ -104,7 +104,7 @@ def get_symmetric(index):
 
 
 def freesurfer_asymmetry_index_workflow(
-    name: str, base_dir: str = "/"
+    name: str, base_dir: str = "/", correction: str = "none"
 ) -> CustomWorkflow:
     """
     Freesurfer cortical reconstruction, white matter ROI, basal ganglia and thalami ROI.
@@ -116,6 +116,8 @@ def freesurfer_asymmetry_index_workflow(
         The workflow name.
     base_dir : path, optional
         The base directory path relative to parent workflow. The default is "/".
+    correction : str, optional
+        Multiple comparison correction for P values (none, bonferroni or fdr). The default is "none".
 
     Input Node Fields
     ----------
@@ -157,6 +159,18 @@ def freesurfer_asymmetry_index_workflow(
     merge_node_ai = Node(Merge(len(lh_labels) * 2), name="merge_node_ai")
     index = 1
 
+    # A single TTest node computes the statistics of every label pair
+    label_pairs = len([label for label in lh_labels if get_symmetric(label) != -1])
+    merge_stats_lh = Node(Merge(label_pairs), name="merge_stats_lh")
+    merge_stats_rh = Node(Merge(label_pairs), name="merge_stats_rh")
+    merge_stats_lh.inputs.no_flatten = True
+    merge_stats_rh.inputs.no_flatten = True
+    t_test = Node(TTest(), name="ttest")
+    t_test.inputs.correction = correction
+    workflow.connect(merge_stats_lh, "out", t_test, "stats_lh")
+    workflow.connect(merge_stats_rh, "out", t_test, "stats_rh")
+    pair_index = 0
+
     for lh_label in lh_labels:
 
         rh_label = get_symmetric(lh_label)
@@ -193,9 +207,12 @@ def freesurfer_asymmetry_index_workflow(
         rh_stats.inputs.op_string = "-M -S -V"
         workflow.connect(rh_apply_mask, "out_file", rh_stats, "in_file")
 
-        t_test = Node(TTest(), name="ttest_%d" % lh_label)
-        workflow.connect(lh_stats, "out_stat", t_test, "stats_lh")
-        workflow.connect(rh_stats, "out_stat", t_test, "stats_rh")
+        workflow.connect(
+            lh_stats, "out_stat", merge_stats_lh, "in%d" % (pair_index + 1)
+        )
+        workflow.connect(
+            rh_stats, "out_stat", merge_stats_rh, "in%d" % (pair_index + 1)
+        )
 
         lh_ai_sum = Node(BinaryMaths(), name="lh_ai_sum_%d" % lh_label)
         lh_ai_sum.inputs.operation = "add"
@@ -238,22 +255,30 @@ def freesurfer_asymmetry_index_workflow(
         lh_value_t = Node(BinaryMaths(), name="lh_value_t_%d" % lh_label)
         lh_value_t.inputs.operation = "mul"
         workflow.connect(lh_mask, "out_file", lh_value_t, "in_file")
-        workflow.connect(t_test, "stat_t", lh_value_t, "operand_value")
+        workflow.connect(
+            t_test, ("stat_t", getn, pair_index), lh_value_t, "operand_value"
+        )
 
         rh_value_t = Node(BinaryMaths(), name="rh_value_t_%d" % lh_label)
         rh_value_t.inputs.operation = "mul"
         workflow.connect(rh_mask_inv, "out_file", rh_value_t, "in_file")
-        workflow.connect(t_test, "stat_t", rh_value_t, "operand_value")
+        workflow.connect(
+            t_test, ("stat_t", getn, pair_index), rh_value_t, "operand_value"
+        )
 
         lh_value_p = Node(BinaryMaths(), name="lh_value_p_%d" % lh_label)
         lh_value_p.inputs.operation = "mul"
         workflow.connect(lh_mask, "out_file", lh_value_p, "in_file")
-        workflow.connect(t_test, "stat_p", lh_value_p, "operand_value")
+        workflow.connect(
+            t_test, ("stat_p", getn, pair_index), lh_value_p, "operand_value"
+        )
 
         rh_value_p = Node(BinaryMaths(), name="rh_value_p_%d" % lh_label)
         rh_value_p.inputs.operation = "mul"
         workflow.connect(rh_mask_inv, "out_file", rh_value_p, "in_file")
-        workflow.connect(t_test, "stat_p", rh_value_p, "operand_value")
+        workflow.connect(
+            t_test, ("stat_p", getn, pair_index), rh_value_p, "operand_value"
+        )
 
         def get_z_op_string(stat_list):
             return "-sub %f -div %f -mas" % (stat_list[0], stat_list[1])
@@ -278,6 +303,7 @@ def freesurfer_asymmetry_index_workflow(
         workflow.connect(rh_z, "out_file", merge_node_z, "in%d" % index)
         workflow.connect(rh_ai_mask, "out_file", merge_node_ai, "in%d" % index)
         index += 1
+        pair_index += 1
 
     sum_masks_t = Node(SumMultiVols(), name="sum_masks_t")
     workflow.connect(merge_node_t, "out", sum_masks_t, "vol_files")
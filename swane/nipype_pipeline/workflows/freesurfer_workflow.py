@@ -1,7 +1,6 @@
 from configparser import SectionProxy
 
 from nipype.interfaces.freesurfer import ReconAll, ApplyVolTransform
-from nipype.interfaces.fsl import BinaryMaths
 from multiprocessing import cpu_count
 from nipype.pipeline.engine import Node
 from math import trunc
@@ -326,29 +325,13 @@ def freesurfer_workflow(
             )
 
     if segmentation_holder is not None:
-        # NODE 7: Left basal ganglia and thalamus binary ROI
-        lhbgROI = Node(ThrROI(), name="lhbgROI")
-        lhbgROI.long_name = "Lh Basal ganglia ROI"
-        lhbgROI.inputs.seg_val_min = 11
-        lhbgROI.inputs.seg_val_max = 13
-        lhbgROI.inputs.out_file = "lhbgROI.nii.gz"
-        workflow.connect(segmentation_holder, "seg_nii", lhbgROI, "in_file")
-
-        # NODE 8: Right basal ganglia and thalamus binary ROI
-        rhbgROI = Node(ThrROI(), name="rhbgROI")
-        rhbgROI.long_name = "Rh Basal ganglia ROI"
-        rhbgROI.inputs.seg_val_min = 50
-        rhbgROI.inputs.seg_val_max = 52
-        rhbgROI.inputs.out_file = "rhbgROI.nii.gz"
-        workflow.connect(segmentation_holder, "seg_nii", rhbgROI, "in_file")
-
-        # NODE 9: Basal ganglia and thalami binary ROI
-        bgROI = Node(BinaryMaths(), name="bgROI")
+        # NODE 7: Basal ganglia and thalami binary ROI (left and right) from a single segmentation load
+        bgROI = Node(ThrROI(), name="bgROI")
         bgROI.long_name = "Basal ganglia ROI"
-        bgROI.inputs.operation = "add"
+        bgROI.inputs.seg_val_ranges = [(11, 13), (50, 52)]
+        bgROI.inputs.combine = True
         bgROI.inputs.out_file = "bgROI.nii.gz"
-        workflow.connect(lhbgROI, "out_file", bgROI, "in_file")
-        workflow.connect(rhbgROI, "out_file", bgROI, "operand_file")
+        workflow.connect(segmentation_holder, "seg_nii", bgROI, "in_file")
 
         workflow.connect(bgROI, "out_file", outputnode, "bgROI")
 
@@ -259,17 +259,34 @@ def func_map_workflow(
     if is_ai:
         sym_template = swane_supplement.sym_template
 
-        func_2_sym_warp = apply_registration_node(
-            name="%s_2_sym_warp" % name,
-            name_prefix=name,
-            name_suffix="to symmetric atlas",
-            use_synth=synth_config.getboolean_safe("morph"),
-            workflow=workflow,
-            warp=[inputnode, "ref_2_sym_warp"],
-            moving=[smooth_2_ref, "out_file"],
-            reference=sym_template,
-            non_linear=True,
-        )
+        if synth_config.getboolean_safe("morph"):
+            func_2_sym_warp = apply_registration_node(
+                name="%s_2_sym_warp" % name,
+                name_prefix=name,
+                name_suffix="to symmetric atlas",
+                use_synth=True,
+                workflow=workflow,
+                warp=[inputnode, "ref_2_sym_warp"],
+                moving=[smooth_2_ref, "out_file"],
+                reference=sym_template,
+                non_linear=True,
+            )
+        else:
+            # Native to symmetric atlas in one resampling, instead of through reference
+            func_2_sym_warp = apply_registration_node(
+                name="%s_2_sym_warp" % name,
+                name_prefix=name,
+                name_suffix="to symmetric atlas",
+                use_synth=False,
+                workflow=workflow,
+                warp=None,
+                moving=[smooth, "out_file"],
+                reference=sym_template,
+                transforms=[
+                    ([reg_wrap.out_registered_node, reg_wrap.warp], False),
+                    ([inputnode, "ref_2_sym_warp"], True),
+                ],
+            )
 
         # NODE 12: RL swap of image in symmetric atlas
         sym_swap = Node(SwapDimensions(), name="%s_sym_swap" % name)
@@ -24,6 +24,7 @@ def linear_reg_workflow(
     is_volumetric: bool = True,
     is_partial_coverage: bool = False,
     bias_field_correction: bool = False,
+    max_cpu: int = 0,
 ) -> CustomWorkflow:
     """
     Transforms input images in a reference space through a linear registration.
@@ -46,6 +47,8 @@ def linear_reg_workflow(
         True if series only includes brain partially. The default is False.
     bias_field_correction : bool, optional
         True to enable bias field correction. The default is False.
+    max_cpu : int, optional
+        If greater than 0, the number of threads used by bias field correction. The default is 0.
 
     Input Node Fields
     ----------
@@ -222,6 +225,8 @@ def linear_reg_workflow(
             bias_correction = Node(
                 N4BiasFieldCorrection(), name="bias_correction", mem_gb=2
             )
+            if max_cpu > 0:
+                bias_correction.inputs.num_threads = max_cpu
             workflow.connect(unbetted_name, "out_file", bias_correction, "out_file")
             workflow.connect(deskull_2_ref, "out_file", bias_correction, "mask_file")
             workflow.connect(
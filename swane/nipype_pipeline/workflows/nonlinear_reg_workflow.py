@@ -6,7 +6,12 @@ from swane.nipype_pipeline.nodes.utils import get_registration_node
 
 # TODO check base_dir = "./"
 def nonlinear_reg_workflow(
-    name: str, synth_config: SectionProxy, base_dir: str = "/"
+    name: str,
+    synth_config: SectionProxy,
+    base_dir: str = "/",
+    use_synth: bool = None,
+    in_file_head: bool = False,
+    atlas_head: bool = False,
 ) -> CustomWorkflow:
     """
     Transforms input images in a reference space through a nonlinear registration.
@@ -20,6 +25,12 @@ def nonlinear_reg_workflow(
         FreeSurfer Synth tools settings.
     base_dir : path, optional
         The base directory path relative to parent workflow. The default is "/".
+    use_synth : bool, optional
+        If set, overrides the morph setting of synth_config. The default is None.
+    in_file_head : bool, optional
+        If True, the nonlinear step uses in_file_head instead of in_file. The default is False.
+    atlas_head : bool, optional
+        If True, the nonlinear step uses atlas_head instead of atlas. The default is False.
 
     Input Node Fields
     ----------
@@ -27,6 +38,10 @@ def nonlinear_reg_workflow(
         The standard atlas for the registration.
     in_file : path
         The input image for the registration.
+    atlas_head : path
+        The standard atlas with skull, if atlas_head is True.
+    in_file_head : path
+        The input image with skull, if in_file_head is True.
 
     Returns
     -------
@@ -49,7 +64,10 @@ def nonlinear_reg_workflow(
     workflow = CustomWorkflow(name=name, base_dir=base_dir)
 
     # Input Node
-    inputnode = Node(IdentityInterface(fields=["atlas", "in_file"]), name="inputnode")
+    inputnode = Node(
+        IdentityInterface(fields=["atlas", "in_file", "atlas_head", "in_file_head"]),
+        name="inputnode",
+    )
 
     # Output Node
     outputnode = Node(
@@ -57,15 +75,19 @@ def nonlinear_reg_workflow(
         name="outputnode",
     )
 
+    if use_synth is None:
+        use_synth = synth_config.getboolean_safe("morph")
+
     reg_wrap = get_registration_node(
         name=name,
         name_prefix="reference",
         name_suffix="to atlas",
-        use_synth=synth_config.getboolean_safe("morph"),
+        use_synth=use_synth,
         workflow=workflow,
-        moving=[inputnode, "in_file"],
+        moving=[inputnode, "in_file_head" if in_file_head else "in_file"],
         moving_brain=[inputnode, "in_file"],
-        reference=[inputnode, "atlas"],
+        reference=[inputnode, "atlas_head" if atlas_head else "atlas"],
+        reference_brain=[inputnode, "atlas"],
         flirt_cost="corratio",
         inverse=True,
         non_linear=True,
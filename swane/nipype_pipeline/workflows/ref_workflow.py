@@ -17,6 +17,7 @@ def ref_workflow(
     config: SectionProxy,
     synth_config: SectionProxy,
     base_dir: str = "/",
+    max_cpu: int = 0,
 ) -> CustomWorkflow:
     """
     T13D workflow to use as reference.
@@ -33,6 +34,8 @@ def ref_workflow(
         Synth tools settings.
     base_dir : path, optional
         The base directory path relative to parent workflow. The default is "/".
+    max_cpu : int, optional
+        If greater than 0, the number of threads used by bias field correction. The default is 0.
 
     Input Node Fields
     ----------
@@ -114,6 +117,8 @@ def ref_workflow(
         N4BiasFieldCorrection(), name="ref_bias_correction", mem_gb=2
     )
     ref_bias_correction.inputs.out_file = "ref.nii.gz"
+    if max_cpu > 0:
+        ref_bias_correction.inputs.num_threads = max_cpu
     workflow.connect(ref_reScale, "out_file", ref_bias_correction, "in_file")
     workflow.connect(ref_deskull, "mask_file", ref_bias_correction, "mask_file")
 
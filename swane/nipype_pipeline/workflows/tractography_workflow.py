@@ -1,20 +1,32 @@
 import os
 import glob
-from nipype import Node, IdentityInterface, MapNode, JoinNode, Merge
+from nipype import Node, IdentityInterface
 from configparser import SectionProxy
 from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
-from swane.nipype_pipeline.nodes.RandomSeedGenerator import RandomSeedGenerator
-from swane.nipype_pipeline.nodes.CustomProbTrackX2 import CustomProbTrackX2
-from swane.nipype_pipeline.nodes.MergeTargets import MergeTargets
+from swane.nipype_pipeline.nodes.SeedPartition import SeedPartition
+from swane.nipype_pipeline.nodes.MultiProbTrackX2 import MultiProbTrackX2
 from swane.nipype_pipeline.nodes.SumMultiTracks import SumMultiTracks
-from swane.config.preference_list import TRACTS, DEFAULT_N_SAMPLES, XTRACT_DATA_DIR
-from swane.nipype_pipeline.nodes.utils import apply_registration_node
+from swane.config.preference_list import (
+    TRACTS,
+    DEFAULT_N_SAMPLES,
+    XTRACT_DATA_DIR,
+    XTRACT_CACHE_DIR,
+)
+from swane.nipype_pipeline.nodes.BatchApplyWarp import BatchApplyWarp
+from swane.nipype_pipeline.nodes.PackMasks import PackMasks
+from swane.nipype_pipeline.nodes.utils import get_protocol_runs
+from swane.nipype_pipeline.nodes.ram_estimators import MultiProbTrackX2RamEstimator
 
 SIDES = ["lh", "rh"]
 
 
 def tractography_workflow(
-    name: str, config: SectionProxy, synth_config: SectionProxy, base_dir: str = "/"
+    name: str,
+    config: SectionProxy,
+    synth_config: SectionProxy,
+    subject_name: str = "",
+    base_dir: str = "/",
+    max_cpu: int = 0,
 ) -> CustomWorkflow:
     """
     Executes tractography for chosen tract using xtract protocols.
@@ -27,8 +39,12 @@ def tractography_workflow(
         The subject workflow preferences.
     synth_config: SectionProxy
         FreeSurfer Synth tools settings.
+    subject_name : str, optional
+        The subject identifier used to derive tractography seeds. The default is "".
     base_dir : path, optional
         The base directory path relative to parent workflow. The default is "/".
+    max_cpu : int, optional
+        If greater than 0, limit the concurrent probtrackx runs. The default is 0.
 
     Input Node Fields
     ----------
@@ -111,216 +127,139 @@ def tractography_workflow(
     else:
         track_threads = config.getint_safe("track_procs")
 
-    # NODE 1: Random seed genration for cache preservation
-    random_seed = Node(RandomSeedGenerator(), name="random_seed")
+    # NODE 1: Deterministic seed generation for cache preservation
+    random_seed = Node(SeedPartition(), name="random_seed")
     random_seed.inputs.seeds_n = track_threads
-    workflow.connect(inputnode, "mask", random_seed, "mask")
+    random_seed.inputs.identity = "%s/%s" % (subject_name, name)
 
     try:
         n_samples = int(TRACTS[name][2] / track_threads)
     except:
         n_samples = int(DEFAULT_N_SAMPLES / track_threads)
 
+    # Xtract protocol loading: all masks of both sides are warped together,
+    # each protocol stores the index of its masks in the warped file list
+    protocols = {}
+    mask_files = []
     for side in SIDES:
-        # Xtract protocol loading
         protocol_dir = os.path.join(XTRACT_DATA_DIR, name + "_" + side[0])
 
         seed_file = os.path.join(protocol_dir, "seed.nii.gz")
         exclude_file = os.path.join(protocol_dir, "exclude.nii.gz")
         stop_file = os.path.join(protocol_dir, "stop.nii.gz")
-        target_files = glob.glob(os.path.join(protocol_dir, "target*"))
+        target_files = sorted(glob.glob(os.path.join(protocol_dir, "target*")))
 
         invert_file = os.path.join(protocol_dir, "invert")
         wayorder_file = os.path.join(protocol_dir, "wayorder")
 
-        is_invert = False
-        is_wayorder = False
+        protocol = {
+            "is_invert": False,
+            "is_wayorder": False,
+            "exclude": None,
+            "stop": None,
+        }
 
         if os.path.exists(invert_file):
-            is_invert = True
+            protocol["is_invert"] = True
         elif os.path.exists(wayorder_file):
-            is_wayorder = True
+            protocol["is_wayorder"] = True
 
         if not os.path.exists(seed_file):
             return None
         if len(target_files) == 0:
             return None
 
-        # NODE 2: Seed ROI nonlinear transformation in T13D reference space
-        seed_2_ref = apply_registration_node(
-            name="seed_2_ref_%s_%s" % (name, side),
-            name_prefix="seed mask",
-            name_suffix="to reference",
-            use_synth=synth_config.getboolean_safe("morph"),
-            workflow=workflow,
-            warp=[inputnode, "mni2ref_warp"],
-            moving=seed_file,
-            reference=[inputnode, "reference_brain"],
-            non_linear=True,
-            labelmap=True,
-        )
-
-        # NODE 4: Target ROIs nonlinear transformation in T13D reference space
-        targets_2_ref = apply_registration_node(
-            name="targets_2_ref_%s_%s" % (name, side),
-            name_prefix="target mask",
-            name_suffix="to reference",
-            use_synth=synth_config.getboolean_safe("morph"),
-            workflow=workflow,
-            warp=[inputnode, "mni2ref_warp"],
-            moving=None,
-            reference=[inputnode, "reference_brain"],
-            non_linear=True,
-            labelmap=True,
-        )
-        if len(target_files) > 1:
-            targets_2_ref.iterables = ("in_file", target_files)
-        else:
-            targets_2_ref.inputs.in_file = target_files[0]
-
-        # NODE 10: Tractography
-        probtrackx = MapNode(
-            CustomProbTrackX2(),
-            name="probtrackx_%s_%s" % (name, side),
-            iterfield=["random_seed"],
-        )
-        probtrackx.long_name = side + " %s"
-        probtrackx.inputs.n_samples = n_samples
-        probtrackx.inputs.loop_check = True
-        probtrackx.inputs.wayorder = is_wayorder
-        probtrackx.inputs.rand_fib = 1
-        probtrackx.inputs.sample_random_points = 1
-        probtrackx.inputs.use_gpu = is_cuda
-        # TODO argomento --ompl che fa??
-        probtrackx.inputs.opd = True
-        workflow.connect(inputnode, "fsamples", probtrackx, "fsamples")
-        workflow.connect(inputnode, "mask", probtrackx, "mask")
-        workflow.connect(inputnode, "reference_brain", probtrackx, "seed_ref")
-        workflow.connect(inputnode, "phsamples", probtrackx, "phsamples")
-        workflow.connect(inputnode, "thsamples", probtrackx, "thsamples")
-        workflow.connect(inputnode, "ref2diff_mat", probtrackx, "xfm")
-        workflow.connect(inputnode, "diff2ref_mat", probtrackx, "inv_xfm")
-        workflow.connect(seed_2_ref, "out_file", probtrackx, "seed")
-        workflow.connect(random_seed, "seeds", probtrackx, "random_seed")
-
-        # Check the number of target ROIs
-        if len(target_files) > 1:
-            merge_targets = JoinNode(
-                MergeTargets(),
-                name="merge_targets_%s_%s" % (name, side),
-                joinsource=targets_2_ref,
-                joinfield="target_files",
-            )
-            merge_targets.long_name = side + " targets ROI merging"
-
-            workflow.connect(targets_2_ref, "out_file", merge_targets, "target_files")
-
-            workflow.connect(merge_targets, "out_file", probtrackx, "waypoints")
-        else:
-            workflow.connect(targets_2_ref, "out_file", probtrackx, "waypoints")
-
-        # Check if inverted run is required in protocol
-        if is_invert:
-            # NODE 11: Inverted tractography
-            probtrackx_inverted = MapNode(
-                CustomProbTrackX2(),
-                name="probtrackx_inverted_%s_%s" % (name, side),
-                iterfield=["random_seed"],
-            )
-            probtrackx_inverted.long_name = side + " inverse %s"
-            probtrackx_inverted.inputs.n_samples = n_samples
-            probtrackx_inverted.inputs.loop_check = True
-            probtrackx_inverted.inputs.wayorder = is_wayorder
-            probtrackx_inverted.inputs.rand_fib = 1
-            probtrackx_inverted.inputs.sample_random_points = 1
-            probtrackx_inverted.inputs.opd = True
-            probtrackx_inverted.inputs.use_gpu = is_cuda
-            workflow.connect(inputnode, "fsamples", probtrackx_inverted, "fsamples")
-            workflow.connect(inputnode, "mask", probtrackx_inverted, "mask")
-            workflow.connect(
-                inputnode, "reference_brain", probtrackx_inverted, "seed_ref"
-            )
-            workflow.connect(inputnode, "phsamples", probtrackx_inverted, "phsamples")
-            workflow.connect(inputnode, "thsamples", probtrackx_inverted, "thsamples")
-            workflow.connect(inputnode, "ref2diff_mat", probtrackx_inverted, "xfm")
-            workflow.connect(inputnode, "diff2ref_mat", probtrackx_inverted, "inv_xfm")
-            workflow.connect(targets_2_ref, "out_file", probtrackx_inverted, "seed")
-            workflow.connect(seed_2_ref, "out_file", probtrackx_inverted, "waypoints")
-            workflow.connect(random_seed, "seeds", probtrackx_inverted, "random_seed")
-
-        # Check for exclusion ROI in protocol
+        protocol["seed"] = len(mask_files)
+        mask_files.append(seed_file)
+        protocol["targets"] = (len(mask_files), len(mask_files) + len(target_files))
+        mask_files.extend(target_files)
         if os.path.exists(exclude_file):
-            # NODE 6: Exclusion ROI nonlinear transformation in T13D reference space
-
-            exclude_2_ref = apply_registration_node(
-                name="exclude_2_ref_%s_%s" % (name, side),
-                name_prefix="exclude mask",
-                name_suffix="to reference",
-                use_synth=synth_config.getboolean_safe("morph"),
-                workflow=workflow,
-                warp=[inputnode, "mni2ref_warp"],
-                moving=exclude_file,
-                reference=[inputnode, "reference_brain"],
-                non_linear=True,
-                labelmap=True,
-            )
-            workflow.connect(exclude_2_ref, "out_file", probtrackx, "avoid_mp")
-
-            if is_invert:
-                workflow.connect(
-                    exclude_2_ref, "out_file", probtrackx_inverted, "avoid_mp"
-                )
-
-        # Check for stop ROI in protocol
+            protocol["exclude"] = len(mask_files)
+            mask_files.append(exclude_file)
         if os.path.exists(stop_file):
-            # NODE 8: stop ROI nonlinear transformation in T13D reference space
-            stop_2_ref = apply_registration_node(
-                name="stop_2_ref_%s_%s" % (name, side),
-                name_prefix="stop mask",
-                name_suffix="to reference",
-                use_synth=synth_config.getboolean_safe("morph"),
-                workflow=workflow,
-                warp=[inputnode, "mni2ref_warp"],
-                moving=stop_file,
-                reference=[inputnode, "reference_brain"],
-                non_linear=True,
-                labelmap=True,
-            )
-            workflow.connect(stop_2_ref, "out_file", probtrackx, "stop_mask")
-
-            if is_invert:
-                workflow.connect(
-                    stop_2_ref, "out_file", probtrackx_inverted, "stop_mask"
-                )
-
-        # NODE 14: Sum tractography and inverted tractography results
+            protocol["stop"] = len(mask_files)
+            mask_files.append(stop_file)
+
+        protocols[side] = protocol
+
+    # NODE 2: Protocol ROIs packed as bits of a few MNI volumes, built once for all subjects
+    pack_masks = Node(PackMasks(), name="pack_masks_%s" % name)
+    pack_masks.long_name = "protocol %s"
+    pack_masks.inputs.in_files = mask_files
+    pack_masks.inputs.cache_dir = XTRACT_CACHE_DIR
+
+    # NODE 3: Protocol ROIs nonlinear transformation in T13D reference space
+    masks_2_ref = Node(BatchApplyWarp(), name="masks_2_ref_%s" % name)
+    masks_2_ref.long_name = "protocol masks %s to reference"
+    masks_2_ref.inputs.unpack_masks = len(mask_files)
+    masks_2_ref.inputs.use_synth = synth_config.getboolean_safe("morph")
+    workflow.connect(pack_masks, "packed_files", masks_2_ref, "in_files")
+    workflow.connect(inputnode, "mni2ref_warp", masks_2_ref, "warp_file")
+    workflow.connect(inputnode, "reference_brain", masks_2_ref, "ref_file")
+
+    # Direct and inverted runs of both sides, each one repeated for every seed
+    runs = []
+    run_slices = {}
+    for side in SIDES:
+        protocol = protocols[side]
+        seed_masks = [protocol["seed"]]
+        target_masks = list(range(*protocol["targets"]))
+        run = {
+            "seed": seed_masks,
+            "waypoints": target_masks,
+            "avoid": protocol["exclude"],
+            "stop": protocol["stop"],
+            "wayorder": protocol["is_wayorder"],
+        }
+        first_run = len(runs)
+        runs.append(run)
+        if protocol["is_invert"]:
+            runs.append(dict(run, seed=target_masks, waypoints=seed_masks))
+        run_slices[side] = (first_run, len(runs))
+
+    # NODE 4: Tractography of all protocols sharing the same bedpostx samples
+    probtrackx = Node(MultiProbTrackX2(), name="probtrackx_%s" % name)
+    probtrackx.long_name = "%s"
+    probtrackx.inputs.protocols = runs
+    probtrackx.inputs.n_samples = n_samples
+    probtrackx.inputs.use_gpu = is_cuda
+    # The runs are executed inside the node, so they must fit its cpu reservation
+    probtrackx.inputs.num_threads = track_threads * len(SIDES)
+    if max_cpu > 0:
+        probtrackx.inputs.num_threads = min(probtrackx.inputs.num_threads, max_cpu)
+    probtrackx.ram_estimator = MultiProbTrackX2RamEstimator()
+    if config.getboolean_safe("track_adaptive"):
+        probtrackx.inputs.adaptive = True
+        probtrackx.inputs.tolerance = config.getfloat_safe("track_adaptive_tolerance")
+    workflow.connect(inputnode, "fsamples", probtrackx, "fsamples")
+    workflow.connect(inputnode, "mask", probtrackx, "mask")
+    workflow.connect(inputnode, "reference_brain", probtrackx, "seed_ref")
+    workflow.connect(inputnode, "phsamples", probtrackx, "phsamples")
+    workflow.connect(inputnode, "thsamples", probtrackx, "thsamples")
+    workflow.connect(inputnode, "ref2diff_mat", probtrackx, "xfm")
+    workflow.connect(inputnode, "diff2ref_mat", probtrackx, "inv_xfm")
+    workflow.connect(masks_2_ref, "out_files", probtrackx, "mask_files")
+    workflow.connect(random_seed, "seeds", probtrackx, "random_seeds")
+
+    for side in SIDES:
+        run_start, run_stop = run_slices[side]
+
+        # NODE 5: Sum tractography and inverted tractography results
         sum_multi_tracks = Node(SumMultiTracks(), name="sumTrack_%s_%s" % (name, side))
         sum_multi_tracks.long_name = side + " %s"
         sum_multi_tracks.inputs.out_file = "r-%s_%s.nii.gz" % (name, side)
-
-        if is_invert:
-            # NODE 12: Merge tractography and inverted tractography fdt_paths
-            merge_paths = Node(Merge(2), name="merge_paths_%s_%s" % (name, side))
-            merge_paths.long_name = side + " Direct and inverse tractography merging"
-            workflow.connect(probtrackx, "fdt_paths", merge_paths, "in1")
-            workflow.connect(probtrackx_inverted, "fdt_paths", merge_paths, "in2")
-
-            # NODE 13: Merge tractography and inverted tractography way_total
-            merge_waytotals = Node(
-                Merge(2), name="merge_waytotals_%s_%s" % (name, side)
-            )
-            merge_waytotals.long_name = side + " Direct and inverse waytotal merging"
-            workflow.connect(probtrackx, "way_total", merge_waytotals, "in1")
-            workflow.connect(probtrackx_inverted, "way_total", merge_waytotals, "in2")
-
-            workflow.connect(merge_paths, "out", sum_multi_tracks, "path_files")
-            workflow.connect(merge_waytotals, "out", sum_multi_tracks, "waytotal_files")
-
-        else:
-            workflow.connect(probtrackx, "fdt_paths", sum_multi_tracks, "path_files")
-            workflow.connect(
-                probtrackx, "way_total", sum_multi_tracks, "waytotal_files"
-            )
+        workflow.connect(
+            probtrackx,
+            ("fdt_paths", get_protocol_runs, run_start, run_stop, len(runs)),
+            sum_multi_tracks,
+            "path_files",
+        )
+        workflow.connect(
+            probtrackx,
+            ("way_total", get_protocol_runs, run_start, run_stop, len(runs)),
+            sum_multi_tracks,
+            "waytotal_files",
+        )
 
         workflow.connect(
             sum_multi_tracks, "out_file", outputnode, "fdt_paths_%s" % side
@@ -147,6 +147,7 @@ subj_tab_old_wf_found = (
     + """. Do you want to resume the previous analysis? If you want to delete all
 previous analyses and start over press NO, otherwise press YES"""
 )
+subj_tab_old_wf_diff = "If resumed, %s."
 subj_tab_old_wf_resume = "Resume execution"
 subj_tab_old_wf_reset = "New execution"
 subj_tab_old_fs_found = "An existing FreeSurfer folder was detected. Do you want to keep or delete the existing folder?"
@@ -452,6 +453,7 @@ node_names = {}
 node_names["CustomDcm2niix"] = "nifti conversion"
 node_names["RobustFOV"] = "neck removal"
 node_names["ForceOrient"] = "standard orientation"
+node_names["FuncPreproc"] = "functional series preparation"
 node_names["BET"] = "scalp removal"
 node_names["SegmentEndocranium"] = "scalp removal"
 node_names["SynthStrip"] = "scalp removal"
@@ -459,9 +461,12 @@ node_names["SynthMorphReg"] = "registration"
 node_names["SynthSeg"] = "SynthSeg cortical parcellation"
 node_names["FLIRT"] = "linear registration"
 node_names["ApplyXFM"] = "linear transformation"
+node_names["BatchApplyXFM"] = "linear transformation"
 node_names["SynthMorphApply"] = "linear transformation"
 node_names["FNIRT"] = "nonlinear registration"
 node_names["ApplyWarp"] = "nonlinear transformation"
+node_names["BatchApplyWarp"] = "nonlinear transformation"
+node_names["PackMasks"] = "masks packing"
 node_names["InvWarp"] = "inverse transformation"
 node_names["DataSink"] = "saving"
 node_names["ApplyMask"] = "masking"
@@ -469,8 +474,10 @@ node_names["EddyCorrect"] = "eddy current correction (old)"
 node_names["CustomEddy"] = "eddy current correction"
 node_names["GenEddyFiles"] = "eddy current correction preparation"
 node_names["BEDPOSTX5"] = "diffusion bayesian estimation"
-node_names["RandomSeedGenerator"] = "random seeds generation"
+node_names["XFibres5"] = "diffusion bayesian estimation"
+node_names["SeedPartition"] = "random seeds generation"
 node_names["CustomProbTrackX2"] = "probabilistic tractography"
+node_names["MultiProbTrackX2"] = "probabilistic tractography"
 node_names["SumMultiTracks"] = "Parallel tractography merging"
 node_names["ReconAll"] = "Recon-all"
 node_names["CustomLabel2Vol"] = "linear transformation"
@@ -486,6 +493,7 @@ node_names["FEATModel"] = "design file generation"
 node_names["FILMGLS"] = "General-Linear-Model estimation"
 node_names["SmoothEstimate"] = "smoothness estimation"
 node_names["Cluster"] = "cluster extraction"
+node_names["MultiThresholdCluster"] = "cluster extraction"
 node_names["SampleToSurface"] = "surface projection"
 node_names["FAST"] = "Tissue segmentation"
 node_names["FLAT1OutliersMask"] = "outliers mask generation"
@@ -495,6 +503,7 @@ node_names["FeatureSpatialPrep"] = "Aroma - Preprocessing"
 node_names["FeatureSpatial"] = "Aroma - Spatial feature"
 node_names["FeatureTimeSeries"] = "Aroma - Time feature"
 node_names["FeatureFrequency"] = "Aroma - Frequency feature"
+node_names["AromaFeatures"] = "Aroma - Features extraction"
 node_names["AromaClassification"] = "Aroma - Noise classification"
 node_names["FilterRegressor"] = "Denoising"
 node_names["FeatureFrequency"] = "Aroma - Frequency feature"
@@ -0,0 +1,70 @@
+"""
+Benchmark of the MainWorkflow generation and indexing for a full-featured subject.
+It is not collected by pytest, run it with FSLDIR set:
+
+    python -m swane.tests.benchmark_workflow [repeats]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+from statistics import median
+from swane.config.ConfigManager import ConfigManager
+from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+from swane.tests.test_5_workflow import full_featured_subject
+
+
+def build_main_workflow(
+    global_config: ConfigManager, subject_config: ConfigManager
+) -> MainWorkflow:
+    input_state_list, dependency_manager = full_featured_subject(
+        global_config, subject_config
+    )
+    return MainWorkflow(
+        name="subj",
+        base_dir=os.path.abspath("subj"),
+        global_config=global_config,
+        subject_config=subject_config,
+        dependency_manager=dependency_manager,
+        subject_input_state_list=input_state_list,
+    )
+
+
+def benchmark(repeats: int = 5) -> dict:
+    """
+    Returns
+    -------
+    The median times in seconds, by measured step.
+    """
+    times = {"creation": [], "first indexing": [], "10 cached indexings": []}
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            os.makedirs("subj")
+            global_config = ConfigManager(global_base_folder=folder)
+            subject_config = ConfigManager(subject_folder="subj")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                main_workflow = build_main_workflow(global_config, subject_config)
+                built = time.perf_counter()
+                main_workflow.get_node_array()
+                main_workflow._get_basic_node_array()
+                indexed = time.perf_counter()
+                for _ in range(10):
+                    main_workflow.get_node_array()
+                    main_workflow._get_basic_node_array()
+                times["creation"].append(built - start)
+                times["first indexing"].append(indexed - built)
+                times["10 cached indexings"].append(time.perf_counter() - indexed)
+        finally:
+            os.chdir(old_cwd)
+    return {step: median(values) for step, values in times.items()}
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for step, seconds in benchmark(repeats).items():
+        print("MainWorkflow %s: %.3f s (median of %d)" % (step, seconds, repeats))
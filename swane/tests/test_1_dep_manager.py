@@ -3,7 +3,11 @@ from swane import strings
 from PySide6.QtCore import QThreadPool
 from swane.config.ConfigManager import ConfigManager
 import shutil
-from swane.utils.DependencyManager import DependencyManager, DependenceStatus
+from swane.utils.DependencyManager import (
+    DependencyManager,
+    DependenceStatus,
+    Dependence,
+)
 import pytest
 from swane.tests import TEST_DIR
 from nipype.interfaces import fsl, dcm2nii, freesurfer
@@ -187,3 +191,43 @@ class TestDependencyManager:
             blocker.args[3] == DependenceStatus.WARNING
         ), "Slicer outdated version error"
         monkeypatch.undo()
+
+    def test_probe_cache(self, monkeypatch):
+        probe_runs = []
+
+        def fake_probe(name):
+            probe_runs.append(name)
+            return Dependence(DependenceStatus.DETECTED, name)
+
+        monkeypatch.setattr(DependencyManager, "_probes", {})
+        monkeypatch.setattr(DependencyManager, "_stored_probes", None)
+        monkeypatch.setattr(
+            DependencyManager,
+            "PROBE_CACHE_FILE",
+            os.path.join(TEST_DIR, "dep", "dependency_probes.json"),
+        )
+        monkeypatch.setattr(DependencyManager, "_run_probe", staticmethod(fake_probe))
+
+        dependency_manager = DependencyManager()
+        assert dependency_manager.is_fsl(), "Probe result not returned"
+        DependencyManager()
+        assert sorted(probe_runs) == sorted(
+            DependencyManager.PROBES
+        ), "Unchanged probes should not run again"
+
+        # A different tool environment invalidates the probe
+        monkeypatch.setenv("FSLDIR", os.path.join(TEST_DIR, "dep"))
+        DependencyManager().fsl
+        assert probe_runs.count("fsl") == 2, "Changed probe should run again"
+        assert probe_runs.count("dcm2niix") == 1, "Unchanged probe should not run"
+
+        # A new process reads the unchanged probes from the cache file
+        monkeypatch.setattr(DependencyManager, "_probes", {})
+        monkeypatch.setattr(DependencyManager, "_stored_probes", None)
+        dependency_manager = DependencyManager()
+        assert (
+            dependency_manager.dcm2niix.label == "dcm2niix"
+        ), "Cached probe result error"
+        assert (
+            len(probe_runs) == len(DependencyManager.PROBES) + 1
+        ), "Cached probes should not run on a new start"
@@ -82,3 +82,36 @@ class TestConfigManager:
         assert (
             global_config.get_main_working_directory() == test_main_working_directory
         ), "Error with existing main working directory"
+
+    def test_global_snapshot(self):
+        global_config = ConfigManager(global_base_folder=os.getcwd())
+        global_config[GlobalPrefCategoryList.MAIN]["default_dicom_folder"] = "snapshot"
+        assert global_config.is_dirty(), "Changed config not marked dirty"
+        assert global_config.save(), "Changed config not saved"
+        assert not global_config.save(), "Unchanged config saved again"
+        global_mtime = os.stat(global_config.config_file).st_mtime_ns
+
+        subject_configs = []
+        for subject in ["subj_1", "subj_2"]:
+            os.makedirs(subject)
+            subject_configs.append(
+                ConfigManager(subject_folder=subject, global_base_folder=os.getcwd())
+            )
+        snapshot = ConfigManager.global_snapshot(os.getcwd())
+        assert snapshot is ConfigManager.global_snapshot(
+            os.getcwd()
+        ), "Global snapshot parsed twice"
+        assert (
+            snapshot[GlobalPrefCategoryList.MAIN]["default_dicom_folder"] == "snapshot"
+        ), "Global snapshot not updated after save"
+        assert (
+            os.stat(global_config.config_file).st_mtime_ns == global_mtime
+        ), "Global config written by subject load"
+        with pytest.raises(TypeError):
+            snapshot[GlobalPrefCategoryList.MAIN]["default_dicom_folder"] = "changed"
+
+        subject_mtime = os.stat(subject_configs[0].config_file).st_mtime_ns
+        subject_configs[0].save()
+        assert (
+            os.stat(subject_configs[0].config_file).st_mtime_ns == subject_mtime
+        ), "Unchanged subject config written"
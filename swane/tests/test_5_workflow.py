@@ -1,4 +1,6 @@
 import os
+import time
+import pickle
 import shutil
 import pytest
 from swane.config.ConfigManager import ConfigManager
@@ -12,9 +14,27 @@ from swane.utils.Subject import Subject, SubjectRet
 from swane.tests import TEST_DIR
 from swane.workers.DicomSearchWorker import DicomSearchWorker
 from swane.utils.DataInputList import DataInputList
-from unittest.mock import ANY
+from unittest.mock import ANY, MagicMock
 from swane.config.preference_list import WF_PREFERENCES
 from swane.nipype_pipeline.engine.WorkflowReport import WorkflowReport, WorkflowSignals
+from swane.nipype_pipeline.engine.CustomWorkflow import CustomWorkflow
+from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
+from swane.nipype_pipeline.engine.ResumeManifest import ResumeManifest
+from swane.nipype_pipeline.engine.TransformRegistry import TransformRegistry
+from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+from swane.nipype_pipeline.WorkflowManifest import WorkflowManifest
+from swane.utils.SubjectInputStateList import SubjectInputStateList, SubjectInputState
+from swane.utils.GraphRenderPool import GraphRenderPool
+import nipype.pipeline.engine.utils as nipype_engine_utils
+from swane.nipype_pipeline.engine.MonitoredMultiProcPlugin import (
+    MonitoredMultiProcPlugin,
+)
+from multiprocessing import Queue
+from nipype import Node, Function, IdentityInterface
+from nipype.interfaces.dcm2nii import Dcm2niix
+from nipype.interfaces.fsl import BET
+import networkx as nx
+from nipype.pipeline.engine.nodes import Node as NipypeNode
 
 
 @pytest.fixture(autouse=True)
@@ -540,3 +560,444 @@ class TestWorkflow:
             and wf_report.signal_type == WorkflowSignals.NODE_ERROR
         ):
             assert False, "Node error during %s" % test_name
+
+
+def diff_test_workflow(base_dir: str, offset: int) -> CustomWorkflow:
+    def add(a, b):
+        return a + b
+
+    main = CustomWorkflow(name="main", base_dir=base_dir)
+    branch = CustomWorkflow(name="branch")
+    first = Node(Function(function=add, output_names=["out"]), name="first")
+    first.inputs.a = 1
+    first.inputs.b = 2
+    second = Node(Function(function=add, output_names=["out"]), name="second")
+    second.inputs.b = offset
+    branch.connect(first, "out", second, "a")
+    other = Node(Function(function=add, output_names=["out"]), name="other")
+    other.inputs.a = 3
+    other.inputs.b = 4
+    last = Node(Function(function=add, output_names=["out"]), name="last")
+    last.inputs.b = 0
+    main.connect(branch, "second.out", last, "a")
+    main.add_nodes([other])
+    return main
+
+
+class TestWorkflowDiff:
+    def test_diff(self):
+        base_dir = os.path.abspath("diff")
+        workflow = diff_test_workflow(base_dir, 10)
+        workflow.run()
+        WorkflowDiff.save(WorkflowDiff.signatures(workflow), base_dir)
+
+        old_signatures = WorkflowDiff.load(base_dir)
+        diff = WorkflowDiff(old_signatures, diff_test_workflow(base_dir, 10))
+        assert diff.is_empty(), "Unchanged workflow should not re-run"
+
+        diff = WorkflowDiff(old_signatures, diff_test_workflow(base_dir, 20))
+        assert diff.changed_nodes == ["main.branch.second"], "Bad changed nodes"
+        assert diff.rerun_nodes == [
+            "main.branch.second",
+            "main.last",
+        ], "Descendants should re-run"
+        assert diff.unknown_cost_nodes == 0, "Previous durations should be known"
+        assert diff.summary() in diff.report(), "Summary missing from report"
+
+        # Directory of an iterables parameterization
+        os.makedirs(os.path.join(base_dir, "main", "_offset_1", "last"))
+        diff.invalidate()
+        assert not os.path.exists(
+            os.path.join(base_dir, "main", "_offset_1", "last")
+        ), "Parameterized node not invalidated"
+        assert not os.path.exists(
+            os.path.join(base_dir, "main", "branch", "second")
+        ), "Changed node not invalidated"
+        assert not os.path.exists(
+            os.path.join(base_dir, "main", "last")
+        ), "Descendant node not invalidated"
+        assert os.path.exists(
+            os.path.join(base_dir, "main", "branch", "first", "result_first.pklz")
+        ), "Unaffected node invalidated"
+        assert os.path.exists(
+            os.path.join(base_dir, "main", "other", "result_other.pklz")
+        ), "Unaffected node invalidated"
+
+        # Nodes never executed must not wait for their result files
+        start = time.perf_counter()
+        diff = WorkflowDiff(
+            old_signatures, diff_test_workflow(os.path.abspath("never_run"), 20)
+        )
+        assert diff.unknown_cost_nodes == len(diff.rerun_nodes), "Bad unknown cost"
+        assert time.perf_counter() - start < 5, "Missing result files awaited"
+
+    def test_input_files(self):
+        in_dir = os.path.abspath("input_series")
+        os.makedirs(in_dir)
+        in_file = os.path.join(in_dir, "series.txt")
+        with open(in_file, "w") as file:
+            file.write("1\n")
+
+        def signatures(value) -> dict:
+            workflow = CustomWorkflow(name="files", base_dir=os.path.abspath("files"))
+            if os.path.isdir(value):
+                node = Node(Dcm2niix(), name="conversion")
+                node.inputs.source_dir = value
+            else:
+                node = Node(BET(), name="bet")
+                node.inputs.in_file = value
+            workflow.add_nodes([node])
+            return WorkflowDiff.signatures(workflow)
+
+        for value in [in_file, in_dir]:
+            old_signatures = signatures(value)
+            stat = os.stat(in_file)
+            with open(in_file, "a") as file:
+                file.write("2\n")
+            os.utime(in_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            assert old_signatures != signatures(
+                value
+            ), "Input changed on disk at the same path not detected"
+
+
+class TestResumeManifest:
+    @staticmethod
+    def run_with_manifest(workflow: CustomWorkflow, manifest_file: str, strict: bool):
+        plugin = MonitoredMultiProcPlugin(
+            plugin_args={
+                "queue": Queue(),
+                "resume_manifest": manifest_file,
+                "resume_strict": strict,
+                "n_procs": 1,
+                "memory_gb": 1,
+            }
+        )
+        try:
+            workflow.run(plugin=plugin)
+        finally:
+            plugin.close_manifest()
+
+    def test_resume(self, monkeypatch):
+        base_dir = os.path.abspath("resume")
+        manifest_file = os.path.join(base_dir, ResumeManifest.FILE_NAME)
+        self.run_with_manifest(diff_test_workflow(base_dir, 10), manifest_file, False)
+
+        hash_checks = []
+        original_is_cached = NipypeNode.is_cached
+
+        def counted_is_cached(node, *args, **kwargs):
+            hash_checks.append(node.fullname)
+            return original_is_cached(node, *args, **kwargs)
+
+        monkeypatch.setattr(NipypeNode, "is_cached", counted_is_cached)
+        self.run_with_manifest(diff_test_workflow(base_dir, 10), manifest_file, False)
+        assert hash_checks == [], "Recorded nodes should skip the hash check"
+
+        # Changed node and its descendants fall back to nipype
+        self.run_with_manifest(diff_test_workflow(base_dir, 20), manifest_file, False)
+        assert "main.branch.second" in hash_checks, "Changed node not checked"
+        assert "main.last" in hash_checks, "Descendant node not checked"
+        assert "main.other" not in hash_checks, "Unchanged node checked"
+
+        # Strict mode accepts touched files with the same content only
+        hash_checks.clear()
+        first_result = os.path.join(
+            base_dir, "main", "branch", "first", "result_first.pklz"
+        )
+        os.utime(first_result, ns=(0, 0))
+        self.run_with_manifest(diff_test_workflow(base_dir, 20), manifest_file, True)
+        assert hash_checks == [], "Touched file with same content should be accepted"
+
+        other_result = os.path.join(base_dir, "main", "other", "_report", "report.rst")
+        with open(other_result, "a") as file:
+            file.write("changed")
+        self.run_with_manifest(diff_test_workflow(base_dir, 20), manifest_file, True)
+        assert hash_checks == ["main.other"], "Changed file should be checked"
+
+
+class TestTransformRegistry:
+    def test_registry(self):
+        main = CustomWorkflow(name="main", base_dir=os.path.abspath("registry"))
+        source = Node(
+            IdentityInterface(fields=["reference", "reference_brain"]), name="source"
+        )
+        consumer = Node(
+            IdentityInterface(fields=["to_mni", "from_mni", "from_mni_2", "synth"]),
+            name="consumer",
+        )
+        main.add_nodes([source, consumer])
+
+        registry = TransformRegistry(main)
+        registry.add_space(
+            "ref",
+            [source, "reference_brain"],
+            "Reference",
+            head_source=[source, "reference"],
+        )
+        registry.add_space(
+            "mni1", "mni_1mm.nii.gz", "MNI", "mni", 1, head_source="mni_head.nii.gz"
+        )
+        registry.add_space("mni2", "mni_2mm.nii.gz", "MNI", "mni", 2)
+
+        ref_2_mni2 = registry.request("ref", "mni2", use_synth=False)
+        ref_2_mni2.connect_forward(consumer, "to_mni")
+        mni1_2_ref = registry.request("mni1", "ref", use_synth=False)
+        mni1_2_ref.connect_forward(consumer, "from_mni")
+        ref_2_mni1 = registry.request("ref", "mni1", use_synth=False)
+        ref_2_mni1.connect_inverse(consumer, "from_mni_2")
+        synth_request = registry.request("ref", "mni1", use_synth=True)
+        synth_request.connect_forward(consumer, "synth")
+        registry.request("ref", "mni2", use_synth=False)
+        registry.build()
+
+        assert len(registry.registrations) == 2, "Same pair registered more than once"
+        assert registry.redundant_registrations() == 2, "Bad redundant count"
+        registration = registry.get_registration(ref_2_mni2.key)
+        assert (
+            registration.get_node("inputnode").inputs.atlas == "mni_1mm.nii.gz"
+        ), "Registration should use the finest template resolution"
+        assert (
+            registry.get_registration(synth_request.key) is not registration
+        ), "SynthMorph and FSL registrations should not be shared"
+
+        # Linear step on brains, nonlinear step on heads
+        inputnode = registration.get_node("inputnode")
+        assert inputnode.inputs.atlas_head == "mni_head.nii.gz", "Bad atlas head"
+        links = {
+            (node.name, dest): source_output
+            for _, node, data in registration._graph.out_edges(inputnode, data=True)
+            for source_output, dest in data["connect"]
+        }
+        assert links[(registration.name + "_flirt", "in_file")] == "in_file"
+        assert links[(registration.name + "_flirt", "reference")] == "atlas"
+        assert links[(registration.name + "_fnirt", "in_file")] == "in_file_head"
+        assert links[(registration.name + "_fnirt", "ref_file")] == "atlas_head"
+        assert ("reference", "inputnode.in_file_head") in [
+            connection
+            for _, _, data in main._graph.in_edges(registration, data=True)
+            for connection in data["connect"]
+        ], "Reference head not connected"
+
+        fields = {
+            dest: source_output
+            for _, _, data in main._graph.in_edges(consumer, data=True)
+            for source_output, dest in data["connect"]
+        }
+        assert fields["to_mni"] == TransformRegistry.FORWARD_FIELD, "Bad forward warp"
+        assert fields["from_mni"] == TransformRegistry.INVERSE_FIELD, "Bad inverse warp"
+        assert (
+            fields["from_mni_2"] == TransformRegistry.INVERSE_FIELD
+        ), "Bad inverse warp"
+
+
+def full_featured_subject(global_config: ConfigManager, subject_config: ConfigManager):
+    """
+    Loads every input of the "subj" folder and enables the optional analyses.
+
+    Returns
+    -------
+    The SubjectInputStateList and a DependencyManager mock without FreeSurfer and Slicer.
+    """
+    input_state_list = SubjectInputStateList(os.path.abspath("subj"), global_config)
+    input_state_list[DataInputList.FMRI_RS] = SubjectInputState()
+    for data_input in input_state_list:
+        os.makedirs(input_state_list.get_dicom_dir(data_input), exist_ok=True)
+        input_state_list[data_input].loaded = True
+    for data_input, option in [
+        (DataInputList.T13D, "flat1"),
+        (DataInputList.PET, "ai"),
+        (DataInputList.ASL, "ai"),
+        (DataInputList.FMRI_RS, "aroma"),
+    ]:
+        subject_config[data_input][option] = "true"
+    dependency_manager = MagicMock()
+    dependency_manager.is_freesurfer.return_value = False
+    dependency_manager.is_slicer.return_value = False
+    return input_state_list, dependency_manager
+
+
+class TestPreferenceSnapshot:
+    def test_snapshot(self):
+        global_config = ConfigManager(global_base_folder=os.getcwd())
+        os.makedirs("subj")
+        subject_config = ConfigManager(subject_folder="subj")
+        subject_config[DataInputList.FMRI_0]["block_design"] = BlockDesign.RARB.name
+        # Invalid values bypassing validation fall back to the default
+        subject_config.read_dict({str(DataInputList.DTI): {"tractography": "maybe"}})
+
+        snapshot = subject_config.snapshot()
+        assert (
+            snapshot[DataInputList.FMRI_0].block_design == BlockDesign.RARB
+        ), "Enum preference not typed"
+        assert snapshot[
+            DataInputList.DTI
+        ].tractography == subject_config.getboolean_safe(
+            DataInputList.DTI, "tractography"
+        ), "Invalid preference should fall back to default"
+        assert type(snapshot[DataInputList.T13D].bet_thr) is float, "Float not typed"
+        assert snapshot[DataInputList.T13D].getfloat_safe(
+            "bet_thr"
+        ) == subject_config.getfloat_safe(
+            DataInputList.T13D, "bet_thr"
+        ), "Snapshot getter differs from ConfigManager"
+        with pytest.raises(TypeError):
+            snapshot[DataInputList.T13D].bet_thr = 0.5
+
+        # Full-featured subject, workflow creation must not parse preferences
+        input_state_list, dependency_manager = full_featured_subject(
+            global_config, subject_config
+        )
+
+        getter_calls = []
+        for config in (global_config, subject_config):
+            for getter in ["getboolean_safe", "getint_safe", "getfloat_safe"]:
+                original = getattr(config, getter)
+                setattr(
+                    config,
+                    getter,
+                    lambda *args, _original=original, **kwargs: (
+                        getter_calls.append(args) or _original(*args, **kwargs)
+                    ),
+                )
+
+        main_workflow = MainWorkflow(
+            name="subj",
+            base_dir=os.path.abspath("subj"),
+            global_config=global_config,
+            subject_config=subject_config,
+            dependency_manager=dependency_manager,
+            subject_input_state_list=input_state_list,
+        )
+
+        assert main_workflow.is_flat1, "Preference not read from snapshot"
+        assert getter_calls == [], "Preferences parsed during workflow creation"
+
+
+class TestGraphRenderPool:
+    def test_render_cache(self, monkeypatch):
+        drawn = []
+
+        def fake_format_dot(dot_file, format="png"):
+            drawn.append(dot_file)
+            graph_file = os.path.splitext(dot_file)[0] + "." + format
+            with open(graph_file, "w") as file:
+                file.write("<svg/>")
+            return graph_file
+
+        monkeypatch.setattr(nipype_engine_utils, "format_dot", fake_format_dot)
+        graph_file = os.path.abspath("graph_main.svg")
+        workflow = diff_test_workflow(os.path.abspath("graph"), 0)
+
+        assert GraphRenderPool.submit(workflow, graph_file).result(), "Graph not drawn"
+        assert os.path.exists(graph_file), "Graph file missing"
+        assert not GraphRenderPool.submit(
+            diff_test_workflow(os.path.abspath("graph"), 5), graph_file
+        ).result(), "Unchanged graph drawn again"
+
+        workflow.add_nodes([Node(IdentityInterface(fields=["a"]), name="added")])
+        assert GraphRenderPool.submit(
+            workflow, graph_file
+        ).result(), "Changed graph not drawn"
+        assert len(drawn) == 2, "Bad number of drawings"
+
+
+class TestWorkflowIndexes:
+    def test_indexes(self, monkeypatch):
+        global_config = ConfigManager(global_base_folder=os.getcwd())
+        os.makedirs("subj")
+        subject_config = ConfigManager(subject_folder="subj")
+        input_state_list, dependency_manager = full_featured_subject(
+            global_config, subject_config
+        )
+
+        main_workflow = MainWorkflow(
+            name="subj",
+            base_dir=os.path.abspath("subj"),
+            global_config=global_config,
+            subject_config=subject_config,
+            dependency_manager=dependency_manager,
+            subject_input_state_list=input_state_list,
+        )
+        node_list = main_workflow.get_node_array()
+        basic_nodes = main_workflow._get_basic_node_array()
+
+        sorts = []
+        original_sort = nx.topological_sort
+        monkeypatch.setattr(
+            nx,
+            "topological_sort",
+            lambda graph: sorts.append(graph) or original_sort(graph),
+        )
+        for _ in range(10):
+            assert main_workflow.get_node_array().keys() == node_list.keys()
+            assert main_workflow._get_basic_node_array() == basic_nodes
+        assert sorts == [], "Unchanged workflow sorted again"
+
+        # Structural changes invalidate the caches of the containing workflows
+        sub_workflow = main_workflow.get_node(next(iter(node_list)))
+
+        def count(items):
+            return len(items)
+
+        sub_workflow.add_nodes([Node(Function(function=count), name="added")])
+        assert len(main_workflow._get_basic_node_array()) == len(basic_nodes) + 1
+        assert "added" in main_workflow.get_node_array()[sub_workflow.name].node_list
+
+
+class TestWorkflowManifest:
+    def test_manifest(self):
+        global_config = ConfigManager(global_base_folder=os.getcwd())
+        os.makedirs("subj")
+        subject_config = ConfigManager(subject_folder="subj")
+        input_state_list, dependency_manager = full_featured_subject(
+            global_config, subject_config
+        )
+        dependency_manager.is_freesurfer_matlab.return_value = False
+        main_workflow = MainWorkflow(
+            name="subj",
+            base_dir=os.path.abspath("subj"),
+            global_config=global_config,
+            subject_config=subject_config,
+            dependency_manager=dependency_manager,
+            subject_input_state_list=input_state_list,
+        )
+        manifest = WorkflowManifest.create(
+            main_workflow,
+            global_config,
+            subject_config,
+            dependency_manager,
+            input_state_list,
+        )
+        manifest.nodes = WorkflowDiff.signatures(main_workflow)
+        manifest.save(os.path.abspath("subj"))
+        saved = WorkflowManifest.load(os.path.abspath("subj"))
+        assert saved.to_json() == manifest.to_json(), "Manifest changed on disk"
+
+        handoff = manifest.handoff_json()
+        assert len(handoff) * 10 < len(
+            pickle.dumps(main_workflow)
+        ), "Handoff not compact"
+        rebuilt = WorkflowManifest.from_json(handoff).build_workflow()
+        assert rebuilt.is_flat1 and rebuilt.max_cpu == main_workflow.max_cpu
+        assert manifest.matches(rebuilt), "Rebuilt workflow differs"
+        assert WorkflowDiff(
+            saved.nodes, rebuilt
+        ).is_empty(), "Rebuilt workflow signatures differ"
+        assert not os.path.exists(
+            os.path.join("subj", ".config.tmp")
+        ), "Rebuilt configuration saved"
+
+        # Saved signatures are usable to diff runs
+        subject_config[DataInputList.T13D]["bet_thr"] = "0.2"
+        changed = MainWorkflow(
+            name="subj",
+            base_dir=os.path.abspath("subj"),
+            global_config=global_config,
+            subject_config=subject_config,
+            dependency_manager=dependency_manager,
+            subject_input_state_list=input_state_list,
+        )
+        assert manifest.matches(changed), "Same nodes expected"
+        assert not WorkflowDiff(
+            saved.nodes, changed
+        ).is_empty(), "Changed workflow not detected"
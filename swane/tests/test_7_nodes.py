@@ -0,0 +1,1037 @@
+import os
+import shlex
+import shutil
+import time
+import pytest
+import numpy as np
+import nibabel as nib
+import SimpleITK as sitk
+from swane.tests import TEST_DIR
+from swane.nipype_pipeline.nodes.ZIntNorm import ZIntNorm
+from swane.nipype_pipeline.nodes.N4BiasFieldCorrection import N4BiasFieldCorrection
+from swane.nipype_pipeline.nodes.TTest import TTest
+from swane.nipype_pipeline.nodes.ThrROI import ThrROI
+from swane.nipype_pipeline.nodes.BatchApplyWarp import BatchApplyWarp
+from swane.nipype_pipeline.nodes.BedpostxSplit import BedpostxSplit
+from swane.nipype_pipeline.nodes.BedpostxMerge import BedpostxMerge
+from swane.nipype_pipeline.nodes.MultiProbTrackX2 import MultiProbTrackX2
+from swane.nipype_pipeline.nodes.SeedPartition import SeedPartition
+from swane.nipype_pipeline.nodes.PackMasks import PackMasks
+from swane.nipype_pipeline.nodes.MultiThresholdCluster import MultiThresholdCluster
+from swane.nipype_pipeline.nodes.BatchApplyXFM import BatchApplyXFM
+from swane.nipype_pipeline.nodes.AromaFeatures import AromaFeatures
+from swane.nipype_pipeline.nodes.FuncPreproc import FuncPreproc
+from swane.nipype_pipeline.nodes.SynthStrip import SynthStrip
+from swane.nipype_pipeline.engine.SynthModelServer import (
+    SynthModelServer,
+    ResidentModelBackend,
+    SynthSegTool,
+    SynthTool,
+)
+from swane.nipype_pipeline.nodes.utils import (
+    apply_registration_node,
+    get_protocol_runs,
+)
+from threading import Thread
+from scipy.stats import ttest_ind_from_stats
+from nipype import Workflow, Node, Function, IdentityInterface
+from nipype.interfaces.base import CommandLine
+from nipype.interfaces.fsl import ConvertWarp
+from swane.nipype_pipeline.nodes.ram_estimators import (
+    AromaFeaturesRamEstimator,
+    MultiProbTrackX2RamEstimator,
+)
+from ica_aroma_py.services import ICA_AROMA_functions as AromaFunc
+
+
+@pytest.fixture(autouse=True)
+def change_test_dir(request):
+    test_dir = os.path.join(TEST_DIR, "nodes")
+    shutil.rmtree(test_dir, ignore_errors=True)
+    os.makedirs(test_dir, exist_ok=True)
+    os.chdir(test_dir)
+
+
+def save_test_image(data: np.ndarray, file_name: str) -> str:
+    affine = np.diag([0.5, 0.5, 0.5, 1])
+    nib.save(nib.Nifti1Image(data, affine), file_name)
+    return os.path.abspath(file_name)
+
+
+class TestNodes:
+    def test_zintnorm(self):
+        rng = np.random.default_rng(0)
+        data = rng.normal(100, 20, (20, 18, 37)).astype(np.float32)
+        data[:, :, :5] = 0
+        mask = np.zeros(data.shape, dtype=np.uint8)
+        mask[2:15, 3:12, 4:30] = 1
+        in_file = save_test_image(data, "t1.nii.gz")
+        mask_file = save_test_image(mask, "mask.nii.gz")
+
+        # Masked normalization, slab size not multiple of the z dimension
+        zintnorm = ZIntNorm(in_file=in_file, mask_file=mask_file, slab_size=4)
+        result = zintnorm.run()
+        out = nib.load(result.outputs.out_file)
+        vals = data[mask > 0].astype(np.float64)
+        expected = (data - vals.mean()) / vals.std()
+        assert out.get_data_dtype() == np.float32, "Bad output datatype"
+        assert np.allclose(out.affine, np.diag([0.5, 0.5, 0.5, 1])), "Bad output affine"
+        assert np.allclose(out.get_fdata(), expected, atol=1e-4), "Bad masked values"
+        assert result.outputs.peak_mem_gb > 0, "Peak memory not reported"
+
+        # Unmasked normalization of a 4D image
+        data_4d = np.stack([data, data * 2], axis=3)
+        in_file_4d = save_test_image(data_4d, "func.nii")
+        zintnorm = ZIntNorm(in_file=in_file_4d, out_file="func_norm.nii.gz")
+        out = nib.load(zintnorm.run().outputs.out_file)
+        vals = data_4d[data_4d > 0].astype(np.float64)
+        expected = (data_4d - vals.mean()) / vals.std()
+        assert np.allclose(out.get_fdata(), expected, atol=1e-4), "Bad 4D values"
+
+        # Compressed input and mask are loaded once, uncompressed ones are memory-mapped
+        assert result.outputs.peak_mem_gb == pytest.approx(
+            ZIntNorm.slab_mem_gb(data.shape, 4) + (data.nbytes + mask.nbytes) / 1024**3
+        ), "Compressed inputs not loaded"
+        zintnorm = ZIntNorm(in_file=save_test_image(data, "t1.nii"), slab_size=4)
+        assert zintnorm.run().outputs.peak_mem_gb == pytest.approx(
+            ZIntNorm.slab_mem_gb(data.shape, 4)
+        ), "Uncompressed input not memory-mapped"
+
+        # Constant image must fail
+        const_file = save_test_image(np.ones((4, 4, 4), dtype=np.float32), "c.nii")
+        with pytest.raises(RuntimeError):
+            ZIntNorm(in_file=const_file).run()
+
+    def test_n4(self):
+        # Two tissue phantom with a smooth multiplicative bias field
+        x, y, z = np.meshgrid(
+            np.linspace(-1, 1, 40),
+            np.linspace(-1, 1, 40),
+            np.linspace(-1, 1, 32),
+            indexing="ij",
+        )
+        mask = (x**2 + y**2 + z**2) < 0.8
+        tissue = np.where((x**2 + y**2 + z**2) < 0.3, 100.0, 60.0) * mask
+        bias = np.exp(0.4 * x + 0.2 * y * z)
+        rng = np.random.default_rng(0)
+        data = (tissue * bias + rng.normal(0, 1, tissue.shape) * mask).astype(
+            np.float32
+        )
+        in_file = save_test_image(data, "biased.nii.gz")
+        mask_file = save_test_image(mask.astype(np.uint8), "mask.nii.gz")
+
+        def cv(volume: np.ndarray) -> float:
+            # Mean coefficient of variation inside the two tissues
+            inner = (x**2 + y**2 + z**2) < 0.3
+            values = []
+            for tissue_mask in (inner & mask, ~inner & mask):
+                values.append(volume[tissue_mask].std() / volume[tissue_mask].mean())
+            return float(np.mean(values))
+
+        # Quality of full resolution and downsampled fits
+        global_threads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+        benchmark = {}
+        for shrink_factor in (1, 4):
+            n4 = N4BiasFieldCorrection(
+                in_file=in_file,
+                mask_file=mask_file,
+                shrink_factor=shrink_factor,
+                preset="fast",
+                num_threads=2,
+                out_file="unbiased_%d.nii.gz" % shrink_factor,
+            )
+            result = n4.run()
+            benchmark[shrink_factor] = cv(nib.load(result.outputs.out_file).get_fdata())
+
+        assert (
+            sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == global_threads
+        ), "N4 changed the process-wide thread number"
+        assert benchmark[1] < cv(data), "Full resolution N4 did not reduce bias"
+        assert benchmark[4] < cv(data), "Downsampled N4 did not reduce bias"
+        assert (
+            benchmark[4] < benchmark[1] * 1.25
+        ), "Downsampled N4 quality too far from full resolution"
+        assert (
+            N4BiasFieldCorrection(num_threads=3).inputs.num_threads == 3
+        ), "Bad thread number"
+
+    def test_ttest(self):
+        # ImageStats "-M -S -V" output: mean, std, voxels, volume
+        stats_lh = [[10, 2, 100, 100], [5, 0, 10, 10], [3, 1, 50, 50], [7, 1, 80, 80]]
+        stats_rh = [[11, 2, 100, 100], [5, 0, 10, 10], [3.2, 1, 50, 50], [9, 2, 90, 90]]
+
+        result = TTest(stats_lh=stats_lh, stats_rh=stats_rh).run()
+        for label in range(len(stats_lh)):
+            if label == 1:
+                # Constant regions give undefined statistics
+                assert result.outputs.stat_t[label] == 0, "Bad undefined T"
+                assert result.outputs.stat_p[label] == 0, "Bad undefined P"
+                continue
+            t, p = ttest_ind_from_stats(*stats_lh[label][:3], *stats_rh[label][:3])
+            assert result.outputs.stat_t[label] == pytest.approx(t), "Bad T value"
+            assert result.outputs.stat_p[label] == pytest.approx(p), "Bad P value"
+
+        uncorrected = np.array(result.outputs.stat_p)[[0, 2, 3]]
+        result = TTest(
+            stats_lh=stats_lh, stats_rh=stats_rh, correction="bonferroni"
+        ).run()
+        assert np.allclose(
+            np.array(result.outputs.stat_p)[[0, 2, 3]], np.minimum(uncorrected * 3, 1)
+        ), "Bad Bonferroni correction"
+
+        result = TTest(stats_lh=stats_lh, stats_rh=stats_rh, correction="fdr").run()
+        corrected = np.array(result.outputs.stat_p)[[0, 2, 3]]
+        assert np.all(corrected >= uncorrected), "FDR P values lower than uncorrected"
+        assert corrected[np.argmax(uncorrected)] == pytest.approx(
+            uncorrected.max()
+        ), "Bad FDR correction of the highest P value"
+
+    def test_thrroi(self):
+        seg = np.zeros((10, 10, 10), dtype=np.int16)
+        seg[1:3] = 11
+        seg[3:5] = 13
+        seg[5:7] = 50
+        seg[7:9] = 2
+        seg_file = save_test_image(seg, "seg.nii.gz")
+
+        # Single range, compact output
+        out = nib.load(
+            ThrROI(in_file=seg_file, seg_val_min=11, seg_val_max=13)
+            .run()
+            .outputs.out_file
+        )
+        assert out.get_data_dtype() == np.uint8, "Bad output datatype"
+        assert np.array_equal(
+            out.get_fdata(), ((seg >= 11) & (seg <= 13)).astype(float)
+        ), "Bad single ROI"
+
+        # Multiple ranges from one node
+        result = ThrROI(
+            in_file=seg_file,
+            seg_val_ranges=[(11, 11), (50, 52), (2, 2)],
+            out_files=["a.nii.gz", "b.nii.gz", "c.nii.gz"],
+        ).run()
+        assert len(result.outputs.out_files) == 3, "Bad output number"
+        for out_file, label in zip(result.outputs.out_files, (11, 50, 2)):
+            assert np.array_equal(
+                nib.load(out_file).get_fdata(), (seg == label).astype(float)
+            ), "Bad multiple ROI"
+
+        # Union of multiple ranges, float output
+        out = nib.load(
+            ThrROI(
+                in_file=seg_file,
+                seg_val_ranges=[(11, 13), (50, 52)],
+                combine=True,
+                out_datatype="float32",
+                out_file="union.nii.gz",
+            )
+            .run()
+            .outputs.out_file
+        )
+        assert out.get_data_dtype() == np.float32, "Bad float output datatype"
+        assert np.array_equal(
+            out.get_fdata(), np.isin(seg, [11, 13, 50]).astype(float)
+        ), "Bad combined ROI"
+
+    def test_batch_apply_warp(self):
+        shape = (12, 10, 8)
+        labels = np.zeros(shape, dtype=np.float32)
+        labels[2:5, 3:6, 1:4] = 1
+        labels_2 = np.zeros(shape, dtype=np.float32)
+        labels_2[7:10, 1:3, 4:7] = 1
+        in_files = [
+            save_test_image(labels, "seed.nii.gz"),
+            save_test_image(labels_2, "target.nii.gz"),
+        ]
+
+        # FSL absolute warp shifting the reference of 1 voxel along y
+        i, j, k = np.meshgrid(*[np.arange(n) for n in shape], indexing="ij")
+        abs_warp = np.stack(
+            [(shape[0] - 1 - i) * 0.5, (j + 1) * 0.5, k * 0.5], axis=3
+        ).astype(np.float32)
+        abs_warp_file = save_test_image(abs_warp, "abs_warp.nii.gz")
+
+        out_files = [os.path.abspath("seed_warped.nii.gz"), "target_warped.nii.gz"]
+        BatchApplyWarp.resample_labels(nib.load(abs_warp_file), in_files, out_files)
+
+        for out_file, in_labels in zip(out_files, (labels, labels_2)):
+            out = nib.load(out_file)
+            expected = np.zeros(shape)
+            expected[:, :-1] = in_labels[:, 1:]
+            assert out.shape == shape, "Bad output shape"
+            assert out.get_data_dtype() == np.uint8, "Bad output datatype"
+            assert np.array_equal(out.get_fdata(), expected), "Bad warped labels"
+
+    def test_batch_apply_warp_fsl(self, monkeypatch):
+        shape = (12, 10, 8)
+        labels = np.zeros(shape, dtype=np.float32)
+        labels[2:5, 3:6, 1:4] = 1
+        labels_2 = np.zeros(shape, dtype=np.float32)
+        labels_2[7:10, 1:3, 4:7] = 1
+        in_files = [
+            save_test_image(labels, "seed.nii.gz"),
+            save_test_image(labels_2, "target.nii.gz"),
+        ]
+        ref_file = save_test_image(np.zeros(shape, dtype=np.float32), "ref.nii.gz")
+        warp_file = save_test_image(
+            np.zeros(shape + (3,), dtype=np.float32), "coef.nii.gz"
+        )
+
+        # convertwarp writes the absolute field shifting the reference of 1 voxel along y
+        i, j, k = np.meshgrid(*[np.arange(n) for n in shape], indexing="ij")
+        abs_warp = np.stack(
+            [(shape[0] - 1 - i) * 0.5, (j + 1) * 0.5, k * 0.5], axis=3
+        ).astype(np.float32)
+        conversions = []
+
+        def convert_warp_run(self, **kwargs):
+            conversions.append(self.inputs)
+            save_test_image(abs_warp, self.inputs.out_file)
+
+        monkeypatch.setattr(ConvertWarp, "run", convert_warp_run)
+        outputs = (
+            BatchApplyWarp(in_files=in_files, warp_file=warp_file, ref_file=ref_file)
+            .run()
+            .outputs
+        )
+
+        assert len(conversions) == 1, "Warp coefficients not converted once"
+        assert conversions[0].out_abswarp, "Converted warp is not absolute"
+        assert conversions[0].warp1 == warp_file, "Bad converted warp"
+        assert conversions[0].reference == ref_file, "Bad conversion reference"
+        for out_file, in_labels in zip(outputs.out_files, (labels, labels_2)):
+            out = nib.load(out_file)
+            expected = np.zeros(shape)
+            expected[:, :-1] = in_labels[:, 1:]
+            assert out.get_data_dtype() == np.uint8, "Bad output datatype"
+            assert np.array_equal(out.get_fdata(), expected), "Bad warped labels"
+
+    def test_batch_apply_warp_synth(self, monkeypatch):
+        shape = (6, 5, 4)
+        os.makedirs("synth masks")
+        labels = [np.zeros(shape, dtype=np.float32) for _ in range(2)]
+        labels[0][1:3, 1:3, 1:3] = 1
+        labels[1][3:5, 2:4, 0:2] = 2
+        in_files = [
+            save_test_image(label, os.path.join("synth masks", "mask %d.nii.gz" % i))
+            for i, label in enumerate(labels)
+        ]
+        warp_file = save_test_image(
+            np.zeros(shape + (3,), dtype=np.float32), "synth warp.nii.gz"
+        )
+        commands = []
+
+        def synth_apply_run(self, **kwargs):
+            # Identity warp: copies every input on its output
+            args = shlex.split(self.cmdline)
+            commands.append(args)
+            paths = args[args.index("uint8") + 2 :]
+            for in_file, out_file in zip(paths[::2], paths[1::2]):
+                nib.save(nib.load(in_file), out_file)
+
+        monkeypatch.setattr(CommandLine, "run", synth_apply_run)
+        outputs = (
+            BatchApplyWarp(
+                in_files=in_files,
+                warp_file=warp_file,
+                ref_file=warp_file,
+                use_synth=True,
+                out_files=["out 0.nii.gz", "out 1.nii.gz"],
+            )
+            .run()
+            .outputs
+        )
+
+        assert len(commands) == 1, "Warp not applied with a single command"
+        assert commands[0][:6] == [
+            "mri_synthmorph",
+            "apply",
+            "-m",
+            "nearest",
+            "-t",
+            "uint8",
+        ], "Bad mri_synthmorph options"
+        assert commands[0][6] == warp_file, "Unquoted warp path"
+        assert commands[0][7::2] == in_files, "Unquoted input paths"
+        assert commands[0][8::2] == outputs.out_files, "Unquoted output paths"
+        for out_file, label in zip(outputs.out_files, labels):
+            assert np.array_equal(nib.load(out_file).get_fdata(), label), "Bad output"
+
+    def test_bedpostx_split_merge(self):
+        rng = np.random.default_rng(0)
+        dwi = rng.random((8, 9, 11, 5)).astype(np.float32)
+        mask = np.zeros((8, 9, 11), dtype=np.uint8)
+        mask[2:6, 2:7, 2:9] = 1
+        mask[3, 3, 5] = 0
+        dwi_file = save_test_image(dwi, "dwi.nii.gz")
+        mask_file = save_test_image(mask, "mask.nii.gz")
+
+        split = BedpostxSplit(dwi=dwi_file, mask=mask_file, slices_per_chunk=3).run()
+        assert split.outputs.chunk_slices == [[2, 5], [5, 8], [8, 9]], "Bad chunks"
+        dwi_nii = nib.load(dwi_file)
+        for dwi_chunk, (z0, z1) in zip(
+            split.outputs.dwi_chunks, split.outputs.chunk_slices
+        ):
+            chunk_nii = nib.load(dwi_chunk)
+            assert np.allclose(
+                chunk_nii.affine, dwi_nii.slicer[:, :, z0:z1].affine
+            ), "Bad chunk affine"
+            assert np.array_equal(
+                chunk_nii.get_fdata(), dwi[:, :, z0:z1]
+            ), "Bad chunk data"
+
+        # Use the masked dwi chunks as fake xfibres samples of two fibres
+        fsamples = []
+        for index, (dwi_chunk, mask_chunk) in enumerate(
+            zip(split.outputs.dwi_chunks, split.outputs.mask_chunks)
+        ):
+            chunk_nii = nib.load(dwi_chunk)
+            samples = (
+                chunk_nii.get_fdata()
+                * nib.load(mask_chunk).get_fdata()[..., np.newaxis]
+            )
+            samples_file = "samples_%d.nii.gz" % index
+            nib.save(nib.Nifti1Image(samples, chunk_nii.affine), samples_file)
+            fsamples.append([os.path.abspath(samples_file)] * 2)
+
+        merge = BedpostxMerge(
+            mask=mask_file,
+            chunk_slices=split.outputs.chunk_slices,
+            fsamples=fsamples,
+            phsamples=fsamples,
+            thsamples=fsamples,
+        ).run()
+        assert len(merge.outputs.merged_fsamples) == 2, "Bad fibre number"
+        merged = nib.load(merge.outputs.merged_thsamples[1])
+        assert np.allclose(merged.affine, nib.load(dwi_file).affine), "Bad affine"
+        assert np.allclose(
+            merged.get_fdata(), dwi * mask[..., np.newaxis]
+        ), "Bad merged samples"
+
+    def test_multi_probtrackx(self, monkeypatch):
+        monkeypatch.setenv("FSLOUTPUTTYPE", "NIFTI_GZ")
+        volume = np.ones((4, 4, 4), dtype=np.float32)
+        samples = [save_test_image(volume, "sample_%d.nii.gz" % i) for i in range(3)]
+        masks = [save_test_image(volume, "mask_%d.nii.gz" % i) for i in range(4)]
+
+        probtrackx = MultiProbTrackX2(
+            fsamples=samples[0],
+            phsamples=samples[1],
+            thsamples=samples[2],
+            mask=masks[0],
+            mask_files=masks,
+            protocols=[
+                {"seed": [0], "waypoints": [1, 2], "avoid": 3, "stop": None},
+                {"seed": [1, 2], "waypoints": [0], "avoid": 3, "stop": None},
+            ],
+            random_seeds=[11, 22],
+        )
+        stage_dir, samples_base_name = probtrackx._stage_samples()
+        assert stage_dir is None, "Samples copied in shared memory by default"
+        try:
+            for sample_type in ["f", "ph", "th"]:
+                assert os.path.exists(
+                    "%s_%s1samples.nii.gz" % (samples_base_name, sample_type)
+                ), "Missing staged samples"
+
+            os.makedirs("protocol1/seed1")
+            probtrackx._write_mask_lists(
+                probtrackx.inputs.protocols[1], os.path.abspath("protocol1")
+            )
+            cmdline = probtrackx._gen_cmdline(
+                probtrackx.inputs.protocols[1],
+                os.path.abspath("protocol1"),
+                os.path.abspath("protocol1/seed1"),
+                22,
+                samples_base_name,
+                1000,
+            )
+        finally:
+            if stage_dir is not None:
+                shutil.rmtree(stage_dir)
+        cmdline += " "
+
+        assert "--samples=%s " % samples_base_name in cmdline, "Bad samples"
+        assert "--rseed=22" in cmdline, "Bad random seed"
+        assert "--nsamples=1000" in cmdline, "Bad sample number"
+        assert (
+            "--seed=%s " % os.path.abspath("protocol1/seeds.txt") in cmdline
+        ), "Bad seed list file"
+        assert "--waypoints=%s " % masks[0] in cmdline, "Bad waypoints"
+        assert "--avoid=%s " % masks[3] in cmdline, "Bad exclusion mask"
+        assert "--stop" not in cmdline, "Unexpected stop mask"
+        with open("protocol1/seeds.txt") as file:
+            assert file.read().split() == masks[1:3], "Bad seed list"
+
+        outputs = probtrackx._list_outputs()
+        assert outputs["fdt_paths"][3] == os.path.abspath(
+            "protocol1/seed1/fdt_paths.nii.gz"
+        ), "Bad output order"
+        assert outputs["samples_used"] == [5000] * 4, "Bad samples used"
+
+        # Every concurrent run loads its own samples
+        samples_gb = 3 * volume.size * 4 / 1024**3
+        estimator = MultiProbTrackX2RamEstimator()
+        estimator.min_gb = 0
+        for num_threads, pool_size in [(1, 1), (3, 3), (10, 4)]:
+            probtrackx.inputs.num_threads = num_threads
+            assert MultiProbTrackX2.pool_size(probtrackx.inputs) == pool_size
+            mem_gb, _ = estimator(probtrackx.inputs)
+            assert mem_gb == pytest.approx(
+                0.3 + samples_gb * pool_size
+            ), "Bad RAM estimation"
+        assert (
+            get_protocol_runs(outputs["fdt_paths"], 1, 2, 2) == outputs["fdt_paths"][2:]
+        ), "Bad protocol runs"
+
+    def test_probtrackx_convergence(self, monkeypatch):
+        rng = np.random.default_rng(0)
+        fdt_paths = rng.random((6, 6, 6)) * 100
+        change, distribution = MultiProbTrackX2.distribution_change(None, fdt_paths)
+        assert change == np.inf, "First increment cannot converge"
+        assert np.isclose(distribution.sum(), 1), "Bad normalisation"
+
+        # An increment with the same distribution does not change anything
+        change, distribution = MultiProbTrackX2.distribution_change(
+            distribution, fdt_paths * 2
+        )
+        assert np.isclose(change, 0), "Bad change of a converged distribution"
+
+        shifted = fdt_paths.copy()
+        shifted[0] += 1000
+        change, _ = MultiProbTrackX2.distribution_change(distribution, shifted)
+        assert 0.1 < change <= 1, "Bad change of a shifted distribution"
+
+        change, distribution = MultiProbTrackX2.distribution_change(
+            None, np.zeros((6, 6, 6))
+        )
+        assert change == np.inf and distribution is None, "Bad empty distribution"
+
+        # probtrackx replaced by a stable distribution with a little noise
+        def fake_probtrackx(self, cmdline, run_dir):
+            noise = rng.random(fdt_paths.shape) * 0.5
+            save_test_image(
+                fdt_paths + noise, os.path.join(run_dir, "fdt_paths.nii.gz")
+            )
+            with open(os.path.join(run_dir, "waytotal"), "w") as file:
+                file.write("100")
+
+        monkeypatch.setenv("FSLOUTPUTTYPE", "NIFTI_GZ")
+        monkeypatch.setattr(MultiProbTrackX2, "_run_probtrackx", fake_probtrackx)
+        volume = np.ones((6, 6, 6), dtype=np.float32)
+        samples = save_test_image(volume, "samples.nii.gz")
+        mask = save_test_image(volume, "mask.nii.gz")
+        probtrackx = MultiProbTrackX2(
+            fsamples=samples,
+            phsamples=samples,
+            thsamples=samples,
+            mask=mask,
+            mask_files=[mask],
+            protocols=[{"seed": [0], "waypoints": [0]}],
+            random_seeds=[1],
+            n_samples=1000,
+            adaptive=True,
+            use_shm=False,
+        )
+        outputs = probtrackx.run().outputs
+        assert outputs.samples_used == [200], "Run did not stop at convergence"
+        with open(outputs.way_total[0]) as file:
+            assert file.read() == "200", "Bad accumulated waytotal"
+        assert np.allclose(
+            nib.load(outputs.fdt_paths[0]).get_fdata(), fdt_paths * 2, atol=1
+        ), "Bad accumulated fdt_paths"
+
+    def test_seed_partition(self):
+        seeds = SeedPartition.partition("subject/cst", 10)
+        assert len(set(seeds)) == 10, "Seeds are not distinct"
+        assert seeds == SeedPartition.partition("subject/cst", 10), "Unstable seeds"
+        assert seeds != SeedPartition.partition("subject/af", 10), "Same tract seeds"
+
+        def sum_seeds(seeds):
+            return sum(seeds)
+
+        def build_workflow():
+            workflow = Workflow(name="seeds", base_dir=os.getcwd())
+            random_seed = Node(SeedPartition(), name="random_seed")
+            random_seed.inputs.seeds_n = 10
+            random_seed.inputs.identity = "subject/cst"
+            seed_sum = Node(
+                Function(input_names=["seeds"], function=sum_seeds), name="seed_sum"
+            )
+            workflow.connect(random_seed, "seeds", seed_sum, "seeds")
+            return workflow
+
+        build_workflow().run()
+        result_files = {
+            node_name: os.path.join("seeds", node_name, "result_%s.pklz" % node_name)
+            for node_name in ["random_seed", "seed_sum"]
+        }
+        mtimes = {
+            node_name: os.path.getmtime(result_file)
+            for node_name, result_file in result_files.items()
+        }
+
+        # A regenerated workflow must reuse every cached result
+        time.sleep(0.1)
+        build_workflow().run()
+        for node_name, result_file in result_files.items():
+            assert os.path.getmtime(result_file) == mtimes[node_name], (
+                "%s was recomputed" % node_name
+            )
+
+    def test_pack_masks(self):
+        rng = np.random.default_rng(0)
+        masks = rng.random((11, 12, 10, 8)) > 0.5
+        mask_files = [
+            save_test_image(mask.astype(np.float32), "mask_%d.nii.gz" % index)
+            for index, mask in enumerate(masks)
+        ]
+
+        outputs = PackMasks(in_files=mask_files, cache_dir="cache").run().outputs
+        assert len(outputs.packed_files) == 2, "Bad bundle volume number"
+        assert outputs.packed_files[0] == os.path.abspath(
+            os.path.join("bundle", PackMasks.BUNDLE_FILE % 0)
+        ), "Bundle not in node directory"
+        cached_file = os.path.join(
+            os.path.abspath("cache"),
+            PackMasks.bundle_key(mask_files),
+            PackMasks.BUNDLE_FILE % 0,
+        )
+        assert os.path.exists(cached_file), "Bundle is not content-addressed"
+        mtime = os.path.getmtime(cached_file)
+        PackMasks(in_files=mask_files, cache_dir="cache").run()
+        assert os.path.getmtime(cached_file) == mtime, "Bundle rebuilt"
+
+        # Node outputs survive the cache removal
+        shutil.rmtree("cache")
+        assert all(
+            os.path.exists(packed_file) for packed_file in outputs.packed_files
+        ), "Node bundle removed with the cache"
+
+        # Identity warp: warped bundles must unpack to the original masks
+        i, j, k = np.meshgrid(*[np.arange(n) for n in masks.shape[1:]], indexing="ij")
+        abs_warp = np.stack(
+            [(masks.shape[1] - 1 - i) * 0.5, j * 0.5, k * 0.5], axis=3
+        ).astype(np.float32)
+        abs_warp_nii = nib.load(save_test_image(abs_warp, "abs_warp.nii.gz"))
+        out_files = [os.path.abspath("%d_out.nii.gz" % i) for i in range(len(masks))]
+        BatchApplyWarp.unpack_labels(
+            BatchApplyWarp.iter_resampled_labels(abs_warp_nii, outputs.packed_files),
+            abs_warp_nii,
+            out_files,
+        )
+        for out_file, mask in zip(out_files, masks):
+            out = nib.load(out_file)
+            assert out.get_data_dtype() == np.uint8, "Bad unpacked datatype"
+            assert np.array_equal(out.get_fdata(), mask), "Bad unpacked mask"
+
+    def test_multi_threshold_cluster(self):
+        log_p = MultiThresholdCluster.cluster_log_p(
+            np.array([1, 10, 100, 1000]), 3.1, 0.5, 50000
+        )
+        assert np.all(np.diff(log_p) < 0), "p-value must decrease with cluster size"
+
+        zstat = np.zeros((30, 30, 30), dtype=np.float32)
+        zstat[5:15, 5:15, 5:15] = 6
+        zstat[8:11, 8:11, 8:11] = 8
+        zstat[25, 25, 25] = 4
+        zstat[20:23, 2:5, 20:23] = 4
+        mask = np.ones(zstat.shape, dtype=np.uint8)
+        mask[20:, :10, 20:] = 0
+
+        outputs = (
+            MultiThresholdCluster(
+                in_file=save_test_image(zstat, "zstat.nii.gz"),
+                mask_file=save_test_image(mask, "mask.nii.gz"),
+                thresholds=[3.1, 5, 7],
+                dlh=0.5,
+                volume=int(mask.sum()),
+                out_files=["t3.nii.gz", "t5.nii.gz", "t7.nii.gz"],
+            )
+            .run()
+            .outputs
+        )
+        expected = np.zeros(zstat.shape)
+        expected[5:15, 5:15, 5:15] = zstat[5:15, 5:15, 5:15]
+        for out_file in outputs.out_files[:2]:
+            assert np.array_equal(
+                nib.load(out_file).get_fdata(), expected
+            ), "Bad significant clusters"
+        assert np.array_equal(
+            nib.load(outputs.out_files[2]).get_fdata() > 0,
+            zstat == 8,
+        ), "Bad significant clusters at higher threshold"
+
+    def test_batch_apply_xfm(self):
+        rng = np.random.default_rng(0)
+        data = rng.random((10, 12, 8)).astype(np.float32)
+        in_file = save_test_image(data, "in.nii.gz")
+        ref_file = save_test_image(np.zeros((10, 12, 8)), "ref.nii.gz")
+
+        # Input shifted of 2 voxels (1 mm) along y in reference space
+        matrix = np.eye(4)
+        matrix[1, 3] = 1
+        np.savetxt("in2ref.mat", matrix)
+        outputs = (
+            BatchApplyXFM(
+                in_files=[in_file, in_file],
+                reference=ref_file,
+                in_matrix_file="in2ref.mat",
+            )
+            .run()
+            .outputs
+        )
+        expected = np.zeros(data.shape)
+        expected[:, 2:] = data[:, :-2]
+        for out_file in outputs.out_files:
+            out = nib.load(out_file)
+            assert out.get_data_dtype() == np.float32, "Bad output datatype"
+            assert np.allclose(out.get_fdata(), expected, atol=1e-6), "Bad resampling"
+
+    def test_aroma_features(self):
+        rng = np.random.default_rng(0)
+        shape = (8, 9, 7)
+        maps = rng.normal(size=shape + (5,)).astype(np.float32)
+        maps[..., 4] = 0
+        maps_file = os.path.abspath("maps.nii")
+        nib.save(nib.Nifti1Image(maps, np.diag([0.5, 0.5, 0.5, 1])), maps_file)
+        masks = {}
+        for mask_name in ["csf", "edge", "out"]:
+            masks[mask_name] = rng.random(shape) > 0.7
+            save_test_image(masks[mask_name].astype(np.uint8), mask_name + ".nii.gz")
+
+        n_vols = 60
+        np.savetxt("mel_mix", rng.normal(size=(n_vols, 5)))
+        np.savetxt("mel_ft_mix", np.abs(rng.normal(size=(n_vols // 2, 5))))
+        np.savetxt("mc.par", rng.normal(size=(n_vols, 6)))
+
+        outputs = (
+            AromaFeatures(
+                in_file=maps_file,
+                mask_csf="csf.nii.gz",
+                mask_edge="edge.nii.gz",
+                mask_out="out.nii.gz",
+                mel_mix="mel_mix",
+                mel_ft_mix="mel_ft_mix",
+                mc="mc.par",
+                TR=2.0,
+                num_threads=3,
+            )
+            .run()
+            .outputs
+        )
+
+        for index in range(4):
+            ic = np.abs(maps[..., index])
+            tot_sum = ic.sum(dtype=np.float64)
+            csf_sum = ic[masks["csf"]].sum(dtype=np.float64)
+            edge_sum = ic[masks["edge"]].sum(dtype=np.float64)
+            out_sum = ic[masks["out"]].sum(dtype=np.float64)
+            assert np.isclose(
+                outputs.csf_fract[index], csf_sum / tot_sum
+            ), "Bad csf fraction"
+            assert np.isclose(
+                outputs.edge_fract[index], (out_sum + edge_sum) / (tot_sum - csf_sum)
+            ), "Bad edge fraction"
+        assert outputs.csf_fract[4] == 0, "Empty component should score 0"
+        assert outputs.edge_fract[4] == 0, "Empty component should score 0"
+        assert np.allclose(
+            outputs.max_rp_corr,
+            AromaFunc.feature_time_series("mel_mix", "mc.par", seed=0),
+        ), "Bad time series feature"
+        assert np.allclose(
+            outputs.HFC, AromaFunc.feature_frequency("mel_ft_mix", 2.0)
+        ), "Bad frequency feature"
+
+        # Estimate scales with the 4D dimensions
+        node = AromaFeatures(in_file=maps_file, num_threads=1)
+        small_gb, _ = AromaFeaturesRamEstimator()(node.inputs)
+        big_shape = (91, 109, 91, 100)
+        assert AromaFeatures.mem_gb(big_shape) > AromaFeatures.mem_gb(
+            big_shape[:3] + (10,)
+        ), "Estimate should grow with components"
+        assert small_gb == AromaFeaturesRamEstimator().min_gb, "Bad clamp"
+
+    def test_func_preproc(self):
+        rng = np.random.default_rng(0)
+        data = rng.integers(0, 1000, size=(6, 7, 5, 10)).astype(np.int16)
+        # Neurological storage with axes in PA RL IS order
+        affine = np.array(
+            [[0, -2, 0, 10], [3, 0, 0, -20], [0, 0, 2.5, 5], [0, 0, 0, 1]]
+        )
+        in_nii = nib.Nifti1Image(data, affine)
+        in_nii.header.set_slope_inter(0.5, 1)
+        in_nii.header.set_zooms((3, 2, 2.5, 1.8))
+        nib.save(in_nii, "func.nii.gz")
+        scaled = np.asarray(nib.load("func.nii.gz").dataobj, dtype=np.float32)
+
+        outputs = (
+            FuncPreproc(
+                in_file=os.path.abspath("func.nii.gz"),
+                nvols=10,
+                del_start_vols=2,
+                del_end_vols=1,
+            )
+            .run()
+            .outputs
+        )
+        assert outputs.nvols == 7, "Bad volumes count"
+        out = nib.load(outputs.out_file)
+        assert outputs.out_file.endswith(".nii"), "Output should be uncompressed"
+        assert out.get_data_dtype() == np.float32, "Bad output datatype"
+        assert nib.aff2axcodes(out.affine) == ("L", "A", "S"), "Bad orientation"
+        assert out.shape == (7, 6, 5, 7), "Bad output shape"
+        assert np.allclose(out.header.get_zooms(), (2, 3, 2.5, 1.8)), "Bad zooms"
+
+        # Every voxel keeps its world position and its scaled value
+        out_data = out.get_fdata()
+        for index in [(0, 0, 0), (3, 5, 2), (6, 1, 4)]:
+            world = out.affine @ np.array(index + (1,))
+            in_index = np.rint(np.linalg.inv(affine) @ world).astype(int)[:3]
+            assert np.allclose(
+                out_data[index], scaled[tuple(in_index)][2:9]
+            ), "Bad voxel values"
+        ref = nib.load(outputs.ref_file)
+        assert ref.shape == (7, 6, 5), "Bad reference shape"
+        assert np.array_equal(
+            ref.get_fdata(), out_data[..., 3]
+        ), "Reference should be the middle volume"
+
+    def test_func_preproc_orientation(self):
+        rng = np.random.default_rng(1)
+        data = rng.random(size=(4, 5, 3, 3)).astype(np.float32)
+        neurological = np.array(
+            [[2, 0, 0, -4], [0, 2, 0, -5], [0, 0, 3, 1], [0, 0, 0, 1]]
+        )
+        radiological = np.array(
+            [[-2, 0, 0, 4], [0, 0, 3, -5], [0, 2, 0, 1], [0, 0, 0, 1]]
+        )
+        flip_x = np.array(
+            [[-1, 0, 0, data.shape[0] - 1], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]
+        )
+
+        for affine in (neurological, radiological):
+            nib.save(nib.Nifti1Image(data, affine), "orient.nii.gz")
+            outputs = (
+                FuncPreproc(in_file=os.path.abspath("orient.nii.gz"), nvols=3)
+                .run()
+                .outputs
+            )
+            out = nib.load(outputs.out_file)
+
+            # ForceOrient steps: fslswapdim -x and fslorient -swaporient if
+            # neurological, then fslswapdim RL PA IS
+            expected = nib.Nifti1Image(data, affine)
+            if np.linalg.det(affine[:3, :3]) > 0:
+                expected = nib.Nifti1Image(data[::-1], affine @ flip_x)
+            expected = expected.as_reoriented(
+                nib.orientations.ornt_transform(
+                    nib.orientations.io_orientation(expected.affine),
+                    nib.orientations.axcodes2ornt(("L", "A", "S")),
+                )
+            )
+            assert np.linalg.det(out.affine[:3, :3]) < 0, "Output not radiological"
+            assert np.allclose(out.affine, expected.affine), "Bad output affine"
+            assert np.array_equal(
+                out.get_fdata(), expected.get_fdata()
+            ), "Bad output voxels"
+
+    def test_synth_server_client(self, monkeypatch):
+        class MockModelBackend:
+            def __init__(self):
+                self.models = {}
+                self.model_loads = 0
+                self.requests = []
+
+            def __call__(self, args, cwd):
+                # Models stay resident between requests
+                if args[0] not in self.models:
+                    self.models[args[0]] = "weights"
+                    self.model_loads += 1
+                self.requests.append(args)
+                if "--fallback" in args:
+                    return {"fallback": True, "error": "not supported in process"}
+                in_file = args[args.index("-i") + 1]
+                out_file = os.path.join(cwd, args[args.index("-o") + 1])
+                shutil.copy(in_file, out_file)
+                return {"returncode": 0, "stdout": "stripped", "stderr": ""}
+
+        in_file = save_test_image(np.ones((4, 4, 4), dtype=np.float32), "t1.nii.gz")
+        socket_dir = "/tmp/swane_test_synth_%d" % os.getpid()
+        os.makedirs(socket_dir, exist_ok=True)
+        socket_path = os.path.join(socket_dir, "socket")
+        backend = MockModelBackend()
+        server = SynthModelServer(socket_path, backend)
+        server_thread = Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        monkeypatch.setenv(SynthModelServer.SOCKET_ENV, socket_path)
+
+        try:
+            for run in range(2):
+                result = SynthStrip(
+                    in_file=in_file, out_file="brain_%d.nii.gz" % run
+                ).run()
+                assert os.path.exists(result.outputs.out_file), "Output not produced"
+                assert result.runtime.stdout == "stripped", "Server output not returned"
+            assert len(backend.requests) == 2, "Requests not served by the server"
+            assert backend.model_loads == 1, "Model should be loaded once"
+            assert backend.requests[0][0] == "mri_synthstrip", "Bad command"
+
+            cwd = os.getcwd()
+            assert (
+                SynthModelServer.request(socket_path, "mri_synthstrip --fallback", cwd)
+                is None
+            ), "Fallback reply should select the command line"
+            assert (
+                SynthModelServer.request(socket_path, "rm -rf " + cwd, cwd) is None
+            ), "Commands other than Synth tools should be refused"
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+        assert (
+            SynthModelServer.request(socket_path, "mri_synthstrip", os.getcwd()) is None
+        ), "Unreachable server should select the command line"
+
+    def test_resident_model_backend(self, monkeypatch):
+        class MockTool(SynthTool):
+            NAME = "mri_synthstrip"
+            THREAD_SAFE = True
+
+            def __init__(self):
+                self.loads = []
+
+            def parse(self, args, cwd):
+                if "--gpu" in args:
+                    return None
+                return {"model": args[1], "threads": int(args[2])}
+
+            def model_key(self, options):
+                return options["model"], options["threads"]
+
+            def load(self, model, threads):
+                if model == "broken":
+                    raise RuntimeError("cannot load")
+                self.loads.append((model, threads))
+                return {"model": model}
+
+            def run(self, loaded, options):
+                return {"returncode": 0, "stdout": loaded["model"], "stderr": ""}
+
+        tool = MockTool()
+        backend = ResidentModelBackend([tool])
+        for model in ["a", "a", "b", "a"]:
+            reply = backend(["mri_synthstrip", model, "1"], os.getcwd())
+            assert reply["stdout"] == model, "Request not served by its model"
+        backend(["mri_synthstrip", "a", "2"], os.getcwd())
+        assert tool.loads == [("a", 1), ("b", 1), ("a", 2)], "Models not kept loaded"
+        for args in (
+            ["mri_synthstrip", "a", "1", "--gpu"],
+            ["mri_synthseg", "a", "1"],
+            ["mri_synthstrip", "broken", "1"],
+            ["mri_synthstrip", "broken", "1"],
+        ):
+            assert backend(args, os.getcwd())["fallback"], "Command line not selected"
+
+        # A script whose model factory records every build
+        script_dir = os.path.abspath("synth_bin")
+        os.makedirs(script_dir, exist_ok=True)
+        script = os.path.join(script_dir, "mri_synthseg")
+        with open(script, "w") as file:
+            file.write(
+                "#!/usr/bin/env python\n"
+                "import sys\n"
+                "def build_model(path):\n"
+                "    with open('builds.txt', 'a') as builds:\n"
+                "        builds.write(path + '\\n')\n"
+                "    return path.upper()\n"
+                "def main():\n"
+                "    print(build_model(sys.argv[sys.argv.index('--i') + 1]))\n"
+                "if __name__ == '__main__':\n"
+                "    main()\n"
+            )
+        os.chmod(script, 0o755)
+        monkeypatch.delenv("FREESURFER_HOME", raising=False)
+        monkeypatch.setenv("PATH", script_dir + os.pathsep + os.environ["PATH"])
+        backend = ResidentModelBackend([SynthSegTool()])
+        for model in ["x", "x", "y"]:
+            reply = backend(
+                ["mri_synthseg", "--i", model, "--threads", "1"], os.getcwd()
+            )
+            assert reply["stdout"] == model.upper() + "\n", "Script output not returned"
+        with open("builds.txt") as builds:
+            assert builds.read().split() == ["x", "y"], "Model built more than once"
+
+    def test_compose_transforms(self):
+        reference = save_test_image(np.zeros((4, 4, 4), dtype=np.float32), "ref.nii.gz")
+        workflow = Workflow(name="compose")
+        source = Node(
+            IdentityInterface(fields=["mat1", "mat2", "warp", "mat3", "image"]),
+            name="source",
+        )
+
+        def connections(node):
+            return {
+                dest: (upstream.name, source_output)
+                for upstream, _, data in workflow._graph.in_edges(node, data=True)
+                for source_output, dest in data["connect"]
+            }
+
+        apply_node = apply_registration_node(
+            name="chain",
+            use_synth=False,
+            workflow=workflow,
+            warp=None,
+            moving=[source, "image"],
+            reference=reference,
+            transforms=[
+                ([source, "mat1"], False),
+                ([source, "mat2"], False),
+                ([source, "warp"], True),
+                ([source, "mat3"], False),
+            ],
+        )
+        assert apply_node.inputs.relwarp, "Composite field is relative"
+        convert_warp = workflow.get_node("chain_convert_warp")
+        concat_xfm = workflow.get_node("chain_concat_xfm_1")
+        assert connections(apply_node)["field_file"] == (
+            "chain_convert_warp",
+            "out_file",
+        ), "Image should be resampled once with the composite field"
+        assert connections(concat_xfm) == {
+            "in_file": ("source", "mat1"),
+            "in_file2": ("source", "mat2"),
+        }, "Consecutive affines should be concatenated in order"
+        assert connections(convert_warp) == {
+            "premat": ("chain_concat_xfm_1", "out_file"),
+            "warp1": ("source", "warp"),
+            "postmat": ("source", "mat3"),
+        }, "Bad convertwarp slots"
+        assert convert_warp.inputs.reference == reference, "Bad reference"
+
+        affine_node = apply_registration_node(
+            name="affine_chain",
+            use_synth=False,
+            workflow=workflow,
+            warp=None,
+            moving=[source, "image"],
+            reference=reference,
+            transforms=[([source, "mat1"], False), ([source, "mat2"], False)],
+        )
+        assert connections(affine_node)["in_matrix_file"] == (
+            "affine_chain_concat_xfm_1",
+            "out_file",
+        ), "Affine chain should be applied as one matrix"
+
+        with pytest.raises(ValueError):
+            apply_registration_node(
+                name="synth_chain",
+                use_synth=True,
+                workflow=workflow,
+                warp=None,
+                moving=[source, "image"],
+                reference=reference,
+                transforms=[([source, "warp"], True), ([source, "mat1"], False)],
+            )
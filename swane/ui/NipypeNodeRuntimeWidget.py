@@ -12,17 +12,13 @@ from PySide6.QtCore import Qt, QUrl
 from PySide6.QtGui import QDesktopServices, QFontMetrics
 
 from swane import strings
-from nipype.utils.filemanip import loadpkl
 from datetime import datetime
 from swane.nipype_pipeline.engine.WorkflowReport import WorkflowSignals
 from swane.ui.CustomTreeWidgetItem import CustomTreeWidgetItem
 from multiprocessing import cpu_count
-from nipype.interfaces.base.support import Bunch
-from nipype.interfaces.base import traits
 import math
 import os
 import subprocess
-from numpy import ndarray
 
 from swane.utils.ToolReference import get_command_info, ToolReference
 
@@ -86,6 +82,8 @@ class NipypeNodeRuntimeWidget(QScrollArea):
         Shows only info that exists if the node is running.
         Read command from command.txt if result.pklz is not yet available.
         """
+        from nipype.utils.filemanip import loadpkl
+
         node_parts = item.node_name.split(".")
         node_wf = node_parts[0]
         node_name = node_parts[1]
@@ -354,6 +352,7 @@ class NipypeNodeRuntimeWidget(QScrollArea):
         self.grid.addWidget(btn, row, col, 1, 5)
 
     def _add_output_view(self, outputs, col):
+        from nipype.interfaces.base.support import Bunch
 
         # -------------------------
         # Case 1: OutputSpec (Node)
@@ -428,6 +427,9 @@ class NipypeNodeRuntimeWidget(QScrollArea):
             self._add_value("—", self._row, col, colspan=6)
 
     def _is_valid_output_value(self, value):
+        from nipype.interfaces.base import traits
+        from numpy import ndarray
+
         if value is None:
             return False
         if value is traits.Undefined:
@@ -446,6 +448,8 @@ class NipypeNodeRuntimeWidget(QScrollArea):
         return f"<i><u>{name}</u></i>"
 
     def _get_interface_name(self, node_pickle_file):
+        from nipype.utils.filemanip import loadpkl
+
         try:
             node = loadpkl(node_pickle_file)
             interface = node.interface
@@ -1,7 +1,7 @@
 import os
 from functools import partial
 from datetime import datetime
-from PySide6.QtCore import Qt, QThreadPool, QFileSystemWatcher, QTimer, QUrl
+from PySide6.QtCore import Qt, QThreadPool, QFileSystemWatcher, QTimer, QUrl, Signal
 from PySide6.QtGui import QFont, QDesktopServices
 from PySide6.QtSvgWidgets import QSvgWidget
 from PySide6.QtWidgets import (
@@ -53,6 +53,9 @@ class SubjectTab(QTabWidget):
     EXECTAB = 1
     RESULTTAB = 2
 
+    # Emitted from the render threads with the long name of a drawn graph
+    graph_rendered = Signal(str)
+
     def __init__(
         self, global_config: ConfigManager, subject: Subject, main_window, parent=None
     ):
@@ -81,6 +84,9 @@ class SubjectTab(QTabWidget):
         )
         self.result_directory_watcher.addPath(self.subject.folder)
 
+        self.graph_rendered.connect(self.graph_render_completed)
+        self.awaited_graphs = set()
+
         self.workflow_process = None
         self.node_list = None
         self.input_report = {}
@@ -691,6 +697,16 @@ class SubjectTab(QTabWidget):
             return
 
         if current.parent() is None:
+            long_name = current.get_text()
+            graph_render = self.subject.request_graph(long_name)
+            if graph_render is not None and not graph_render.done():
+                # Shown by graph_render_completed when drawn, if still selected
+                if graph_render not in self.awaited_graphs:
+                    self.awaited_graphs.add(graph_render)
+                    graph_render.add_done_callback(
+                        lambda future: self.graph_rendered.emit(long_name)
+                    )
+                return
             graph_file = self.subject.graph_file(current.get_text())
             if os.path.exists(graph_file):
                 self.exec_graph.load(graph_file)
@@ -706,6 +722,35 @@ class SubjectTab(QTabWidget):
                 self.subject.workflow_dir(), current
             )
 
+    def graph_render_completed(self, long_name: str):
+        """
+        Listener for the graph_rendered signal, executed in the GUI thread.
+        Shows the drawn graph if its sub-workflow is still selected.
+
+        Parameters
+        ----------
+        long_name : str
+            The long name of the drawn sub-workflow graph.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.awaited_graphs = {
+            graph_render
+            for graph_render in self.awaited_graphs
+            if not graph_render.done()
+        }
+        current = self.node_list_treeWidget.currentItem()
+        if (
+            current is not None
+            and current.parent() is None
+            and current.get_text() == long_name
+        ):
+            self.tree_item_changed(current, None)
+
     @staticmethod
     def no_close_event(event):
         """
@@ -747,6 +792,13 @@ class SubjectTab(QTabWidget):
             if workflow_start_ret == SubjectRet.ExecWfResume:
                 msg_box = QMessageBox()
                 msg_box.setText(strings.subj_tab_old_wf_found)
+                if self.subject.workflow_diff is not None:
+                    # Nodes invalidated by changes since the previous execution
+                    msg_box.setInformativeText(
+                        strings.subj_tab_old_wf_diff
+                        % self.subject.workflow_diff.summary()
+                    )
+                    msg_box.setDetailedText(self.subject.workflow_diff.report())
                 msg_box.setIcon(QMessageBox.Icon.Question)
                 msg_box.setStandardButtons(
                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
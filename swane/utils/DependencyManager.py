@@ -1,9 +1,11 @@
 import os
+import json
 import subprocess
 import re
+import threading
 from shutil import which
-from nipype.interfaces import dcm2nii, fsl, freesurfer
-from swane import strings
+from concurrent.futures import Future, ThreadPoolExecutor
+from swane import strings, __version__
 from packaging import version
 from swane.config.ConfigManager import ConfigManager
 from PySide6.QtCore import QThreadPool
@@ -88,11 +90,204 @@ class DependencyManager:
     FLS_LOCALE_COMMAND = "locale -a | grep en_US.utf8 >/dev/null || false "
     SLICER_MODULES = ["SlicerFreeSurfer", "SurfaceWrapSolidify"]
 
+    PROBES = ["dcm2niix", "fsl", "freesurfer", "graphviz"]
+
+    # Probe results of previous executions, reused while their probe key is unchanged
+    PROBE_CACHE_FILE = os.path.join(
+        os.path.expanduser("~"),
+        "." + strings.APPNAME + "_cache",
+        "dependency_probes.json",
+    )
+
+    # Probe results of this process, by probe name: (probe key, Future of Dependence)
+    _probes: dict = {}
+    _probes_lock = threading.Lock()
+    _probe_executor: ThreadPoolExecutor = None
+    # Content of PROBE_CACHE_FILE, loaded on first use
+    _stored_probes: dict = None
+
     def __init__(self):
-        self.dcm2niix = DependencyManager.check_dcm2niix()
-        self.fsl = DependencyManager.check_fsl()
-        self.freesurfer = DependencyManager.check_freesurfer()
-        self.graphviz = DependencyManager.check_graphviz()
+        self._futures = DependencyManager.start_probes()
+
+    @property
+    def dcm2niix(self) -> Dependence:
+        return self._futures["dcm2niix"].result()
+
+    @property
+    def fsl(self) -> Dependence:
+        return self._futures["fsl"].result()
+
+    @property
+    def freesurfer(self) -> Dependence:
+        return self._futures["freesurfer"].result()
+
+    @property
+    def graphviz(self) -> Dependence:
+        return self._futures["graphviz"].result()
+
+    @staticmethod
+    def _file_signature(path: str) -> tuple:
+        if path is None:
+            return (None,)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return (path,)
+        return path, stat.st_mtime_ns, stat.st_ino
+
+    @staticmethod
+    def probe_key(name: str) -> tuple:
+        """
+        Computes, without running external commands, the values a probe result depends on:
+        the tool paths with their mtime and inode and the tool environment variables.
+
+        Parameters
+        ----------
+        name: str
+            The probe name, in PROBES
+
+        Returns
+        -------
+        A tuple that changes when the probe must run again
+        """
+        if name == "dcm2niix":
+            files = [which("dcm2niix")]
+            env = []
+        elif name == "fsl":
+            fsl_dir = os.getenv("FSLDIR", "")
+            files = [os.path.join(fsl_dir, "etc", "fslversion"), which("flirt")]
+            env = ["FSLDIR", "FSLOUTPUTTYPE"]
+        elif name == "freesurfer":
+            freesurfer_home = os.getenv("FREESURFER_HOME", "")
+            files = [
+                which("recon-all"),
+                os.path.join(freesurfer_home, "build-stamp.txt"),
+                os.path.join(freesurfer_home, "license.txt"),
+                os.getenv("FS_LICENSE"),
+                which(DependencyManager.FSL_TCSH_COMMAND),
+                which(DependencyManager.FREESURFER_MATLAB_COMMAND),
+            ]
+            env = ["FREESURFER_HOME", "FS_LICENSE"]
+        else:
+            files = [which("dot")]
+            env = []
+        return tuple(DependencyManager._file_signature(path) for path in files) + tuple(
+            os.getenv(variable) for variable in env
+        )
+
+    @staticmethod
+    def _run_probe(name: str) -> Dependence:
+        return getattr(DependencyManager, "check_" + name)()
+
+    @staticmethod
+    def _load_stored_probes() -> dict:
+        """
+        Reads the probe cache file. Results of another SWANe version are discarded,
+        as checks and minimum versions may differ.
+
+        Returns
+        -------
+        The stored probes, by probe name
+        """
+        try:
+            with open(DependencyManager.PROBE_CACHE_FILE, encoding="utf-8") as file:
+                stored = json.load(file)
+            if stored["version"] == __version__ and type(stored["probes"]) is dict:
+                return stored["probes"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    @staticmethod
+    def _stored_result(name: str, key: tuple) -> Dependence:
+        """
+        Returns
+        -------
+        The stored result of a probe if its probe key is unchanged, otherwise None
+        """
+        stored = DependencyManager._stored_probes.get(name)
+        try:
+            # Keys are stored as json, tuples become lists
+            if stored is None or stored["key"] != json.loads(json.dumps(key)):
+                return None
+            return Dependence(
+                DependenceStatus[stored["state"]],
+                stored["label"],
+                DependenceStatus[stored["state2"]],
+            )
+        except (KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _probe_and_store(name: str, key: tuple) -> Dependence:
+        """
+        Runs a probe and saves its result in the probe cache file.
+        """
+        dependence = DependencyManager._run_probe(name)
+        with DependencyManager._probes_lock:
+            DependencyManager._stored_probes[name] = {
+                "key": key,
+                "state": dependence.state.name,
+                "label": dependence.label,
+                "state2": dependence.state2.name,
+            }
+            content = {
+                "version": __version__,
+                "probes": DependencyManager._stored_probes,
+            }
+            temp_file = DependencyManager.PROBE_CACHE_FILE + ".tmp"
+            try:
+                os.makedirs(
+                    os.path.dirname(DependencyManager.PROBE_CACHE_FILE), exist_ok=True
+                )
+                with open(temp_file, "w", encoding="utf-8") as file:
+                    json.dump(content, file)
+                os.replace(temp_file, DependencyManager.PROBE_CACHE_FILE)
+            except OSError:
+                pass
+        return dependence
+
+    @staticmethod
+    def start_probes() -> dict[str, Future]:
+        """
+        Starts the dependency probes in background threads.
+        Results are shared in the process and saved in PROBE_CACHE_FILE: a probe runs again
+        only if its probe key changed, so it can be called early at startup and again by
+        every DependencyManager, and a start with unchanged tools runs no external command.
+
+        Returns
+        -------
+        A dict of Future of Dependence, by probe name
+        """
+        futures = {}
+        with DependencyManager._probes_lock:
+            if DependencyManager._probe_executor is None:
+                DependencyManager._probe_executor = ThreadPoolExecutor(
+                    max_workers=len(DependencyManager.PROBES),
+                    thread_name_prefix="dependency_probe",
+                )
+            if DependencyManager._stored_probes is None:
+                DependencyManager._stored_probes = (
+                    DependencyManager._load_stored_probes()
+                )
+            for name in DependencyManager.PROBES:
+                key = DependencyManager.probe_key(name)
+                cached = DependencyManager._probes.get(name)
+                if cached is not None and cached[0] == key:
+                    futures[name] = cached[1]
+                    continue
+
+                dependence = DependencyManager._stored_result(name, key)
+                if dependence is not None:
+                    future = Future()
+                    future.set_result(dependence)
+                else:
+                    future = DependencyManager._probe_executor.submit(
+                        DependencyManager._probe_and_store, name, key
+                    )
+                DependencyManager._probes[name] = (key, future)
+                futures[name] = future
+        return futures
 
     def is_fsl(self) -> bool:
         """
@@ -147,6 +342,8 @@ class DependencyManager:
         True if freesurfer version contains synth commands.
 
         """
+        from nipype.interfaces import freesurfer
+
         freesurfer_version = str(freesurfer.base.Info.looseversion())
         try:
             found_version = version.parse(freesurfer_version)
@@ -258,6 +455,8 @@ class DependencyManager:
         -------
         A Dependence object with dcm2niix information.
         """
+        from nipype.interfaces import dcm2nii
+
         dcm2niix_version = dcm2nii.Info.version()
         if dcm2niix_version is None:
             return Dependence(
@@ -275,6 +474,8 @@ class DependencyManager:
         -------
         A Dependence object with fsl information.
         """
+        from nipype.interfaces import fsl
+
         fsl_version = fsl.base.Info.version()
         if fsl_version is None:
             return Dependence(DependenceStatus.MISSING, strings.check_dep_fsl_error)
@@ -321,6 +522,7 @@ class DependencyManager:
         -------
         A Dependence object with freesurfer and freesurfer matlab runtime information.
         """
+        from nipype.interfaces import freesurfer
 
         # FS installed
         if freesurfer.base.Info.version() is None:
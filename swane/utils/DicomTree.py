@@ -1,4 +1,9 @@
-import pydicom
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pydicom
 
 
 class DicomSeries:
@@ -34,6 +39,8 @@ class DicomSeries:
                     self.volumes += 1
 
     def refine_frame_number(self):
+        import pydicom
+
         if self.is_multi_frame and self.multi_frame_loc is not None:
             if self.ds is None:
                 self.ds = pydicom.dcmread(self.multi_frame_loc, force=True)
@@ -0,0 +1,117 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+
+class GraphRenderPool:
+    """
+    Bounded pool drawing the graphviz graphs of the sub-workflows.
+    Each graph is stored with the hash of its dot description: a graph whose structure
+    is unchanged since the last drawing is not drawn again.
+
+    """
+
+    MAX_WORKERS = max(1, min(4, cpu_count() // 2))
+    HASH_EXT = ".sha256"
+
+    _executor: ThreadPoolExecutor = None
+    _lock = threading.Lock()
+    # Renders not yet completed, by graph file
+    _pending: dict[str, Future] = {}
+
+    @staticmethod
+    def dot_file(graph_file: str) -> str:
+        return os.path.splitext(graph_file)[0] + ".dot"
+
+    @staticmethod
+    def related_files(graph_file: str) -> list[str]:
+        """
+        Returns
+        -------
+        The graph file and the files stored with it
+        """
+        return [
+            graph_file,
+            GraphRenderPool.dot_file(graph_file),
+            graph_file + GraphRenderPool.HASH_EXT,
+        ]
+
+    @staticmethod
+    def read_hash(graph_file: str) -> str:
+        try:
+            with open(graph_file + GraphRenderPool.HASH_EXT, encoding="utf-8") as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def render(workflow, graph_file: str, colored: bool = True) -> bool:
+        """
+        Writes the dot description of a workflow and draws it, if changed.
+
+        Parameters
+        ----------
+        workflow : CustomWorkflow
+            The workflow to draw.
+        graph_file : str
+            The image path, its extension is the image format.
+        colored : bool, optional
+            If True, the graph is colored by sub-workflow. The default is True.
+
+        Returns
+        -------
+        True if the graph was drawn, False if the existing image was up to date.
+
+        """
+        from nipype.pipeline.engine.utils import format_dot
+
+        dot_file = GraphRenderPool.dot_file(graph_file)
+        workflow.write_hierarchical_dotfile(
+            dotfilename=dot_file, colored=colored, simple_form=True
+        )
+        with open(dot_file, "rb") as file:
+            structure_hash = hashlib.sha256(file.read()).hexdigest()
+        if (
+            os.path.exists(graph_file)
+            and GraphRenderPool.read_hash(graph_file) == structure_hash
+        ):
+            return False
+
+        format_dot(dot_file, format=os.path.splitext(graph_file)[1][1:])
+        with open(graph_file + GraphRenderPool.HASH_EXT, "w", encoding="utf-8") as file:
+            file.write(structure_hash)
+        return True
+
+    @staticmethod
+    def submit(workflow, graph_file: str, colored: bool = True) -> Future:
+        """
+        Queues the drawing of a workflow graph. A graph already queued is not queued again.
+
+        Returns
+        -------
+        A Future of the render() result.
+
+        """
+        with GraphRenderPool._lock:
+            future = GraphRenderPool._pending.get(graph_file)
+            if future is not None and not future.done():
+                return future
+            if GraphRenderPool._executor is None:
+                GraphRenderPool._executor = ThreadPoolExecutor(
+                    max_workers=GraphRenderPool.MAX_WORKERS,
+                    thread_name_prefix="graph_render",
+                )
+            future = GraphRenderPool._executor.submit(
+                GraphRenderPool.render, workflow, graph_file, colored
+            )
+            GraphRenderPool._pending[graph_file] = future
+        future.add_done_callback(lambda done: GraphRenderPool._forget(graph_file, done))
+        return future
+
+    @staticmethod
+    def _forget(graph_file: str, future: Future):
+        with GraphRenderPool._lock:
+            if GraphRenderPool._pending.get(graph_file) is future:
+                del GraphRenderPool._pending[graph_file]
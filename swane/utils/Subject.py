@@ -9,15 +9,22 @@ from swane.utils.DependencyManager import DependencyManager
 from swane.workers.DicomSearchWorker import DicomSearchWorker
 from PySide6.QtCore import QThreadPool
 from swane import strings
-from swane.nipype_pipeline.MainWorkflow import MainWorkflow
 import traceback
-from threading import Thread
-from swane.nipype_pipeline.workflows.freesurfer_workflow import FS_DIR
+from concurrent.futures import Future
 from multiprocessing import Queue
-from swane.workers.WorkflowMonitorWorker import WorkflowMonitorWorker
-from swane.workers.WorkflowProcess import WorkflowProcess
 from swane.workers.SlicerExportWorker import SlicerExportWorker
 from swane.utils.ToolReference import tool_reference_list
+from swane.utils.GraphRenderPool import GraphRenderPool
+from swane.config.config_enums import GlobalPrefCategoryList
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Workflow modules import nipype, they are loaded when a workflow is generated
+    from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+    from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
+    from swane.nipype_pipeline.WorkflowManifest import WorkflowManifest
+    from swane.workers.WorkflowMonitorWorker import WorkflowMonitorWorker
+    from swane.workers.WorkflowProcess import WorkflowProcess
 
 
 class SubjectRet(Enum):
@@ -65,8 +72,12 @@ class Subject:
         self.config: ConfigManager = None
         self.dependency_manager: DependencyManager = dependency_manager
         self.workflow: MainWorkflow = None
+        self.workflow_diff: WorkflowDiff = None
+        self.workflow_manifest: WorkflowManifest = None
         self.workflow_process: WorkflowProcess = None
         self.workflow_monitor_work: WorkflowMonitorWorker = None
+        # Graph drawings of the current workflow, by sub-workflow long name
+        self.graph_renders: dict[str, Future] = {}
 
     def load(self, subject_folder: str) -> SubjectRet:
         """
@@ -637,12 +648,43 @@ class Subject:
             Subject.GRAPH_FILE_PREFIX + graph_name + "." + Subject.GRAPH_FILE_EXT,
         )
 
+    def request_graph(self, long_name: str) -> Future:
+        """
+        Queues the drawing of a sub-workflow graph, if not already drawn or queued.
+
+        Parameters
+        ----------
+        long_name: str
+            The sub-workflow complete name
+
+        Returns
+        -------
+        A Future completed when the graph file is ready, None if it cannot be drawn
+        """
+        if self.workflow is None or not self.dependency_manager.is_graphviz():
+            return None
+        if long_name not in self.graph_renders:
+            node_list = self.workflow.get_node_array()
+            for node in node_list.keys():
+                if node_list[node].long_name == long_name:
+                    self.graph_renders[long_name] = GraphRenderPool.submit(
+                        self.workflow.get_node(node),
+                        self.graph_file(long_name),
+                        colored=self.GRAPH_TYPE == "colored",
+                    )
+                    break
+            else:
+                return None
+        return self.graph_renders[long_name]
+
     def result_dir(self) -> str:
         """
         Returns
         -------
         The subject results directory path
         """
+        from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+
         return os.path.join(self.folder, MainWorkflow.Result_DIR)
 
     def scene_path(self) -> str:
@@ -671,6 +713,10 @@ class Subject:
 
         """
 
+        from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+        from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
+        from swane.nipype_pipeline.WorkflowManifest import WorkflowManifest
+
         if not self.can_generate_workflow():
             return SubjectRet.GenWfMissingRequisites
 
@@ -687,14 +733,35 @@ class Subject:
                     dependency_manager=self.dependency_manager,
                     subject_input_state_list=self.input_state_list,
                 )
+                self.workflow_manifest = WorkflowManifest.create(
+                    self.workflow,
+                    self.global_config,
+                    self.config,
+                    self.dependency_manager,
+                    self.input_state_list,
+                )
             except:
                 traceback.print_exc()
+                self.workflow = None
                 # TODO: generiamo un file crash nella cartella log?
                 return SubjectRet.GenWfError
 
-        graph_dir = self.graph_dir()
-        shutil.rmtree(graph_dir, ignore_errors=True)
-        os.mkdir(graph_dir)
+            # Comparison with the signatures of the previous execution, if any
+            self.workflow_diff = None
+            old_manifest = WorkflowManifest.load(self.workflow_dir())
+            if old_manifest is not None and old_manifest.nodes is not None:
+                old_signatures = old_manifest.nodes
+            else:
+                # Executions before the workflow manifest
+                old_signatures = WorkflowDiff.load(self.workflow_dir())
+            if old_signatures is not None:
+                try:
+                    self.workflow_diff = WorkflowDiff(old_signatures, self.workflow)
+                except:
+                    traceback.print_exc()
+
+        # Graphs are kept between generations, unchanged ones are not drawn again
+        os.makedirs(self.graph_dir(), exist_ok=True)
 
         interfaces = self.workflow.get_interface_array()
         reference_file = os.path.join(self.folder, "references.txt")
@@ -712,21 +779,30 @@ class Subject:
 
         # Graphviz analysis graphs drawing
         node_list = self.workflow.get_node_array()
-        if generate_graphs:
+        graph_files = []
+        for node in node_list.keys():
+            if len(node_list[node].node_list.keys()) > 0:
+                graph_files.extend(
+                    GraphRenderPool.related_files(
+                        self.graph_file(node_list[node].long_name)
+                    )
+                )
+        # Remove graphs of the sub-workflows no longer generated
+        for file_name in os.listdir(self.graph_dir()):
+            file_path = os.path.join(self.graph_dir(), file_name)
+            if file_path not in graph_files:
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path, ignore_errors=True)
+                else:
+                    os.remove(file_path)
+
+        self.graph_renders = {}
+        if generate_graphs and not self.global_config.getboolean_safe(
+            GlobalPrefCategoryList.PERFORMANCE, "graph_on_demand"
+        ):
             for node in node_list.keys():
                 if len(node_list[node].node_list.keys()) > 0:
-                    if self.dependency_manager.is_graphviz():
-                        thread = Thread(
-                            target=self.workflow.get_node(node).write_graph,
-                            kwargs={
-                                "graph2use": self.GRAPH_TYPE,
-                                "format": Subject.GRAPH_FILE_EXT,
-                                "dotfilename": os.path.join(
-                                    self.graph_file(node_list[node].long_name)
-                                ),
-                            },
-                        )
-                        thread.start()
+                    self.request_graph(node_list[node].long_name)
 
         return SubjectRet.GenWfCompleted
 
@@ -783,6 +859,8 @@ class Subject:
         -------
         The freesurfer subject directory path
         """
+        from swane.nipype_pipeline.workflows.freesurfer_workflow import FS_DIR
+
         return os.path.join(self.folder, FS_DIR)
 
     def freesurfer_dir_exists(self) -> bool:
@@ -828,6 +906,10 @@ class Subject:
         A SubjectRet code
 
         """
+        from swane.nipype_pipeline.engine.WorkflowDiff import WorkflowDiff
+        from swane.workers.WorkflowMonitorWorker import WorkflowMonitorWorker
+        from swane.workers.WorkflowProcess import WorkflowProcess
+
         # Already executing workflow
         if self.is_workflow_process_alive():
             return SubjectRet.ExecWfStatusError
@@ -838,6 +920,9 @@ class Subject:
             elif not resume:
                 self.delete_workflow_dir()
                 self.delete_result_dir()
+            elif self.workflow_diff is not None:
+                # Only the nodes affected by the changes lose their cache
+                self.workflow_diff.invalidate()
 
         # Checks for a previous workflow FreeSurfer execution
         if self.config.get_workflow_freesurfer_pref() and self.freesurfer_dir_exists():
@@ -846,6 +931,14 @@ class Subject:
             elif not resume_freesurfer:
                 self.delete_freesurfer_dir()
 
+        if self.workflow_diff is not None:
+            signatures = self.workflow_diff.new_signatures
+        else:
+            signatures = WorkflowDiff.signatures(self.workflow)
+        self.workflow_manifest.nodes = signatures
+        self.workflow_manifest.save(self.workflow_dir())
+        self.workflow_diff = None
+
         queue = Queue(maxsize=500)
 
         # Generates a Monitor Worker to receive workflows notifications
@@ -855,7 +948,9 @@ class Subject:
         QThreadPool.globalInstance().start(self.workflow_monitor_work)
 
         # Starts the workflow on a new process
-        self.workflow_process = WorkflowProcess(self.name, self.workflow, queue)
+        self.workflow_process = WorkflowProcess(
+            self.name, self.workflow_manifest.handoff_json(), queue
+        )
         self.workflow_process.start()
         return SubjectRet.ExecWfStarted
 
@@ -896,6 +991,8 @@ class Subject:
             return False
 
         self.workflow = None
+        self.workflow_diff = None
+        self.workflow_manifest = None
         return True
 
     def generate_scene(self, progress_callback: callable = None):
@@ -303,9 +303,9 @@ equivalent_command_list = {
     "ErodeImage": "MathsCommand",
     "MeanImage": "MathsCommand",
     "Threshold": "MathsCommand",
-    "ThrROI": "MathsCommand",
     "ApplyMask": "MathsCommand",
     "DeleteVolumes": "MathsCommand",
+    "FuncPreproc": "MathsCommand",
     "ImageMaths": "MathsCommand",
     "BinaryMaths": "MathsCommand",
     "UnaryMaths": "MathsCommand",
@@ -313,11 +313,18 @@ equivalent_command_list = {
     "SumMultiTracks": "MathsCommand",
     "SpatialFilter": "MathsCommand",
     "ApplyXFM": "FLIRT",
+    "BatchApplyXFM": "FLIRT",
     "CustomSliceTimer": "FEAT",
     "FeatureSpatialPrep": "AromaClassification",
     "FeatureTimeSeries": "AromaClassification",
     "FeatureFrequency": "AromaClassification",
     "FeatureSpatial": "AromaClassification",
+    "AromaFeatures": "AromaClassification",
     "SynthMorphApply": "SynthMorphReg",
+    "BatchApplyWarp": "ApplyWarp",
+    "XFibres5": "BEDPOSTX5",
+    "BedpostxSplit": "BEDPOSTX5",
+    "BedpostxMerge": "BEDPOSTX5",
+    "MultiProbTrackX2": "CustomProbTrackX2",
     "EddyCorrect": "Eddy",
 }
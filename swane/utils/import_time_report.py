@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+import time
+
+STARTUP_MODULE = "swane.ui.MainWindow"
+
+
+def parse_import_times(output: str) -> list[tuple[str, int, int]]:
+    """
+    Parses the stderr of a python -X importtime run.
+
+    Parameters
+    ----------
+    output: str
+        The importtime output
+
+    Returns
+    -------
+    A list of (module, self microseconds, cumulative microseconds), by decreasing cumulative time
+    """
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_time = int(fields[0])
+            cumulative_time = int(fields[1])
+        except ValueError:
+            # Header line
+            continue
+        import_times.append((fields[2].strip(), self_time, cumulative_time))
+    import_times.sort(key=lambda import_time: import_time[2], reverse=True)
+    return import_times
+
+
+def import_time_report(module: str = STARTUP_MODULE, top: int = 25) -> str:
+    """
+    Imports a module in a new interpreter with -X importtime and reports the slowest imports,
+    to check which modules are loaded before the main window appears.
+
+    Parameters
+    ----------
+    module: str, optional
+        The module to import. Default is the main window module
+    top: int, optional
+        The number of imports to report. Default is 25
+
+    Returns
+    -------
+    The report text
+    """
+    env = dict(os.environ)
+    # The main window module imports Qt widgets, that do not need a display to be imported
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        return "Import of %s failed:\n%s" % (module, result.stderr.strip())
+
+    import_times = parse_import_times(result.stderr)
+    lines = [
+        "Import of %s: %.2f s including interpreter startup, %d modules"
+        % (module, elapsed, len(import_times)),
+        "%12s %12s  %s" % ("self (ms)", "cumul (ms)", "module"),
+    ]
+    for name, self_time, cumulative_time in import_times[:top]:
+        lines.append(
+            "%12.1f %12.1f  %s" % (self_time / 1000, cumulative_time / 1000, name)
+        )
+    return "\n".join(lines)
@@ -1,8 +1,6 @@
-import pydicom
 import os
 from PySide6.QtCore import Signal, QObject, QRunnable
 from swane.utils.DicomTree import DicomTree
-from dicom_sequence_classifier import extract_metadata, classify_dicom
 
 
 class DicomSearchSignal(QObject):
@@ -92,6 +90,8 @@ class DicomSearchWorker(QRunnable):
             return 0
 
     def run(self):
+        import pydicom
+
         try:
             if len(self.unsorted_list) == 0:
                 self.load_dir()
@@ -210,6 +210,8 @@ class DicomSearchWorker(QRunnable):
 
         """
 
+        import pydicom
+
         for image in image_list:
             ds = pydicom.dcmread(image, force=True)
 
@@ -234,6 +236,8 @@ class DicomSearchWorker(QRunnable):
 
         """
 
+        from dicom_sequence_classifier import extract_metadata, classify_dicom
+
         meta = extract_metadata(ds)
         classification = classify_dicom(meta)
         if classification != "NOT MR":
@@ -2,6 +2,8 @@
 
 from nipype import logging as nipype_log, config
 import os
+import shutil
+import tempfile
 from psutil import virtual_memory
 import traceback
 from multiprocessing import Process, Event
@@ -13,6 +15,10 @@ from swane.nipype_pipeline.engine.MonitoredMultiProcPlugin import (
 )
 import logging as orig_log
 from swane.nipype_pipeline.MainWorkflow import MainWorkflow
+from swane.nipype_pipeline.WorkflowManifest import WorkflowManifest
+from swane.nipype_pipeline.engine.ResumeManifest import ResumeManifest
+from swane.nipype_pipeline.engine.SynthModelServer import SynthModelServer
+from swane.config.config_enums import ResumeCheck
 from multiprocessing import Queue
 
 LOG_DIR_NAME = "log"
@@ -26,7 +32,7 @@ class WorkflowProcess(Process):
         "nipype.interface",
     ]
 
-    def __init__(self, subject_name: str, workflow: MainWorkflow, queue: Queue):
+    def __init__(self, subject_name: str, manifest: str, queue: Queue):
         """
             A Process that execute a subject workflow in a thread, manage executor settings and signaling with gui.
             A process is needed to iterate and kill its subprocess if user wants to stop a workflow, a thread would not
@@ -36,15 +42,16 @@ class WorkflowProcess(Process):
         ----------
         subject_name: str
             The subject name
-        workflow: MainWorkflow
-            The workflow already generated and populated
+        manifest: str
+            The JSON WorkflowManifest of the workflow already generated, rebuilt in the process
         queue: Queue
             The subprocess queue for signal handling
 
         """
         super(WorkflowProcess, self).__init__()
         self.stop_event: Event = Event()
-        self.workflow: MainWorkflow = workflow
+        self.manifest: str = manifest
+        self.workflow: MainWorkflow = None
         self.queue: Queue = queue
         self.subject_name: str = subject_name
 
@@ -83,14 +90,46 @@ class WorkflowProcess(Process):
         # Assign to niype specified RAM
         plugin_args["memory_gb"] = self.workflow.memory_gb
 
+        if self.workflow.resume_check != ResumeCheck.NIPYPE:
+            plugin_args["resume_manifest"] = os.path.join(
+                self.workflow.base_dir, self.workflow.name, ResumeManifest.FILE_NAME
+            )
+            plugin_args["resume_strict"] = (
+                self.workflow.resume_check == ResumeCheck.STRICT
+            )
+
+        # Unix socket paths are limited to about 100 characters, subject dir may be longer
+        synth_server_dir = None
+        synth_server = None
+        if self.workflow.synth_server:
+            synth_server_dir = tempfile.mkdtemp(prefix="swane_synth_")
+            socket_path = os.path.join(synth_server_dir, "socket")
+            synth_server = SynthModelServer.start(socket_path)
+            if synth_server is not None:
+                # Inherited by the node subprocesses
+                os.environ[SynthModelServer.SOCKET_ENV] = socket_path
+
         try:
+            # The rebuilt workflow must be the one generated in the GUI
+            if not WorkflowManifest.from_json(self.manifest).matches(self.workflow):
+                raise RuntimeError("Rebuilt workflow differs from the generated one")
+
             # this is useful to generate resource monitor files in subject directory
             os.chdir(self.workflow.base_dir)
 
-            self.workflow.run(plugin=MonitoredMultiProcPlugin(plugin_args=plugin_args))
+            plugin = MonitoredMultiProcPlugin(plugin_args=plugin_args)
+            try:
+                self.workflow.run(plugin=plugin)
+            finally:
+                plugin.close_manifest()
 
         except:
             traceback.print_exc()
+        finally:
+            os.environ.pop(SynthModelServer.SOCKET_ENV, None)
+            SynthModelServer.stop(synth_server)
+            if synth_server_dir is not None:
+                shutil.rmtree(synth_server_dir, ignore_errors=True)
 
         # TODO implement nipype.utils.draw_gantt_chart.generate_gantt_chart but maybe it's bugged
 
@@ -122,6 +161,15 @@ class WorkflowProcess(Process):
         """
         The Process main code
         """
+        # The workflow is rebuilt here, only its compact manifest is passed to the process
+        try:
+            self.workflow = WorkflowManifest.from_json(self.manifest).build_workflow()
+        except:
+            traceback.print_exc()
+            self.queue.put(WorkflowReport(signal_type=WorkflowSignals.WORKFLOW_STOP))
+            self.queue.close()
+            return
+
         # log folder management
         log_dir = os.path.join(self.workflow.base_dir, LOG_DIR_NAME)
         if not os.path.exists(log_dir):